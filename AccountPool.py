@@ -0,0 +1,233 @@
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+from itertools import zip_longest
+from Metrics import metrics
+from PlaylistScheduler import ALL_PLAYLISTS
+
+
+class AccountPool:
+    """
+    Sincronizza in un solo processo più account Spotify, ognuno verso il proprio utente Navidrome
+    (sezione [[accounts]] della configurazione, vedi account_configs). Ogni account ha il proprio
+    PlaylistDownloader, con le proprie playlist, scadenze e brani salvati; indice della libreria,
+    corrispondenze, coda dei download e file scaricati sono condivisi (SharedLibrary): un brano presente
+    nelle playlist di più utenti viene cercato e scaricato una sola volta.
+    Ad ogni ciclo le playlist in scadenza degli account vengono analizzate a turno, una per account
+    (iniziando ogni volta da un account diverso), così i download partono nello stesso ordine e nessun
+    utente attende che siano finite le playlist di un altro. La scansione Navidrome dopo i download è unica.
+    """
+
+    def __init__(self, config: dict, downloaders: dict):
+        """
+        Args:
+            config (dict): La configurazione principale.
+            downloaders (dict): Nome dell'account -> PlaylistDownloader, tutti con lo stesso SharedLibrary.
+        """
+        self.config = config
+        self.logger = logging.getLogger("AccountPool")
+        self.accounts = downloaders
+        self.primary = next(iter(downloaders.values()))
+        self.shared = self.primary.shared
+        # A single event wakes the wait for every account (see wait)
+        self.wake = threading.Event()
+        for downloader in downloaders.values():
+            downloader.scheduler.wake = self.wake
+        self.stopping = threading.Event()
+        # Account that starts the next cycle
+        self.turn = 0
+
+    def sync(self):
+        """
+        Come PlaylistDownloader.sync, per tutti gli account: un ciclo parte appena una playlist
+        di uno qualsiasi degli account è in scadenza o richiesta. Termina dopo stop().
+        """
+        while not self.stopping.is_set():
+            self.distribute_requests()
+            requested = {name: downloader.scheduler.take_requests() for name, downloader in self.accounts.items()}
+            if any(self.accounts[name].scheduler.something_due(requested[name]) for name in self.accounts):
+                self.logger.info("Starting playlist download...")
+                try:
+                    self.sync_all_playlists(scheduled=True, requested=requested)
+                except Exception as e:
+                    # A failed cycle must not stop the service: the next one starts at the next due time
+                    print(f"❌ Errore durante la sincronizzazione: {e}")
+                    self.logger.error(f"Errore durante il ciclo di sincronizzazione: {e}", exc_info=True)
+                self.logger.info("Playlist download completed. Waiting for the next due playlist...")
+            if not self.stopping.is_set():
+                self.wait()
+
+    def distribute_requests(self):
+        """
+        Passa a tutti gli account le richieste di sincronizzazione registrate nello stato condiviso
+        (--sync-now senza --account).
+        """
+        for playlist in self.shared.state.pop_sync_requests():
+            for downloader in self.accounts.values():
+                with downloader.scheduler.lock:
+                    downloader.scheduler.requests.add(playlist)
+
+    def request_sync(self, playlist: str = ALL_PLAYLISTS):
+        """Chiede a tutti gli account di sincronizzare subito una playlist (nome o ID) o tutte."""
+        for downloader in self.accounts.values():
+            downloader.scheduler.request_sync(playlist)
+
+    def wait(self):
+        """Attende la prima scadenza tra tutti gli account, una richiesta di sincronizzazione o al massimo tick secondi."""
+        now = time.time()
+        timeout = min(downloader.scheduler.tick for downloader in self.accounts.values())
+        for downloader in self.accounts.values():
+            if downloader.scheduler.next_wake is not None:
+                timeout = min(timeout, max(0.0, downloader.scheduler.next_wake - now))
+        if self.wake.wait(timeout):
+            self.wake.clear()
+
+    def sync_all_playlists(self, scheduled: bool = False, requested: dict = None):
+        """
+        Esegue un ciclo di sincronizzazione per tutti gli account.
+        Args:
+            scheduled (bool): Vedi PlaylistDownloader.sync_all_playlists.
+            requested (dict): Nome dell'account -> playlist richieste esplicitamente.
+        """
+        requested = requested or {}
+        with ExitStack() as stack:
+            for downloader in self.accounts.values():
+                stack.enter_context(downloader.sync_lock)
+            try:
+                self.run_cycle(scheduled, requested)
+            finally:
+                for downloader in self.accounts.values():
+                    downloader.progress.update(state="idle", playlist=None, last_cycle_finished_at=time.time())
+
+    def run_cycle(self, scheduled: bool, requested: dict):
+        """Corpo di sync_all_playlists, eseguito con il sync_lock di ogni account acquisito."""
+        started = time.time()
+        before = metrics.snapshot()
+        # The download queue is shared: resumed once, its playlists are forced in every account
+        resumed = self.primary.resume_downloads()
+        cycles = {}
+        for name, downloader in self.accounts.items():
+            if scheduled and not resumed and not downloader.scheduler.something_due(requested.get(name, ())):
+                # Nothing due for this account: its playlists are not even read
+                continue
+            try:
+                cycles[name] = downloader.start_cycle(scheduled, requested.get(name, frozenset()), resumed)
+            except Exception as e:
+                # An account that cannot be read (e.g. expired token) must not stop the others
+                print(f"❌ Errore nella lettura delle playlist dell'account '{name}': {e}")
+                self.logger.error(f"Errore nella lettura delle playlist dell'account {name}: {e}", exc_info=True)
+        # Tracks resolved for one account are resolved for all: the library is the same
+        cycle_matches = {}
+        synced = {name: [] for name in cycles}
+        try:
+            for downloader in self.accounts.values():
+                downloader.cycle_matches = cycle_matches
+            for name, playlist in self.interleave(cycles):
+                downloader = self.accounts[name]
+                if downloader.cancel_event.is_set():
+                    continue
+                cycle = cycles[name]
+                playlist_status = downloader.sync_selected_playlist(playlist, cycle["selected"], cycle["excluded"],
+                                                                    cycle["forced"])
+                if playlist_status:
+                    synced[name].append((playlist, playlist_status))
+            self.link_accounts(synced)
+        finally:
+            for downloader in self.accounts.values():
+                downloader.navidrome_playlists = None
+                downloader.cycle_matches = None
+        statuses = []
+        for name, cycle in cycles.items():
+            statuses.extend(self.accounts[name].finish_cycle(cycle, synced[name], scheduled))
+        self.primary.report_cycle(started, before, statuses)
+
+    def interleave(self, cycles: dict) -> list:
+        """
+        Ordina le playlist da analizzare alternando gli account: la prima playlist di ogni account, poi
+        la seconda e così via, mantenendo l'ordine di priorità di ciascuno. Il primo account cambia ad ogni ciclo.
+        Args:
+            cycles (dict): Nome dell'account -> ciclo restituito da PlaylistDownloader.start_cycle.
+        Returns:
+            list: Tuple (nome dell'account, playlist Spotify).
+        """
+        names = list(cycles)
+        if names:
+            start = self.turn % len(names)
+            names = names[start:] + names[:start]
+            self.turn += 1
+        queues = [[(name, playlist) for playlist in cycles[name]["playlists"]] for name in names]
+        return [item for row in zip_longest(*queues) for item in row if item is not None]
+
+    def link_accounts(self, synced: dict):
+        """
+        Attende i download di tutti gli account (un brano richiesto da più utenti è scaricato una volta),
+        cerca i brani scaricati dopo un'unica scansione e li collega alle playlist di ogni account.
+        Args:
+            synced (dict): Nome dell'account -> tuple (playlist Spotify, stato della sincronizzazione).
+        """
+        every_playlist = [item for items in synced.values() for item in items]
+        for downloader in self.accounts.values():
+            downloader.progress.update(state="download", playlist=None)
+        with metrics.timer("sync_phase_seconds", phase="download"):
+            self.primary.download_songs(every_playlist)
+        for downloader in self.accounts.values():
+            downloader.progress["state"] = "link"
+        linked = {} if self.stopping.is_set() else self.primary.find_downloaded_songs(every_playlist)
+        for name, items in synced.items():
+            try:
+                self.accounts[name].link_downloaded_songs(items, linked)
+            except Exception as e:
+                print(f"❌ Errore nel collegamento dei brani scaricati dell'account '{name}': {e}")
+                self.logger.error(f"Errore nel collegamento dei brani scaricati dell'account {name}: {e}",
+                                  exc_info=True)
+
+    def cancel(self) -> dict:
+        """Interrompe il ciclo in corso di tutti gli account (vedi PlaylistDownloader.cancel)."""
+        results = [downloader.cancel() for downloader in self.accounts.values()]
+        return {"running": any(result["running"] for result in results),
+                "cancelled_downloads": sum(result["cancelled_downloads"] for result in results)}
+
+    def stop(self):
+        """Arresto ordinato di tutti gli account (vedi PlaylistDownloader.stop)."""
+        self.stopping.set()
+        for downloader in self.accounts.values():
+            downloader.stop()
+
+def account_configs(config: dict) -> dict:
+    """
+    Configurazione di ogni account della sezione [[accounts]]. Le sottosezioni di un account (spotify,
+    navidrome, download, ...) completano quelle principali: di solito l'account indica solo il proprio utente
+    Navidrome (username, password) e le playlist da sincronizzare. Ogni account ha un proprio stato
+    (state_db, predefinito state-<nome>.db accanto a quello principale, che resta condiviso) e una propria
+    cache del token OAuth di Spotify (cache_path, predefinita .cache-<nome> nella stessa cartella).
+    Args:
+        config (dict): La configurazione principale.
+    Returns:
+        dict: Nome dell'account -> configurazione, vuoto se non ci sono account.
+    Raises:
+        ValueError: Se due account hanno lo stesso nome o usano un altro server Navidrome.
+    """
+    accounts = {}
+    shared_state = config['config'].get("state_db", os.path.join('Config', 'state.db'))
+    directory = os.path.dirname(shared_state)
+    for index, account in enumerate(config.get("accounts", [])):
+        name = account.get("name") or f"account{index + 1}"
+        if name in accounts:
+            raise ValueError(f"Nome dell'account ripetuto: {name}")
+        merged = {section: dict(values) for section, values in config.items()
+                  if section != "accounts" and isinstance(values, dict)}
+        for section, values in account.items():
+            if isinstance(values, dict):
+                merged[section] = {**merged.get(section, {}), **values}
+        if merged['navidrome'].get("url") != config['navidrome'].get("url"):
+            # The library index and the downloads are shared: a single Navidrome server
+            raise ValueError(f"L'account {name} deve usare il server Navidrome della sezione [navidrome]")
+        merged['config']["account"] = name
+        merged['config']["state_db"] = account.get("config", {}).get(
+            "state_db", os.path.join(directory, f"state-{name}.db"))
+        merged['spotify']["cache_path"] = account.get("spotify", {}).get(
+            "cache_path", os.path.join(directory, f".cache-{name}"))
+        accounts[name] = merged
+    return accounts
@@ -0,0 +1,195 @@
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from LikedSongs import LIKED_SONGS_ID
+from PlaylistScheduler import ALL_PLAYLISTS
+
+
+class ControlServer:
+    """
+    API HTTP locale per controllare il servizio in esecuzione (modalità --daemon). Usa i client, le cache
+    e lo scheduler già inizializzati del PlaylistDownloader, quindi una sincronizzazione richiesta
+    da qui parte subito senza il costo di un nuovo avvio.
+
+    Endpoint:
+        GET  /playlists              Playlist Spotify con stato della sincronizzazione (?refresh=1 per rileggerle)
+        POST /playlists/<id>/sync    Sincronizza subito una playlist (ID o nome Spotify)
+        POST /sync                   Sincronizza subito tutte le playlist selezionate
+        GET  /progress               Avanzamento del ciclo in corso e dei download
+        GET  /queue                  Download in coda o in corso
+        POST /cancel                 Interrompe il ciclo in corso e annulla i download in coda
+
+    Con più account (vedi AccountPool) playlist e sincronizzazioni si riferiscono all'account indicato
+    con ?account=<nome>; senza, /playlists mostra il primo account e le sincronizzazioni riguardano tutti.
+    """
+
+    def __init__(self, downloader, options: dict, pool=None):
+        """
+        Args:
+            downloader (PlaylistDownloader): Il downloader del servizio (il primo account, con più account).
+            options (dict): Sezione [control] della configurazione: host (predefinito 127.0.0.1), port
+                (predefinita 8787) e token (se presente, richiesto come "Authorization: Bearer <token>").
+            pool (AccountPool, opzionale): Gli account, se più di uno.
+        """
+        self.logger = logging.getLogger("ControlServer")
+        self.downloader = downloader
+        self.pool = pool
+        self.token = options.get("token")
+        self.httpd = ThreadingHTTPServer((options.get("host", "127.0.0.1"), options.get("port", 8787)),
+                                         self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="control", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        host, port = self.httpd.server_address[:2]
+        self.logger.info(f"API di controllo disponibile su http://{host}:{port}/")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def account(self, name: str|None):
+        """Il downloader dell'account indicato (quello del servizio se non indicato), None se non esiste."""
+        if not name:
+            return self.downloader
+        return self.pool.accounts.get(name) if self.pool else None
+
+    def downloaders(self, name: str|None) -> list:
+        """I downloader a cui si riferisce una richiesta: l'account indicato o, se non indicato, tutti."""
+        if name or not self.pool:
+            downloader = self.account(name)
+            return [downloader] if downloader else []
+        return list(self.pool.accounts.values())
+
+    def playlists(self, refresh: bool = False, account: str = None) -> tuple:
+        """Playlist Spotify (quelle lette dall'ultimo ciclo, se disponibili) con il loro stato."""
+        downloader = self.account(account)
+        if not downloader:
+            return 404, {"error": f"Account non trovato: {account}"}
+        playlists = downloader.last_playlists
+        if refresh or not playlists:
+            playlists = downloader.last_playlists = downloader.list_spotify_playlists()
+        selected = downloader.config["download"].get("selected_playlists", [])
+        excluded = downloader.config["download"].get("excluded_playlists", [])
+        result = []
+        for playlist in playlists:
+            stored = downloader.state.get_playlist_state(playlist['id'])
+            result.append({
+                "id": playlist['id'],
+                "name": playlist['name'],
+                "tracks_total": playlist.get('tracks_total'),
+                "selected": (selected is True or playlist['name'] in selected or playlist['id'] == LIKED_SONGS_ID)
+                            and playlist['name'] not in excluded,
+                "navidrome_id": stored.get('navidrome_id'),
+                "pending": stored.get('pending', 0),
+                "synced_at": stored.get('synced_at'),
+                "changed_at": stored.get('changed_at'),
+                "next_due": stored.get('next_due'),
+                "retry_at": stored.get('retry_at'),
+            })
+        return 200, result
+
+    @staticmethod
+    def find_playlist(downloader, key: str) -> dict|None:
+        """Cerca una playlist per ID o nome tra quelle note dell'account."""
+        for playlist in downloader.last_playlists:
+            if key in (playlist['id'], playlist['name']):
+                return playlist
+        return None
+
+    def request_sync(self, key: str, account: str = None) -> tuple:
+        """Chiede la sincronizzazione immediata di una playlist; restituisce (stato HTTP, risposta)."""
+        downloaders = self.downloaders(account)
+        if not downloaders:
+            return 404, {"error": f"Account non trovato: {account}"}
+        if key != ALL_PLAYLISTS:
+            # Accounts whose playlists are not known yet are asked anyway
+            downloaders = [downloader for downloader in downloaders
+                           if not downloader.last_playlists or self.find_playlist(downloader, key)]
+            if not downloaders:
+                return 404, {"error": f"Playlist non trovata: {key}"}
+        for downloader in downloaders:
+            downloader.scheduler.request_sync(key)
+        self.logger.info(f"Sincronizzazione richiesta via API: {key}")
+        return 202, {"requested": key}
+
+    def progress(self) -> dict:
+        downloader = self.downloader
+        with downloader.download_scheduler.lock:
+            downloads = dict(downloader.download_scheduler.progress)
+        progress = {"cycle": dict(downloader.progress), "downloads": downloads}
+        if self.pool:
+            progress["accounts"] = {name: dict(account.progress) for name, account in self.pool.accounts.items()}
+        return progress
+
+    def cancel(self) -> dict:
+        return (self.pool or self.downloader).cancel()
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if not self.authorized():
+                    return
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                account = query.get("account", [None])[0]
+                if url.path == "/playlists":
+                    self.run(lambda: server.playlists(query.get("refresh", ["0"])[0] not in ("0", ""), account))
+                elif url.path == "/progress":
+                    self.run(lambda: (200, server.progress()))
+                elif url.path == "/queue":
+                    self.run(lambda: (200, server.downloader.download_scheduler.queue()))
+                else:
+                    self.respond(404, {"error": "Not found"})
+
+            def do_POST(self):
+                if not self.authorized():
+                    return
+                url = urlsplit(self.path)
+                parts = [unquote(part) for part in url.path.strip("/").split("/")]
+                account = parse_qs(url.query).get("account", [None])[0]
+                if parts == ["sync"]:
+                    self.run(lambda: server.request_sync(ALL_PLAYLISTS, account))
+                elif len(parts) == 3 and parts[0] == "playlists" and parts[2] == "sync":
+                    self.run(lambda: server.request_sync(parts[1], account))
+                elif parts == ["cancel"]:
+                    self.run(lambda: (200, server.cancel()))
+                else:
+                    self.respond(404, {"error": "Not found"})
+
+            def authorized(self) -> bool:
+                if not server.token:
+                    return True
+                header = self.headers.get("Authorization", "")
+                if hmac.compare_digest(header.encode(), f"Bearer {server.token}".encode()):
+                    return True
+                self.respond(401, {"error": "Unauthorized"})
+                return False
+
+            def run(self, action):
+                try:
+                    status, body = action()
+                except Exception as e:
+                    server.logger.error(f"Errore nella richiesta {self.command} {self.path}: {e}", exc_info=True)
+                    status, body = 500, {"error": str(e)}
+                self.respond(status, body)
+
+            def respond(self, status, body):
+                data = json.dumps(body, indent=2).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
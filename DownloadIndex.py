@@ -0,0 +1,159 @@
+import logging
+import os
+import re
+import threading
+import time
+
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".flac", ".ogg", ".opus", ".wav")
+# spotdl saves the Spotify URL of the track in the tags (WOAS, "url" or "----:spotdl:WOAS")
+SPOTIFY_TRACK_URL = re.compile(r"open\.spotify\.com/track/([A-Za-z0-9]+)")
+
+
+class DownloadIndex:
+    """
+    Indice dei file audio già presenti nella cartella dei download, per ID Spotify e ISRC letti dai tag.
+    Serve a non scaricare di nuovo un brano che è già su disco ma non ancora in Navidrome (scansione non
+    ancora eseguita) o che è stato scaricato nella cartella di un'altra playlist.
+    L'indice è salvato nello StateStore: ad ogni aggiornamento vengono riletti solo i file nuovi o
+    cambiati (inode, dimensione o mtime diversi).
+    """
+
+    def __init__(self, config: dict, state):
+        self.logger = logging.getLogger("DownloadIndex")
+        self.root = os.path.abspath(config['download']["path"])
+        self.state = state
+        # Minuti di validità dell'indice prima di una nuova lettura della cartella
+        self.ttl = config['download'].get("local_index_ttl", 5) * 60
+        self.lock = threading.Lock()
+        # path -> {'inode', 'size', 'mtime', 'spotify_id', 'isrc'}, loaded from the state on the first refresh
+        self.files = None
+        self.by_id = {}
+        self.by_isrc = {}
+        # Files added by the download threads while refresh walks the folder: path -> entry (None = no walk)
+        self.added = None
+        self.refreshed_at = None
+        self.tags_warning = False
+
+    def refresh(self, force: bool = False):
+        """Aggiorna l'indice se scaduto (o se forzato), rileggendo i tag dei soli file cambiati."""
+        if not force and self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.ttl:
+            return
+        started = time.monotonic()
+        with self.lock:
+            files = dict(self.files) if self.files is not None else self.state.list_local_files()
+            self.added = {}
+        changed = []
+        seen = set()
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.lower().endswith(AUDIO_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                known = files.get(path)
+                if known and (known['inode'], known['size'], known['mtime']) == (stat.st_ino, stat.st_size, stat.st_mtime):
+                    continue
+                entry = {'inode': stat.st_ino, 'size': stat.st_size, 'mtime': stat.st_mtime, **self.read_tags(path)}
+                files[path] = entry
+                changed.append((path, entry))
+        removed = [path for path in files if path not in seen]
+        for path in removed:
+            del files[path]
+        with self.lock:
+            # Downloads finished during the walk: the walk may have missed them or read them half written
+            added, self.added = self.added, None
+            files.update(added)
+            by_id, by_isrc = {}, {}
+            for path, entry in files.items():
+                if entry['spotify_id']:
+                    by_id[entry['spotify_id']] = path
+                if entry['isrc']:
+                    by_isrc[entry['isrc']] = path
+            self.files, self.by_id, self.by_isrc = files, by_id, by_isrc
+        self.state.save_local_files([(path, entry) for path, entry in changed if path not in added]
+                                    + list(added.items()))
+        self.state.remove_local_files([path for path in removed if path not in added])
+        self.refreshed_at = time.monotonic()
+        self.logger.info(f"Indicizzati {len(files)} file scaricati in {self.refreshed_at - started:.2f}s "
+                         f"({len(changed)} nuovi o cambiati, {len(removed)} rimossi)")
+
+    def find(self, spotify_song: dict) -> str|None:
+        """
+        Cerca un file già scaricato per una traccia Spotify (per ID Spotify o, in mancanza, per ISRC).
+        Returns:
+            str|None: Il percorso del file, None se il brano non è su disco.
+        """
+        with self.lock:
+            path = self.by_id.get(spotify_song['id'])
+            if path is None and spotify_song.get('isrc'):
+                path = self.by_isrc.get(spotify_song['isrc'])
+        if path and os.path.isfile(path):
+            return path
+        return None
+
+    def add(self, path: str, spotify_song: dict):
+        """Aggiunge all'indice un file appena scaricato, senza rileggerne i tag."""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        entry = {'inode': stat.st_ino, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                 'spotify_id': spotify_song['id'], 'isrc': spotify_song.get('isrc') or None}
+        with self.lock:
+            if self.files is not None:
+                self.files[path] = entry
+            if self.added is not None:
+                # Replayed by the refresh in progress (see refresh)
+                self.added[path] = entry
+            self.by_id[spotify_song['id']] = path
+            if entry['isrc']:
+                self.by_isrc[entry['isrc']] = path
+        self.state.save_local_files([(path, entry)])
+
+    def read_tags(self, path: str) -> dict:
+        """
+        Legge ID Spotify e ISRC dai tag di un file audio.
+        Returns:
+            dict: 'spotify_id' e 'isrc' (None se assenti o illeggibili).
+        """
+        tags = {'spotify_id': None, 'isrc': None}
+        try:
+            # mutagen is installed with spotdl
+            import mutagen
+        except ImportError:
+            if not self.tags_warning:
+                self.tags_warning = True
+                self.logger.warning("mutagen non disponibile: i file scaricati da altri programmi non saranno riconosciuti.")
+            return tags
+        try:
+            audio = mutagen.File(path)
+        except Exception as e:
+            self.logger.debug(f"Tag non leggibili in {path}: {e}")
+            return tags
+        if audio is None or not audio.tags:
+            return tags
+        for key, value in audio.tags.items():
+            text = tag_text(value)
+            match = SPOTIFY_TRACK_URL.search(text)
+            if match and not tags['spotify_id']:
+                tags['spotify_id'] = match.group(1)
+            if "isrc" in key.lower() or key.upper().startswith("TSRC"):
+                tags['isrc'] = text.strip().upper() or None
+        return tags
+
+
+def tag_text(value) -> str:
+    """Testo di un valore di tag mutagen (frame ID3, lista di stringhe o di byte)."""
+    if isinstance(value, (list, tuple)):
+        return " ".join(tag_text(item) for item in value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="ignore")
+    url = getattr(value, "url", None)
+    if url:
+        return url
+    return str(value)
@@ -0,0 +1,221 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from Metrics import metrics
+from Spotify import DownloaderUnavailable
+
+
+class DownloadScheduler:
+    """
+    Scarica i brani mancanti con più worker in parallelo, ognuno verso la propria cartella di destinazione.
+    Se è indicato uno StateStore, ogni brano è salvato in una coda persistente con il suo stato
+    (pending, searching, downloading, done, failed) e il risultato della ricerca spotdl, così che dopo
+    un riavvio i download interrotti riprendano da dove si erano fermati (vedi resume).
+    """
+
+    def __init__(self, config: dict, spotify_client, state=None):
+        self.config = config
+        self.logger = logging.getLogger("DownloadScheduler")
+        self.spotify_client = spotify_client
+        self.state = state
+        self.workers = max(1, config['download'].get("workers", 2))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+        self.lock = threading.Lock()
+        self.progress = {'done': 0, 'total': 0}
+        # Jobs not finished yet: id(result) -> (future, result), 'state' of the result is the state in the queue
+        self.jobs = {}
+        # Set by close(): new downloads stay in the persistent queue without starting
+        self.closed = False
+
+    def submit(self, track: dict, destination: str, on_result=None, playlist_id: str = None) -> Future:
+        """
+        Pianifica il download di un brano, che parte appena un worker è libero.
+        Args:
+            track (dict): La traccia Spotify da scaricare.
+            destination (str): La cartella di destinazione.
+            on_result (callable, opzionale): Funzione chiamata (dal worker) con il risultato del brano.
+            playlist_id (str, opzionale): La playlist Spotify che attende il brano (salvata nella coda).
+        Returns:
+            Future: Il risultato del brano, un dizionario con le chiavi:
+                - 'track': La traccia Spotify richiesta
+                - 'destination': La cartella di destinazione
+                - 'outcome': 'downloaded', 'failed', 'not_found' oppure 'unavailable' (spotdl non utilizzabile)
+                - 'path': Il percorso del file scaricato (None se non scaricato)
+                - 'detail': Descrizione dell'eventuale errore
+        """
+        if self.state:
+            self.state.enqueue_download(track, destination, playlist_id)
+        return self.start(new_result(track, destination), on_result)
+
+    def start(self, result: dict, on_result) -> Future:
+        """Affida un brano ai worker (o lo lascia nella coda persistente, dopo close)."""
+        with self.lock:
+            if self.closed:
+                future = Future()
+                future.cancel()
+                return future
+            self.progress['total'] += 1
+            future = self.executor.submit(self.run_job, result, on_result)
+            self.jobs[id(result)] = (future, result)
+        return future
+
+    def add_playlist(self, track: dict, playlist_id: str):
+        """Registra nella coda persistente un'altra playlist che attende un brano già pianificato."""
+        if self.state:
+            self.state.add_download_playlist(track['id'], playlist_id)
+
+    def resume(self, on_result=None) -> list:
+        """
+        Riprende i download rimasti nella coda persistente da un'esecuzione precedente: quelli non terminati
+        vengono pianificati di nuovo (senza ripetere la ricerca spotdl, se già fatta), quelli terminati
+        ma non ancora collegati alle playlist vengono restituiti come già completati.
+        Args:
+            on_result (callable, opzionale): Funzione chiamata con il risultato di ogni brano ripreso.
+        Returns:
+            list: Tuple (traccia Spotify, ID delle playlist che la attendono, Future del risultato).
+        """
+        if not self.state:
+            return []
+        resumed = []
+        for item in self.state.list_download_queue(("pending", "searching", "downloading", "done")):
+            result = new_result(item['track'], item['destination'], item['song'])
+            if item['state'] == "done":
+                result.update(outcome='downloaded', path=item['path'], state='done')
+                future = Future()
+                future.set_result(result)
+            else:
+                future = self.start(result, on_result)
+            resumed.append((item['track'], item['playlists'], future))
+        if resumed:
+            self.logger.info(f"Ripresi {len(resumed)} download dalla coda persistente.")
+        return resumed
+
+    def queue(self) -> list:
+        """
+        Restituisce i download non ancora terminati, nell'ordine di arrivo.
+        Returns:
+            list: Dizionari con 'id', 'search_string', 'destination' e 'state' ('pending', 'searching' o 'downloading').
+        """
+        with self.lock:
+            return [{'id': result['track']['id'], 'search_string': result['track']['search_string'],
+                     'destination': result['destination'], 'state': result['state']}
+                    for _, result in self.jobs.values()]
+
+    def cancel_pending(self, forget: bool = False) -> int:
+        """
+        Annulla i download in coda non ancora iniziati (quelli in corso vengono completati).
+        Args:
+            forget (bool): Se True li toglie anche dalla coda persistente; altrimenti riprenderanno al prossimo avvio.
+        Returns:
+            int: Numero di download annullati.
+        """
+        cancelled = []
+        with self.lock:
+            for key, (future, result) in list(self.jobs.items()):
+                if future.cancel():
+                    del self.jobs[key]
+                    self.progress['total'] -= 1
+                    cancelled.append(result['track']['id'])
+        if forget and self.state:
+            self.state.remove_downloads(cancelled)
+        if cancelled:
+            self.logger.info(f"Annullati {len(cancelled)} download in coda.")
+        return len(cancelled)
+
+    def close(self) -> int:
+        """
+        Arresto ordinato: i download in corso vengono completati, quelli in coda (e quelli pianificati
+        da ora in poi) restano nella coda persistente per il prossimo avvio.
+        Returns:
+            int: Numero di download rimandati.
+        """
+        with self.lock:
+            self.closed = True
+        return self.cancel_pending()
+
+    def run_job(self, result: dict, on_result) -> dict:
+        """Cerca e scarica un singolo brano (eseguito in un worker)."""
+        with metrics.timer("download_seconds"):
+            self.search_and_download(result)
+        self.report(result, on_result)
+        return result
+
+    def checkpoint(self, result: dict, state: str, **fields):
+        """Aggiorna lo stato del brano, anche nella coda persistente."""
+        result['state'] = state
+        if self.state:
+            self.state.update_download(result['track']['id'], state, **fields)
+
+    def search_and_download(self, result: dict):
+        """Cerca il brano con spotdl (se non già trovato prima di un riavvio) e, se trovato, lo scarica."""
+        try:
+            songs = self.find_song(result)
+        except DownloaderUnavailable as e:
+            songs = []
+            result['outcome'] = 'unavailable'
+            result['detail'] = f"spotdl non disponibile: {e}"
+        except Exception as e:
+            songs = []
+            result['detail'] = f"Errore nella ricerca spotdl: {e}"
+        if songs:
+            self.checkpoint(result, 'downloading', song=getattr(songs[0], "json", None))
+            self.download_one(songs[0], result)
+        elif not result['detail']:
+            result['detail'] = "Brano non trovato da spotdl"
+
+    def find_song(self, result: dict) -> list:
+        """Restituisce il brano spotdl salvato nella coda o, in mancanza, lo cerca."""
+        if result['song']:
+            try:
+                return [self.spotify_client.restore_song(result['song'])]
+            except DownloaderUnavailable:
+                raise
+            except Exception as e:
+                self.logger.warning(f"Brano salvato non valido per {result['track']['search_string']}, "
+                                    f"nuova ricerca: {e}")
+        self.checkpoint(result, 'searching')
+        return self.spotify_client.search_songs([result['track']['url']])
+
+    def download_one(self, song, result: dict):
+        """Scarica un singolo brano aggiornandone il risultato."""
+        try:
+            path = self.spotify_client.download_song(song, result['destination'])
+        except Exception as e:
+            result['outcome'] = 'failed'
+            result['detail'] = str(e)
+            print(f"❌ Errore durante il download: {e}")
+            self.logger.warning(f"Impossibile scaricare canzone - titolo: {song.name} - artista: {song.artist} [{e}]")
+            return
+        if path:
+            result['outcome'] = 'downloaded'
+            result['path'] = str(path)
+            print("✅ Download completato.")
+            self.logger.info(f"Download completed: {song.name} - artista: {song.artist}")
+        else:
+            result['outcome'] = 'failed'
+            result['detail'] = "Nessun file prodotto"
+            print(f"❌ Impossibile archiviare il file per {song.name} - {song.artist}. Download fallito.")
+            self.logger.warning(f"Impossibile scaricare canzone - titolo: {song.name} - artista: {song.artist} (Forse V.M. 18?)")
+
+    def report(self, result: dict, on_result):
+        """Aggiorna l'avanzamento e notifica il risultato di un brano."""
+        # An unusable spotdl is not a problem of the track: it stays pending for the next run
+        state = {'downloaded': 'done', 'unavailable': 'pending'}.get(result['outcome'], 'failed')
+        self.checkpoint(result, state, path=result['path'], detail=result['detail'])
+        with self.lock:
+            self.jobs.pop(id(result), None)
+            self.progress['done'] += 1
+            self.logger.debug(f"[{self.progress['done']}/{self.progress['total']}] {result['outcome']}: "
+                              f"{result['track']['search_string']}")
+        if on_result:
+            try:
+                on_result(result)
+            except Exception as e:
+                self.logger.error(f"Errore nella notifica del risultato di {result['track']['search_string']}: {e}",
+                                  exc_info=True)
+
+
+def new_result(track: dict, destination: str, song: dict = None) -> dict:
+    """Risultato iniziale del download di un brano (vedi DownloadScheduler.submit)."""
+    return {'track': track, 'destination': destination, 'outcome': 'not_found', 'path': None, 'detail': '',
+            'state': 'pending', 'song': song}
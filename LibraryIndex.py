@@ -0,0 +1,79 @@
+import logging
+import time
+from SongMatcher import blocking_key
+
+
+class LibraryIndex:
+    """
+    Indice in memoria dell'intera libreria Navidrome, per ISRC e per titolo normalizzato (vedi blocking_key):
+    i candidati con lo stesso titolo vengono poi valutati da SongMatcher.
+    """
+
+    def __init__(self, config: dict, navidrome_client):
+        self.config = config
+        self.logger = logging.getLogger("LibraryIndex")
+        self.navidrome_client = navidrome_client
+        self.page_size = config['navidrome'].get("library_page_size", 500)
+        # Minuti di validità dell'indice prima di una nuova scansione completa
+        self.ttl = config['navidrome'].get("library_index_ttl", 10) * 60
+        self.by_isrc = {}
+        self.by_title = {}
+        self.by_id = {}
+        self.built_at = None
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Ricostruisce l'indice se scaduto (o se forzato).
+        Returns:
+            bool: True se l'indice è utilizzabile, False se la scansione della libreria è fallita.
+        """
+        if not force and self.built_at is not None and time.monotonic() - self.built_at < self.ttl:
+            return True
+        by_isrc = {}
+        by_title = {}
+        by_id = {}
+        count = 0
+        started = time.monotonic()
+        for song in self.navidrome_client.iter_library_songs(self.page_size):
+            if song is None:
+                # Scansione interrotta da un errore: si mantiene l'indice precedente
+                self.logger.error("Scansione della libreria Navidrome interrotta, indice non aggiornato.")
+                return self.built_at is not None
+            count += 1
+            by_id[song['id']] = song
+            for isrc in song.get('isrc') or []:
+                by_isrc.setdefault(isrc, []).append(song)
+            by_title.setdefault(blocking_key(song.get('title', '')), []).append(song)
+        self.by_isrc = by_isrc
+        self.by_title = by_title
+        self.by_id = by_id
+        self.built_at = time.monotonic()
+        self.logger.info(f"Indicizzate {count} canzoni Navidrome in {self.built_at - started:.1f}s "
+                         f"({len(by_isrc)} ISRC, {len(by_title)} titoli)")
+        return True
+
+    def lookup(self, spotify_song: dict) -> list:
+        """
+        Cerca i candidati per una traccia Spotify senza interrogare Navidrome.
+        Args:
+            spotify_song (dict): Dizionario della traccia Spotify ('isrc', 'artist', 'name').
+        Returns:
+            list: Canzoni Navidrome con lo stesso ISRC o, in mancanza, con lo stesso titolo normalizzato.
+        """
+        isrc = spotify_song.get('isrc')
+        if isrc and isrc in self.by_isrc:
+            return self.by_isrc[isrc]
+        return self.by_title.get(blocking_key(spotify_song.get('name', '')), [])
+
+    def add(self, song: dict):
+        """Aggiunge all'indice una canzone comparsa nella libreria dopo l'ultima scansione completa."""
+        if song['id'] in self.by_id:
+            return
+        self.by_id[song['id']] = song
+        for isrc in song.get('isrc') or []:
+            self.by_isrc.setdefault(isrc, []).append(song)
+        self.by_title.setdefault(blocking_key(song.get('title', '')), []).append(song)
+
+    def get(self, song_id: str) -> dict:
+        """Restituisce la canzone Navidrome con l'ID indicato ({} se non è nella libreria)."""
+        return self.by_id.get(song_id, {})
@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import math
+import threading
+from Metrics import metrics
+
+# ID of the virtual playlist: Spotify playlist IDs are 22 base62 characters
+LIKED_SONGS_ID = "liked_songs"
+
+
+class LikedSongs:
+    """
+    I brani salvati su Spotify ("Brani che ti piacciono") come playlist virtuale, sincronizzata come le altre.
+    La lista può contenere decine di migliaia di brani, quindi ne viene tenuta una copia nello StateStore
+    e ad ogni ciclo si leggono da Spotify solo:
+        - i brani aggiunti dopo l'ultimo letto (il feed è ordinato per added_at, dal più recente);
+        - se il totale è diminuito più del previsto, le poche posizioni necessarie a trovare, per bisezione,
+          i brani tolti (quando costerebbe meno, l'intera lista viene riletta).
+    Richiede il permesso Spotify user-library-read: attivare download.liked_songs richiede una nuova
+    autorizzazione OAuth (vedi Spotify.authenticate).
+    """
+
+    def __init__(self, config: dict, spotify_client, state):
+        self.logger = logging.getLogger("LikedSongs")
+        self.spotify_client = spotify_client
+        self.state = state
+        # Name of the Navidrome playlist (and of the download folder)
+        self.name = config['download'].get("liked_songs_name", "Liked Songs")
+        # Maximum page size of the saved tracks endpoint
+        self.page_size = 50
+        self.lock = threading.Lock()
+        # (added_at, track) from the most recent, as saved in the state (loaded on the first refresh)
+        self.tracks = None
+        # The list read by the last refresh, synchronized by iter_pages (not saved in a dry run)
+        self.current = None
+
+    def playlist(self, persist: bool = True) -> dict:
+        """
+        Aggiorna la copia locale e restituisce la playlist virtuale, nel formato di Spotify.list_user_playlists.
+        Lo snapshot_id è calcolato dagli ID dei brani: cambia solo se la lista cambia.
+        Args:
+            persist (bool): False in un dry run (vedi PlaylistDownloader.plan_cycle): la lista letta non viene
+                salvata, così il ciclo successivo trova ancora le differenze.
+        """
+        with self.lock:
+            with metrics.timer("sync_phase_seconds", phase="liked_songs"):
+                self.current = self.refresh(persist)
+            ids = "\n".join(track['id'] for _, track in self.current)
+        return {
+            'name': self.name,
+            'id': LIKED_SONGS_ID,
+            'tracks_total': len(self.current),
+            'snapshot_id': hashlib.sha1(ids.encode("utf-8")).hexdigest()
+        }
+
+    def iter_pages(self, page_size: int = 100):
+        """
+        Scorre i brani salvati una pagina alla volta, come Spotify.iter_playlist_pages, dalla copia locale.
+        """
+        with self.lock:
+            tracks = [track for _, track in self.current or []]
+        for start in range(0, len(tracks), page_size):
+            yield tracks[start:start + page_size]
+
+    def refresh(self, persist: bool = True) -> list:
+        """
+        Legge i brani salvati su Spotify con il minor numero di richieste, partendo dalla copia locale.
+        Args:
+            persist (bool): Se True la lista letta diventa la copia locale e viene salvata nello StateStore.
+        Returns:
+            list: Tuple (added_at, traccia), dal brano più recente.
+        """
+        if self.tracks is None:
+            self.tracks = self.state.list_liked_tracks()
+        if not self.tracks:
+            return self.reload(persist)
+        # Watermark: the most recent track already known
+        watermark = self.tracks[0][0]
+        known = {track['id']: added_at for added_at, track in self.tracks}
+        added = []
+        offset, total = 0, None
+        while True:
+            page = self.spotify_client.saved_tracks_page(offset, self.page_size)
+            total = page['total']
+            new = [(added_at, track) for added_at, track in page['items']
+                   if added_at > watermark or (added_at == watermark and known.get(track['id']) != added_at)]
+            added.extend(new)
+            offset += len(page['items'])
+            if len(new) < len(page['items']) or not page['items'] or offset >= total:
+                break
+        # Tracks saved again move to the top
+        added_ids = {track['id'] for _, track in added}
+        tracks = added + [(added_at, track) for added_at, track in self.tracks if track['id'] not in added_ids]
+        missing = len(tracks) - total
+        if missing < 0 or (missing and missing * self.probes(len(tracks)) > math.ceil(total / self.page_size)):
+            # Inconsistent copy, or too many removals to look for one by one
+            self.logger.info(f"Brani salvati: rilettura completa ({missing} brani di differenza)")
+            return self.reload(persist)
+        removed = self.find_removed(tracks, len(added), missing) if missing else []
+        if removed is None:
+            self.logger.info("Brani salvati cambiati durante la lettura: rilettura completa")
+            return self.reload(persist)
+        if persist:
+            self.state.save_liked_tracks(added, removed)
+            self.tracks = tracks
+        if added or removed:
+            self.logger.info(f"Brani salvati: {len(added)} nuovi, {len(removed)} tolti, {len(tracks)} in totale")
+        return tracks
+
+    def reload(self, persist: bool = True) -> list:
+        """Rilegge l'intera lista dei brani salvati (vedi refresh)."""
+        tracks = []
+        offset = 0
+        while True:
+            page = self.spotify_client.saved_tracks_page(offset, self.page_size)
+            tracks.extend(page['items'])
+            offset += len(page['items'])
+            if not page['items'] or offset >= page['total']:
+                break
+        if persist:
+            self.state.save_liked_tracks(tracks, replace=True)
+            self.tracks = tracks
+        self.logger.info(f"Letti {len(tracks)} brani salvati")
+        return tracks
+
+    def probes(self, size: int) -> int:
+        """Richieste necessarie per trovare un brano tolto: bisezione fino a una pagina, poi la pagina."""
+        return max(0, math.ceil(math.log2(max(size, 1) / self.page_size))) + 1
+
+    def find_removed(self, tracks: list, start: int, count: int) -> list|None:
+        """
+        Trova i count brani tolti su Spotify e li elimina da tracks. Fino al primo brano tolto le posizioni
+        coincidono con quelle su Spotify, dopo sono spostate: la prima differenza si trova per bisezione.
+        Args:
+            tracks (list): La copia locale, già con i brani nuovi in cima.
+            start (int): Posizione da cui cercare (i brani nuovi sono sicuramente presenti).
+            count (int): Numero di brani tolti.
+        Returns:
+            list|None: Gli ID dei brani tolti, None se la lista su Spotify è cambiata durante la ricerca.
+        """
+        removed = []
+        total = len(tracks) - count
+        for _ in range(count):
+            # The first position that differs is in [low, high]: position total does not exist on Spotify
+            low, high = start, total
+            while high - low > self.page_size:
+                middle = (low + high) // 2
+                if self.remote_ids(middle, 1) == [tracks[middle][1]['id']]:
+                    low = middle + 1
+                else:
+                    high = middle
+            remote = self.remote_ids(low, high - low) if high > low else []
+            position = next((low + index for index, spotify_id in enumerate(remote)
+                             if spotify_id != tracks[low + index][1]['id']), high)
+            removed.append(tracks.pop(position)[1]['id'])
+            start = position
+        # The last track must now be the last one on Spotify
+        if total and self.remote_ids(total - 1, 1) != [tracks[-1][1]['id']]:
+            return None
+        return removed
+
+    def remote_ids(self, offset: int, limit: int) -> list:
+        page = self.spotify_client.saved_tracks_page(offset, limit)
+        return [track['id'] for _, track in page['items']]
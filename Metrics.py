@@ -0,0 +1,193 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metrics exposed in the Prometheus text format: name -> (type, description)
+DESCRIPTIONS = {
+    "sync_phase_seconds": ("histogram", "Durata delle fasi della sincronizzazione"),
+    "sync_cycles_total": ("counter", "Cicli di sincronizzazione completati"),
+    "sync_overruns_total": ("counter", "Cicli durati più del tempo a disposizione"),
+    "sync_last_duration_seconds": ("gauge", "Durata dell'ultimo ciclo di sincronizzazione"),
+    "sync_last_finished_timestamp": ("gauge", "Fine dell'ultimo ciclo di sincronizzazione (epoch)"),
+    "navidrome_request_seconds": ("histogram", "Latenza delle richieste a Navidrome per endpoint"),
+    "navidrome_requests_total": ("counter", "Richieste a Navidrome per endpoint ed esito"),
+    "spotify_request_seconds": ("histogram", "Latenza delle chiamate alla Web API di Spotify per endpoint"),
+    "spotify_requests_total": ("counter", "Chiamate alla Web API di Spotify per endpoint ed esito"),
+    "request_retries_total": ("counter", "Richieste ripetute per errori transitori, per servizio"),
+    "circuit_open_total": ("counter", "Aperture del circuit breaker, per servizio"),
+    "match_total": ("counter", "Esito della risoluzione dei brani Spotify (metodo o miss)"),
+    "match_rejected_total": ("counter", "Brani con candidati Navidrome tutti scartati dal confronto di titolo, artisti e durata"),
+    "downloads_total": ("counter", "Download per esito"),
+    "download_seconds": ("histogram", "Durata di ricerca e download di un brano"),
+    "download_bytes_total": ("counter", "Byte scritti dai download"),
+}
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+
+class Metrics:
+    """
+    Registro delle metriche (contatori, gauge e istogrammi con etichette), condiviso da tutti i thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # (name, labels) -> [bucket counts..., count, sum]
+        self.histograms = {}
+        # JSON summary of the last synchronization cycle
+        self.last_summary = None
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Incrementa un contatore."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        """Imposta il valore di una gauge."""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """Registra un valore (ad esempio una durata in secondi) in un istogramma."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for index, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    def timed(self, iterable, name: str, **labels):
+        """Restituisce gli elementi di iterable registrando in name il tempo necessario a produrre ciascuno."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.observe(name, time.perf_counter() - started, **labels)
+            yield item
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Misura la durata del blocco nell'istogramma name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> dict:
+        """
+        Valori correnti di contatori e istogrammi (conteggio e somma), per calcolare le differenze di un ciclo.
+        Returns:
+            dict: Chiave "nome{etichette}" -> valore (i contatori degli istogrammi come _count e _sum).
+        """
+        with self.lock:
+            values = {format_key(name, labels): value for (name, labels), value in self.counters.items()}
+            for (name, labels), histogram in self.histograms.items():
+                values[format_key(f"{name}_count", labels)] = histogram[-2]
+                values[format_key(f"{name}_sum", labels)] = histogram[-1]
+        return values
+
+    def render(self) -> str:
+        """Tutte le metriche nel formato testuale di Prometheus."""
+        lines = []
+        with self.lock:
+            series = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                series.setdefault(name, []).append(f"{format_key(name, labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                series.setdefault(name, []).append(f"{format_key(name, labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                samples = series.setdefault(name, [])
+                for bound, count in zip(BUCKETS, histogram):
+                    samples.append(f"{format_key(name + '_bucket', labels + (('le', str(bound)),))} {count}")
+                samples.append(f"{format_key(name + '_bucket', labels + (('le', '+Inf'),))} {histogram[-2]}")
+                samples.append(f"{format_key(name + '_count', labels)} {histogram[-2]}")
+                samples.append(f"{format_key(name + '_sum', labels)} {histogram[-1]}")
+        for name in sorted(series):
+            metric_type, description = DESCRIPTIONS.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(series[name])
+        return "\n".join(lines) + "\n"
+
+
+def format_key(name: str, labels: tuple) -> str:
+    """Nome della serie nel formato Prometheus, ad esempio match_total{method="isrc"}."""
+    if not labels:
+        return name
+    values = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels)
+    return f"{name}{{{values}}}"
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def snapshot_delta(before: dict, after: dict) -> dict:
+    """Differenza tra due snapshot (solo le serie cambiate)."""
+    return {key: value - before.get(key, 0) for key, value in after.items() if value != before.get(key, 0)}
+
+
+class MetricsServer:
+    """
+    Server HTTP locale che espone /metrics (formato Prometheus) e /summary (JSON dell'ultimo ciclo).
+    """
+
+    def __init__(self, registry: Metrics, host: str = "127.0.0.1", port: int = 9477):
+        self.logger = logging.getLogger("Metrics")
+        self.registry = registry
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        host, port = self.httpd.server_address[:2]
+        self.logger.info(f"Metriche disponibili su http://{host}:{port}/metrics")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def make_handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/metrics":
+                    self.respond(200, "text/plain; version=0.0.4; charset=utf-8", registry.render())
+                elif path == "/summary":
+                    self.respond(200, "application/json", json.dumps(registry.last_summary, indent=2))
+                else:
+                    self.respond(404, "text/plain; charset=utf-8", "Not found\n")
+
+            def respond(self, status, content_type, body):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# Registry shared by the whole program
+metrics = Metrics()
@@ -2,7 +2,13 @@ import hashlib
 import logging
 import random
 import string
+from concurrent.futures import Future, ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from Metrics import metrics
+from RequestGovernor import RequestGovernor
+from SongMatcher import search_query
+from TrackRecords import NavidromeSong
 
 class NavidromeException(Exception):
     """Eccezione personalizzata per errori Navidrome."""
@@ -17,29 +23,114 @@ class Navidrome:
         self.salt, self.token = create_navidrome_token(
             config['navidrome']["password"]
         )
+        # Numero massimo di richieste contemporanee verso Navidrome
+        self.max_workers = max(1, config['navidrome'].get("max_workers", 4))
+        self.timeout = config['navidrome'].get("timeout", 10)
         self.session = requests.Session()
+        # Connections kept open: the request workers (shared by the accounts, see AccountPool) and the threads
+        # calling Navidrome directly (analysis, linking, library index, control API). A smaller pool discards
+        # connections under load ("Connection pool is full") and reconnects at every request.
+        pool_size = config['navidrome'].get("pool_size", self.max_workers + 4)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.max_workers, pool_size))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="navidrome")
+        # Playlist changes: IDs per request in the query string (GET) or in a form-encoded body (POST)
+        self.get_chunk_size = config['navidrome'].get("get_chunk_size", 100)
+        self.post_chunk_size = config['navidrome'].get("post_chunk_size", 1000)
+        self.form_post = config['navidrome'].get("form_post")
+        # Rate limit, retries and circuit breaker shared by all requests to Navidrome
+        self.governor = RequestGovernor("Navidrome", config['navidrome'], rate=100, burst=self.max_workers * 2)
+
+    def map(self, function, items: list) -> list:
+        """Esegue function su ogni elemento in parallelo (al massimo max_workers richieste alla volta).
+        Args:
+            function: Funzione da applicare ad ogni elemento.
+            items (list): Elementi da elaborare.
+        Returns:
+            list: I risultati, nello stesso ordine degli elementi.
+        """
+        if self.max_workers == 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        return list(self.executor.map(function, items))
+
+    def submit(self, function, item) -> Future:
+        """Pianifica function(item) sul pool di richieste Navidrome."""
+        return self.executor.submit(function, item)
+
+    def search_songs(self, songs_info: list) -> list:
+        """Cerca in parallelo più canzoni in Navidrome.
+        Args:
+            songs_info (list): Lista di dizionari con le informazioni delle canzoni ('artist', 'name').
+        Returns:
+            list: Per ogni canzone, la lista dei risultati della ricerca (stesso ordine dell'input),
+            None se la ricerca è fallita.
+        """
+        return self.map(self.try_search_song, songs_info)
+
+    def try_search_song(self, song_info: dict) -> list|None:
+        """Come search_this_song, ma restituisce None se la ricerca fallisce."""
+        try:
+            return self.search_this_song(song_info)
+        except NavidromeException:
+            return None
 
     def search_this_song(self, song_info: dict) -> list:
         """Cerca una canzone in Navidrome/OpenSubsonic utilizzando il titolo e l'artista.
         Args:
             song_info (dict): Un dizionario contenente le informazioni della canzone ('artist', 'name').
         Returns:
-            list: Una lista di canzoni trovate che corrispondono alla ricerca.
+            list: Una lista di canzoni trovate che corrispondono alla ricerca (vuota se la canzone non esiste).
+        Raises:
+            NavidromeException: Se la ricerca non è riuscita (errore di rete o del server): la canzone
+            non deve essere considerata mancante.
         """
         endpoint = "rest/search2.view"
         artist = song_info['artist']
         song_title = song_info['name']
         params = {
-            "query": f"{artist} {song_title}",
+            # Main artist and title without "feat." and remaster suffixes, which the search would require
+            "query": search_query(song_info),
         }
         try:
             data = self.send_request(endpoint, params)
-            response = data.get("subsonic-response", {}).get("searchResult2", {}).get("song", [])
-            return response
         except (requests.HTTPError, Exception) as e:
             print(f"Errore nella richiesta a Navidrome: {e}")
             self.logger.error(f"Errore nella richiesta a Navidrome: {e}")
-            return []
+            raise NavidromeException(f"Ricerca fallita per {artist} - {song_title}: {e}") from e
+        response = data.get("subsonic-response", {})
+        if response.get("status") == "failed":
+            raise NavidromeException(f"Ricerca fallita per {artist} - {song_title}: {response.get('error')}")
+        return [NavidromeSong.from_dict(song) for song in response.get("searchResult2", {}).get("song", [])]
+
+    def iter_library_songs(self, page_size: int = 500):
+        """Scorre l'intera libreria Navidrome tramite search3 con query vuota, una pagina alla volta.
+        Args:
+            page_size (int): Numero di canzoni richieste per pagina.
+        Yields:
+            dict: Le canzoni della libreria; None se la scansione si interrompe per un errore.
+        """
+        endpoint = "rest/search3.view"
+        offset = 0
+        while True:
+            params = {
+                "query": "",
+                "artistCount": 0,
+                "albumCount": 0,
+                "songCount": page_size,
+                "songOffset": offset,
+            }
+            try:
+                data = self.send_request(endpoint, params)
+            except (requests.HTTPError, Exception) as e:
+                self.logger.error(f"Errore nella scansione della libreria Navidrome (offset {offset}): {e}")
+                yield None
+                return
+            songs = data.get("subsonic-response", {}).get("searchResult3", {}).get("song", [])
+            yield from map(NavidromeSong.from_dict, songs)
+            if len(songs) < page_size:
+                return
+            offset += page_size
 
     def list_playlists(self) -> list|None:
         """Recupera la lista delle playlist dell'utente da Navidrome.
@@ -56,7 +147,8 @@ class Navidrome:
             return None
 
     def create_playlist(self, playlist_name: str, playlist_id: str = "", songs: list = None) -> dict:
-        """Crea una nuova playlist in Navidrome.
+        """Crea una nuova playlist in Navidrome (o ne sostituisce il contenuto se playlist_id è indicato).
+        Le canzoni oltre la dimensione massima di una richiesta vengono aggiunte con updatePlaylist successivi.
 
         Args:
             playlist_name (str): Nome della nuova playlist.
@@ -70,39 +162,46 @@ class Navidrome:
         params = {
             "name": playlist_name
         }
-        if playlist_id and songs:
+        songs = songs or []
+        chunk_size = self.ids_per_request()
+        if playlist_id:
             params["playlistId"] = playlist_id
-            for song in songs:
-                params.setdefault("songId", []).append(song)
+        if songs:
+            params["songId"] = songs[:chunk_size]
             self.logger.info(f"Creazione della nuova playlist: {playlist_name} e aggiungo {len(songs)} canzoni")
         else:
             self.logger.info(f"Creazione della nuova playlist {playlist_name} senza canzoni")
             print(f"Creazione della nuova playlist {playlist_name} senza canzoni")
         try:
-            return self.send_request(endpoint, params)
+            data = self.send_request(endpoint, params, method=self.write_method(), idempotent=False)
         except (requests.HTTPError, Exception) as e:
             print(f"Errore nella creazione della playlist in Navidrome: {e}")
             self.logger.error(f"Errore nella creazione della playlist in Navidrome: {e}")
             return {}
+        remaining = songs[chunk_size:]
+        new_playlist_id = data.get("subsonic-response", {}).get("playlist", {}).get("id", playlist_id)
+        if remaining and new_playlist_id:
+            if not self.add_songs_to_playlist(new_playlist_id, remaining, []):
+                return {}
+        return data
 
     def add_songs_to_playlist(self, playlist_id: str, songs_to_add: list, songs_to_remove: list) -> dict:
         """Aggiunge canzoni a una playlist esistente in Navidrome/OpenSubsonic.
+        Le modifiche vengono divise in più richieste se superano la dimensione massima di una richiesta:
+        le rimozioni sono applicate in ordine di indice decrescente, così gli indici ancora da rimuovere
+        non cambiano, e le aggiunte mantengono l'ordine indicato.
 
         Args:
             playlist_id (str): ID della playlist esistente.
             songs_to_add (list): Lista di ID delle canzoni da aggiungere.
-            songs_to_remove: Lista di ID delle canzoni da rimuovere dalla playlist.
+            songs_to_remove: Lista degli indici delle canzoni da rimuovere dalla playlist.
 
         Returns:
-            dict: Risposta JSON della richiesta di aggiornamento della playlist.
+            dict: Risposta JSON dell'ultima richiesta di aggiornamento, con il numero di richieste inviate
+            in "requests" ({} in caso di errore).
 
         """
         endpoint = "rest/updatePlaylist.view"
-        params = {
-            "playlistId": playlist_id,
-            "songIdToAdd": songs_to_add,
-            "songIndexToRemove": songs_to_remove
-        }
         if not songs_to_add and not songs_to_remove:
             # Se non ci sono canzoni da aggiungere o rimuovere
             self.logger.debug(f"Nessuna canzone da aggiungere/rimuovere dalla playlist con ID {playlist_id}.")
@@ -110,11 +209,50 @@ class Navidrome:
 
         self.logger.info(f"Aggiungo {len(songs_to_add)} canzoni/Rimuovo {len(songs_to_remove)} alla playlist con ID {playlist_id}")
 
-        try:
-            return self.send_request(endpoint, params)
-        except (requests.HTTPError, Exception) as e:
-            self.logger.error(f"Errore nell'aggiunta delle canzoni alla playlist {playlist_id}: {e}")
-            return {}
+        batches = split_playlist_update(songs_to_add, songs_to_remove, self.ids_per_request())
+        data = {}
+        for number, (to_add, to_remove) in enumerate(batches, start=1):
+            params = {
+                "playlistId": playlist_id,
+                "songIdToAdd": to_add,
+                "songIndexToRemove": to_remove
+            }
+            try:
+                data = self.send_request(endpoint, params, method=self.write_method(), idempotent=False)
+            except (requests.HTTPError, Exception) as e:
+                self.logger.error(f"Errore nell'aggiunta delle canzoni alla playlist {playlist_id} "
+                                  f"(richiesta {number}/{len(batches)}): {e}")
+                return {}
+            if data.get("subsonic-response", {}).get("status") != "ok":
+                self.logger.error(f"Aggiornamento della playlist {playlist_id} fallito "
+                                  f"(richiesta {number}/{len(batches)}): {data}")
+                return {}
+        if len(batches) > 1:
+            self.logger.debug(f"Playlist {playlist_id} aggiornata con {len(batches)} richieste.")
+        data["requests"] = len(batches)
+        return data
+
+    def supports_form_post(self) -> bool:
+        """Verifica (una sola volta) se il server supporta l'estensione OpenSubsonic formPost."""
+        if self.form_post is None:
+            try:
+                data = self.send_request("rest/getOpenSubsonicExtensions.view")
+                extensions = data.get("subsonic-response", {}).get("openSubsonicExtensions", [])
+                self.form_post = any(extension.get("name") == "formPost" for extension in extensions)
+            except (requests.HTTPError, Exception):
+                self.form_post = False
+            self.logger.debug(f"Supporto formPost di Navidrome: {self.form_post}")
+        return self.form_post
+
+    def write_method(self) -> str:
+        """Metodo HTTP da usare per le richieste con molti parametri."""
+        return "POST" if self.supports_form_post() else "GET"
+
+    def ids_per_request(self) -> int:
+        """Numero massimo di ID/indici in una singola richiesta di modifica delle playlist."""
+        if self.supports_form_post():
+            return self.post_chunk_size
+        return self.get_chunk_size
 
     def get_playlist_info(self, playlist_id: str) -> dict:
         """Recupera le informazioni di una playlist specifica in Navidrome.
@@ -129,11 +267,14 @@ class Navidrome:
         }
         try:
             data = self.send_request(endpoint, params)
-            return data.get("subsonic-response", {}).get("playlist", {})
+            playlist = data.get("subsonic-response", {}).get("playlist", {})
         except (requests.HTTPError, Exception) as e:
             print(f"Errore nel recupero delle informazioni della playlist in Navidrome: {e}")
             self.logger.error(f"Errore nel recupero delle informazioni della playlist in Navidrome: {e}")
             return {}
+        if playlist.get('entry'):
+            playlist['entry'] = [NavidromeSong.from_dict(song) for song in playlist['entry']]
+        return playlist
 
     def set_playlist_public(self, playlist_id: str, is_public: bool):
         """
@@ -155,11 +296,42 @@ class Navidrome:
             self.logger.error(f"Errore nell'impostare la playlist {playlist_id}: {response}")
 
 
-    def send_request(self, endpoint: str, params: dict = None) -> dict:
+    def start_scan(self) -> bool:
+        """Avvia la scansione della libreria Navidrome (richiede un utente amministratore).
+        Returns:
+            bool: True se la scansione è stata avviata (o era già in corso).
+        """
+        try:
+            data = self.send_request("rest/startScan.view")
+        except (requests.HTTPError, Exception) as e:
+            self.logger.error(f"Errore nell'avvio della scansione Navidrome: {e}")
+            return False
+        if data.get("subsonic-response", {}).get("status") != "ok":
+            self.logger.error(f"Scansione Navidrome non avviata: {data}")
+            return False
+        self.logger.info("Scansione della libreria Navidrome avviata.")
+        return True
+
+    def get_scan_status(self) -> dict:
+        """Recupera lo stato della scansione della libreria.
+        Returns:
+            dict: Lo stato della scansione ('scanning', 'count', ...) o un dizionario vuoto in caso di errore.
+        """
+        try:
+            data = self.send_request("rest/getScanStatus.view")
+            return data.get("subsonic-response", {}).get("scanStatus", {})
+        except (requests.HTTPError, Exception) as e:
+            self.logger.error(f"Errore nel recupero dello stato della scansione Navidrome: {e}")
+            return {}
+
+    def send_request(self, endpoint: str, params: dict = None, method: str = "GET", idempotent: bool = True) -> dict:
         """Invia una richiesta a Navidrome e gestisce gli errori.
         Args:
             endpoint (str): L'endpoint della richiesta.
             params (dict): I parametri della richiesta.
+            method (str): "GET" (parametri nella query string) o "POST" (parametri nel corpo, form-encoded).
+            idempotent (bool): False per le richieste che modificano le playlist, ripetute solo se
+                non hanno raggiunto il server (vedi RequestGovernor.call).
         Returns:
             dict: La risposta JSON della richiesta.
         """
@@ -174,10 +346,27 @@ class Navidrome:
             "c": "spotify_sync",
             "f": "json"
         })
+
+        name = endpoint.removeprefix("rest/").removesuffix(".view")
+
+        def request() -> dict:
+            outcome = "error"
+            try:
+                with metrics.timer("navidrome_request_seconds", endpoint=name):
+                    if method == "POST":
+                        response = self.session.post(url, data=params, timeout=self.timeout)
+                    else:
+                        response = self.session.get(url, params=params, timeout=self.timeout)
+                    response.raise_for_status()
+                    data = response.json()
+                outcome = "ok"
+                return data
+            finally:
+                metrics.inc("navidrome_requests_total", endpoint=name, outcome=outcome)
+
         try:
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
+            # Transient errors (timeouts, 5xx, 429) are retried by the governor
+            return self.governor.call(request, idempotent=idempotent)
         except requests.HTTPError as e:
             self.logger.error(f"Errore nella richiesta [{endpoint}] a Navidrome: {e}")
             raise
@@ -187,6 +376,32 @@ class Navidrome:
 
 
 
+def split_playlist_update(songs_to_add: list, songs_to_remove: list, chunk_size: int) -> list:
+    """
+    Divide una modifica di playlist in richieste con al massimo chunk_size ID/indici ciascuna.
+    Gli indici da rimuovere sono ordinati in modo decrescente: ogni richiesta rimuove solo posizioni
+    successive a quelle delle richieste seguenti, che quindi restano valide. Le aggiunte seguono le rimozioni.
+    Args:
+        songs_to_add (list): ID delle canzoni da aggiungere, nell'ordine desiderato.
+        songs_to_remove (list): Indici delle canzoni da rimuovere.
+        chunk_size (int): Numero massimo di valori per richiesta.
+    Returns:
+        list: Lista di tuple (ID da aggiungere, indici da rimuovere), una per richiesta.
+    """
+    chunk_size = max(1, chunk_size)
+    removals = sorted(set(songs_to_remove), reverse=True)
+    batches = []
+    for start in range(0, len(removals), chunk_size):
+        batches.append(([], removals[start:start + chunk_size]))
+    position = 0
+    if batches and len(batches[-1][1]) < chunk_size:
+        # Fill the last removal request with the first songs to add
+        position = chunk_size - len(batches[-1][1])
+        batches[-1][0].extend(songs_to_add[:position])
+    for start in range(position, len(songs_to_add), chunk_size):
+        batches.append((songs_to_add[start:start + chunk_size], []))
+    return batches
+
 def create_navidrome_token(password: str) -> tuple:
     """
     Genera un token di autenticazione per Navidrome utilizzando una password e un salt casuale.
@@ -0,0 +1,74 @@
+import queue
+import threading
+from collections import deque
+
+_END = object()
+
+
+def prefetch(iterable, max_items: int):
+    """
+    Consuma iterable in un thread separato, tenendo pronti al massimo max_items elementi.
+    Il produttore si blocca quando la coda è piena (backpressure) e si ferma se il consumatore smette di leggere.
+    Args:
+        iterable: Sorgente degli elementi (ad esempio le pagine di una playlist Spotify).
+        max_items (int): Numero massimo di elementi in coda.
+    Yields:
+        Gli elementi di iterable, nello stesso ordine. Un'eccezione del produttore viene rilanciata al consumatore.
+    """
+    items = queue.Queue(maxsize=max(1, max_items))
+    stopped = threading.Event()
+    errors = []
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            errors.append(e)
+        put(_END)
+
+    producer = threading.Thread(target=produce, name="prefetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stopped.set()
+
+
+def map_pages(submit, function, pages, window: int):
+    """
+    Applica function a ogni elemento di ogni pagina tramite submit (ad esempio executor.submit),
+    con al massimo window pagine in elaborazione contemporaneamente.
+    Args:
+        submit (callable): Funzione che pianifica function(elemento) e restituisce un Future.
+        function (callable): Funzione da applicare ad ogni elemento.
+        pages: Sorgente delle pagine (liste di elementi).
+        window (int): Numero massimo di pagine in elaborazione.
+    Yields:
+        tuple: (pagina, risultati) nell'ordine originale delle pagine e degli elementi.
+    """
+    in_flight = deque()
+    for page in pages:
+        in_flight.append((page, [submit(function, item) for item in page]))
+        if len(in_flight) >= max(1, window):
+            page, futures = in_flight.popleft()
+            yield page, [future.result() for future in futures]
+    while in_flight:
+        page, futures = in_flight.popleft()
+        yield page, [future.result() for future in futures]
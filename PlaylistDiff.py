@@ -0,0 +1,36 @@
+import math
+from Navidrome import split_playlist_update
+
+
+def edit_script(current: list, target: list) -> tuple:
+    """
+    Calcola le modifiche minime che portano una playlist Navidrome dall'ordine current all'ordine target.
+    updatePlaylist sa solo togliere canzoni per indice e aggiungerle in fondo, quindi le canzoni mantenute
+    devono formare l'inizio di target: la più lunga sottosequenza comune utile è il più lungo prefisso
+    di target presente, nello stesso ordine, in current. Si trova in tempo lineare scorrendo current una volta.
+    Args:
+        current (list): ID delle canzoni nella playlist, nell'ordine attuale (anche ripetuti).
+        target (list): ID delle canzoni nell'ordine desiderato, senza ripetizioni.
+    Returns:
+        tuple: (indici di current da togliere, ID da aggiungere in fondo nell'ordine indicato).
+    """
+    kept = 0
+    to_remove = []
+    for index, song_id in enumerate(current):
+        if kept < len(target) and song_id == target[kept]:
+            kept += 1
+        else:
+            to_remove.append(index)
+    return to_remove, target[kept:]
+
+def update_requests(to_remove: list, to_add: list, chunk_size: int) -> int:
+    """Numero di richieste updatePlaylist necessarie per applicare le modifiche."""
+    return len(split_playlist_update(to_add, to_remove, chunk_size))
+
+def rewrite_requests(target: list, chunk_size: int) -> int:
+    """Numero di richieste per riscrivere la playlist: un createPlaylist più gli updatePlaylist delle canzoni in eccesso."""
+    return max(1, math.ceil(len(target) / max(1, chunk_size)))
+
+def ordered_ids(ids) -> list:
+    """Toglie gli ID ripetuti (e i None), mantenendo la prima occorrenza."""
+    return list(dict.fromkeys(song_id for song_id in ids if song_id))
@@ -1,106 +1,673 @@
+import json
 import logging
-from time import sleep
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+from DownloadScheduler import new_result
+from LikedSongs import LIKED_SONGS_ID, LikedSongs
+from Metrics import metrics, snapshot_delta
 from Navidrome import Navidrome, NavidromeException
+from Pipeline import map_pages, prefetch
+from PlaylistDiff import edit_script, ordered_ids, rewrite_requests, update_requests
+from PlaylistScheduler import PlaylistScheduler
+from SharedLibrary import SharedLibrary
+from SongMatcher import SongMatcher
 from Spotify import Spotify
+from StateStore import StateStore
+from SyncPlan import DEFAULT_BITRATE, estimated_size
 import re
 
 class PlaylistDownloader:
-    def __init__(self, config: dict, spotify_client: Spotify, navidrome_client: Navidrome):
+    def __init__(self, config: dict, spotify_client: Spotify, navidrome_client: Navidrome,
+                 shared: SharedLibrary = None):
+        """
+        Args:
+            config (dict): La configurazione (quella dell'account, con più account: vedi AccountPool).
+            spotify_client (Spotify): Il client Spotify dell'account.
+            navidrome_client (Navidrome): Il client dell'utente Navidrome dell'account.
+            shared (SharedLibrary, opzionale): Indice della libreria, corrispondenze e download condivisi
+                con gli altri account. Se non indicato ne viene creato uno proprio, con lo stesso StateStore.
+        """
         self.config = config
-        self.logger = logging.getLogger("PlaylistDownloader")
+        # Name of the account, None with a single account
+        self.account = config['config'].get("account")
+        self.logger = logging.getLogger(f"PlaylistDownloader.{self.account}" if self.account else "PlaylistDownloader")
         self.download_path = config['download']["path"]
         self.spotify_client = spotify_client
         self.navidrome_client = navidrome_client
+        # Matches, failures, library index, download queue and local files: shared by all the accounts
+        self.shared = shared or SharedLibrary(config, spotify_client, navidrome_client)
+        self.shared_state = self.shared.state
+        # Playlists, schedule and Liked Songs of this account
+        self.state = StateStore(config) if shared else self.shared_state
+        self.library_index = self.shared.library_index
+        self.library_index_ready = False
+        # Matching of the candidates without ISRC (title, artists, album, duration)
+        self.matcher = SongMatcher(config)
+        self.search_fallback = config['navidrome'].get("search_fallback", True)
+        self.rescan_after_download = config['navidrome'].get("rescan_after_download", True)
+        # Reproduce the order of the Spotify playlists in Navidrome (otherwise new songs are appended)
+        self.keep_order = config['navidrome'].get("keep_order", True)
+        self.scan_timeout = config['navidrome'].get("scan_timeout", 600)
+        self.scan_poll_interval = config['navidrome'].get("scan_poll_interval", 5)
+        # Navidrome playlists and resolved tracks, shared by all playlists of a synchronization cycle
+        self.navidrome_playlists = None
+        self.cycle_matches = None
+        self.prefetch_pages = config['spotify'].get("prefetch_pages", 2)
+        self.pages_in_flight = config['navidrome'].get("pages_in_flight", 2)
+        self.download_scheduler = self.shared.download_scheduler
+        # Spotify Liked Songs, synchronized as a virtual playlist
+        self.liked_songs = None
+        if config['download'].get("liked_songs", False):
+            self.liked_songs = LikedSongs(config, spotify_client, self.state)
+        self.download_index = self.shared.download_index
+        # Start of the last completed Navidrome scan: files older than this are already in the library
+        self.last_scan_at = 0
+        self.skip_unchanged = config["download"].get("skip_unchanged", True)
+        # JSON summary of every cycle and time budget of a cycle (by default the pause between cycles)
+        self.summary_file = config.get("metrics", {}).get("summary_file", os.path.join("Config", "last_sync.json"))
+        self.cycle_budget = config.get("metrics", {}).get("cycle_budget", config["download"].get("pause", 15)) * 60
+        # Per-playlist due times and "sync now" requests; a single cycle runs at a time
+        self.scheduler = PlaylistScheduler(config, self.state)
+        self.sync_lock = threading.Lock()
+        # Progress of the running cycle, Spotify playlists seen by the last cycle and cancellation request
+        self.progress = {"state": "idle", "playlist": None, "playlists_done": 0, "playlists_total": 0,
+                         "cycle_started_at": None, "last_cycle_finished_at": None}
+        self.last_playlists = []
+        self.cancel_event = threading.Event()
+        # Set by stop(): no new cycle starts and the running one drains the downloads in flight
+        self.stopping = threading.Event()
+        # Set while plan_cycle analyses the playlists: Navidrome, downloads and sync state are not modified
+        self.dry_run = False
+        self.estimated_bitrate = config['download'].get("estimated_bitrate", DEFAULT_BITRATE)
 
     def sync(self):
         """
-        Avvia il processo di sincronizzazione delle playlist.
+        Avvia il processo di sincronizzazione delle playlist: ogni playlist viene sincronizzata alla propria
+        scadenza (vedi PlaylistScheduler) o subito, se cambiata su Spotify o richiesta con request_sync.
+        Termina dopo stop().
+        """
+        while not self.stopping.is_set():
+            requested = self.scheduler.take_requests()
+            if self.scheduler.something_due(requested):
+                self.logger.info("Starting playlist download...")
+                try:
+                    self.sync_all_playlists(scheduled=True, requested=requested)
+                except Exception as e:
+                    # A failed cycle must not stop the service: the next one starts at the next due time
+                    print(f"❌ Errore durante la sincronizzazione: {e}")
+                    self.logger.error(f"Errore durante il ciclo di sincronizzazione: {e}", exc_info=True)
+                self.logger.info("Playlist download completed. Waiting for the next due playlist...")
+            if not self.stopping.is_set():
+                self.scheduler.wait()
+
+    def sync_all_playlists(self, scheduled: bool = False, requested: set = frozenset()):
+        """
+        Esegue un ciclo di sincronizzazione delle playlist selezionate.
+        Args:
+            scheduled (bool): Se True sincronizza solo le playlist in scadenza, cambiate o richieste,
+                e ne pianifica la prossima sincronizzazione; altrimenti tutte le playlist selezionate.
+            requested (set): Playlist (nomi o ID) richieste esplicitamente, analizzate anche se invariate.
+        """
+        with self.sync_lock:
+            try:
+                self.run_cycle(scheduled, requested)
+            finally:
+                self.progress.update(state="idle", playlist=None, last_cycle_finished_at=time.time())
+
+    def run_cycle(self, scheduled: bool, requested: set):
+        """Corpo di sync_all_playlists, eseguito con sync_lock acquisito."""
+        started = time.time()
+        before = metrics.snapshot()
+        cycle = self.start_cycle(scheduled, requested)
+        try:
+            synced = self.sync_selected_playlists(cycle["playlists"], cycle["selected"], cycle["excluded"],
+                                                  cycle["forced"])
+        finally:
+            self.navidrome_playlists = None
+            self.cycle_matches = None
+        self.report_cycle(started, before, self.finish_cycle(cycle, synced, scheduled))
+
+    def start_cycle(self, scheduled: bool, requested: set, resumed: set = None) -> dict:
+        """
+        Prima fase di un ciclo: legge le playlist Spotify, sceglie quelle da sincronizzare e le playlist Navidrome.
+        Args:
+            scheduled (bool): Vedi sync_all_playlists.
+            requested (set): Vedi sync_all_playlists.
+            resumed (set, opzionale): ID delle playlist che attendono i download ripresi, se già ripresi
+                (vedi AccountPool); altrimenti li riprende resume_downloads.
+        Returns:
+            dict: 'playlists' da analizzare, nomi delle playlist 'selected' ed 'excluded', ID delle playlist
+                'forced' (da analizzare anche se invariate) e 'sync_id' del ciclo nello StateStore.
+        """
+        excluded_playlists = self.config["download"].get("excluded_playlists", [])
+        if not self.stopping.is_set():
+            self.cancel_event.clear()
+        self.progress.update(state="spotify_playlists", playlist=None, playlists_done=0, playlists_total=0,
+                             cycle_started_at=time.time())
+        with metrics.timer("sync_phase_seconds", phase="spotify_playlists"):
+            playlists = self.list_spotify_playlists()
+        self.last_playlists = playlists
+        sync_id = self.state.start_sync()
+        selected_playlists = self.selected_playlist_names(playlists)
+        # Playlists waiting for resumed downloads are analysed again to link them
+        forced = self.resume_downloads() if resumed is None else set(resumed)
+        if scheduled:
+            requested = set(requested) | forced
+            # Playlists requested by name or ID are synchronized even if not selected
+            playlists = [playlist for playlist in playlists
+                         if (playlist['name'] in selected_playlists and playlist['name'] not in excluded_playlists)
+                         or playlist['id'] in requested or playlist['name'] in requested]
+            playlists, forced = self.scheduler.due_playlists(playlists, requested)
+            selected_playlists, excluded_playlists = [playlist['name'] for playlist in playlists], []
+            self.logger.info(f"Playlist da sincronizzare in questo ciclo: {len(playlists)}")
+        self.navidrome_playlists = self.navidrome_client.list_playlists() if playlists else []
+        self.cycle_matches = {}
+        self.progress["playlists_total"] = len(playlists)
+        return {"playlists": playlists, "selected": selected_playlists, "excluded": excluded_playlists,
+                "forced": forced, "sync_id": sync_id}
+
+    def finish_cycle(self, cycle: dict, synced: list, scheduled: bool) -> list:
+        """
+        Ultima fase di un ciclo: pianifica la prossima sincronizzazione delle playlist e registra il ciclo.
+        Args:
+            cycle (dict): Il ciclo restituito da start_cycle.
+            synced (list): Tuple (playlist Spotify, stato della sincronizzazione) delle playlist analizzate.
+            scheduled (bool): Vedi sync_all_playlists.
+        Returns:
+            list: Lo stato della sincronizzazione di ogni playlist analizzata.
         """
-        while True:
-            self.logger.info("Starting playlist download...")
-            self.sync_all_playlists()
-            self.logger.info("Playlist download completed. Pausing before next run...")
-            sleep(self.config["download"].get('pause', 15)*60)  # Pausa in minuti
+        if scheduled:
+            for playlist, playlist_status in synced:
+                if playlist_status["failed"]:
+                    self.scheduler.schedule_failure(playlist)
+                elif not playlist_status["cancelled"]:
+                    self.scheduler.schedule(playlist, playlist_status)
+        synced = [playlist_status for _, playlist_status in synced]
+        self.state.finish_sync(
+            cycle["sync_id"],
+            playlists=len(synced),
+            added=sum(len(status["to_add"]) for status in synced),
+            removed=sum(len(status["to_remove"]) for status in synced),
+            downloaded=sum(len(status["downloaded"]) for status in synced)
+        )
+        return synced
 
-    def sync_all_playlists(self):
+    def selected_playlist_names(self, playlists: list) -> list:
+        """Nomi delle playlist selezionate nella configurazione (tutte, se selected_playlists è true)."""
         selected_playlists = self.config["download"].get("selected_playlists", [])
+        if isinstance(selected_playlists, bool):
+            if selected_playlists:
+                self.logger.info("Syncing all playlists.")
+                return [playlist['name'] for playlist in playlists]
+            selected_playlists = []
+        if self.liked_songs:
+            # Enabling liked_songs selects them
+            return list(selected_playlists) + [self.liked_songs.name]
+        return selected_playlists
+
+    def plan_cycle(self) -> list:
+        """
+        Analizza tutte le playlist selezionate senza modificare nulla: nessuna playlist Navidrome creata
+        o aggiornata, nessun download e nessuno stato di sincronizzazione salvato (le corrispondenze trovate
+        restano in cache). Il piano può essere applicato in seguito con apply_plan, senza ripetere l'analisi.
+        Returns:
+            list: Una voce per playlist (vedi plan_entry).
+        """
         excluded_playlists = self.config["download"].get("excluded_playlists", [])
-        liked_songs = self.config["download"].get("liked_songs", False)
+        with self.sync_lock:
+            self.dry_run = True
+            self.cancel_event.clear()
+            try:
+                playlists = self.last_playlists = self.list_spotify_playlists()
+                selected_playlists = self.selected_playlist_names(playlists)
+                playlists = [playlist for playlist in playlists
+                             if playlist['name'] in selected_playlists and playlist['name'] not in excluded_playlists]
+                self.navidrome_playlists = self.navidrome_client.list_playlists() if playlists else []
+                self.cycle_matches = {}
+                plan = []
+                for playlist in playlists:
+                    self.logger.info(f"Pianificazione della playlist: {playlist['name']}")
+                    plan.append(self.plan_entry(playlist, self.analyse_playlist_difference(playlist)))
+                return plan
+            finally:
+                self.dry_run = False
+                self.navidrome_playlists = None
+                self.cycle_matches = None
+
+    def plan_entry(self, selected_playlist: dict, playlist_status: dict) -> dict:
+        """
+        Voce del piano di una playlist analizzata da plan_cycle.
+        Returns:
+            dict: Playlist Spotify ('spotify_id', 'name', 'snapshot_id', 'tracks_total'), playlist Navidrome
+                ('navidrome_id', None se va creata, e 'navidrome_changed', la versione su cui è calcolato
+                il piano), le modifiche ('to_add', 'to_remove', 'target', 'order', 'moved'), i brani da
+                scaricare ('to_download', con 'local' e 'deferred' gli ID di quelli già su disco o da
+                riprovare più tardi), 'lookup_failed', 'skipped' e 'estimated_download_bytes'.
+        """
+        navidrome_changed = None
+        for navidrome_playlist in self.get_navidrome_playlists() or []:
+            if navidrome_playlist.get('id') == playlist_status["navidrome_id"]:
+                navidrome_changed = navidrome_playlist.get('changed')
+        local, deferred, size = [], [], 0
+        if self.download_index and playlist_status["to_download"]:
+            self.download_index.refresh()
+        for track in playlist_status["to_download"]:
+            if self.download_index and self.download_index.find(track):
+                local.append(track['id'])
+            elif self.shared_state.retry_time(track) > time.time():
+                deferred.append(track['id'])
+            else:
+                size += estimated_size(track, self.estimated_bitrate)
+        return {
+            "spotify_id": selected_playlist['id'],
+            "name": selected_playlist['name'],
+            "snapshot_id": selected_playlist.get('snapshot_id'),
+            "tracks_total": selected_playlist['tracks_total'],
+            "navidrome_id": playlist_status["navidrome_id"],
+            "navidrome_changed": navidrome_changed,
+            "skipped": playlist_status["skipped"],
+            "to_add": playlist_status["to_add"],
+            "to_remove": playlist_status["to_remove"],
+            "target": playlist_status["target"],
+            "order": playlist_status["order"],
+            "moved": playlist_status["moved"],
+            "to_download": playlist_status["to_download"],
+            "local": local,
+            "deferred": deferred,
+            "lookup_failed": playlist_status["lookup_failed"],
+            "estimated_download_bytes": size,
+        }
+
+    def apply_plan(self, plan: list) -> list:
+        """
+        Applica un piano calcolato da plan_cycle: aggiorna le playlist Navidrome, scarica i brani mancanti
+        e li collega, come un normale ciclo. Le playlist Navidrome modificate dopo il piano (versione
+        diversa da 'navidrome_changed') vengono saltate: gli indici da togliere non sarebbero più validi.
+        Args:
+            plan (list): Le voci del piano.
+        Returns:
+            list: Lo stato della sincronizzazione di ogni playlist applicata, con 'failed' per quelle il cui
+                aggiornamento non è riuscito (da pianificare di nuovo).
+        """
+        with self.sync_lock:
+            started = time.time()
+            before = metrics.snapshot()
+            self.cancel_event.clear()
+            sync_id = self.state.start_sync()
+            self.navidrome_playlists = self.navidrome_client.list_playlists()
+            synced = []
+            try:
+                for entry in plan:
+                    if entry["skipped"]:
+                        continue
+                    selected_playlist = {'id': entry['spotify_id'], 'name': entry['name'],
+                                         'snapshot_id': entry['snapshot_id'], 'tracks_total': entry['tracks_total']}
+                    try:
+                        playlist_status = self.apply_plan_entry(selected_playlist, entry)
+                    except Exception as e:
+                        self.logger.error(f"Errore nell'applicazione del piano per {entry['name']}: {e}", exc_info=True)
+                        print(f"❌ Errore nell'applicazione del piano per la playlist '{entry['name']}': {e}")
+                        continue
+                    if playlist_status:
+                        synced.append((selected_playlist, playlist_status))
+                with metrics.timer("sync_phase_seconds", phase="download"):
+                    self.download_songs(synced)
+                self.link_downloaded_songs(synced)
+            finally:
+                self.navidrome_playlists = None
+            synced = [playlist_status for _, playlist_status in synced]
+            self.state.finish_sync(
+                sync_id,
+                playlists=len(synced),
+                added=sum(len(status["to_add"]) for status in synced),
+                removed=sum(len(status["to_remove"]) for status in synced),
+                downloaded=sum(len(status["downloaded"]) for status in synced)
+            )
+            self.report_cycle(started, before, synced)
+        return synced
+
+    def apply_plan_entry(self, selected_playlist: dict, entry: dict) -> dict|None:
+        """
+        Applica la voce del piano di una playlist e pianifica i suoi download.
+        Returns:
+            dict|None: Lo stato della sincronizzazione ('failed' se l'aggiornamento della playlist Navidrome
+                non è riuscito: nessun download pianificato), None se la playlist è cambiata dopo il piano.
+        """
+        if entry["navidrome_id"]:
+            n_playlist_info = self.navidrome_client.get_playlist_info(entry["navidrome_id"])
+            stale = n_playlist_info.get('changed') != entry["navidrome_changed"]
+        else:
+            # Created now: it must still be empty
+            n_playlist_info = self.get_navidrome_playlist_info(selected_playlist)
+            stale = bool(n_playlist_info.get('entry'))
+        if stale or not n_playlist_info.get('id'):
+            print(f"⚠️ Playlist '{entry['name']}' modificata dopo il piano: saltata, va pianificata di nuovo.")
+            self.logger.warning(f"Playlist Navidrome {entry['name']} modificata dopo il piano: saltata.")
+            return None
+        playlist_status = new_playlist_status(selected_playlist)
+        playlist_status.update({key: entry[key] for key in ("to_add", "to_remove", "target", "order", "moved",
+                                                            "to_download", "lookup_failed")})
+        playlist_status["navidrome_id"] = n_playlist_info['id']
+        with metrics.timer("sync_phase_seconds", phase="playlist_update"):
+            updated = self.update_navidrome_playlist(n_playlist_info, playlist_status["to_add"],
+                                                     playlist_status["to_remove"], playlist_status["target"])
+        if not updated:
+            self.playlist_update_failed(selected_playlist, playlist_status)
+            return playlist_status
+        self.save_playlist_state(selected_playlist, n_playlist_info, playlist_status)
+        for track in playlist_status["to_download"]:
+            self.queue_download(track, selected_playlist, playlist_status)
+        return playlist_status
+
+    def list_spotify_playlists(self) -> list:
+        """
+        Restituisce le playlist Spotify dell'utente e, se abilitati, i brani salvati come playlist virtuale.
+        """
         playlists = self.spotify_client.list_user_playlists()
-        if isinstance(selected_playlists, bool) and selected_playlists:
-            self.logger.info("Syncing all playlists.")
-            selected_playlists = [playlist['name'] for playlist in playlists]
+        if self.liked_songs:
+            playlists.append(self.liked_songs.playlist(persist=not self.dry_run))
+        return playlists
+
+    def iter_spotify_pages(self, selected_playlist: dict):
+        """Scorre le tracce di una playlist Spotify (o dei brani salvati) una pagina alla volta."""
+        if selected_playlist['id'] == LIKED_SONGS_ID and self.liked_songs:
+            return self.liked_songs.iter_pages()
+        return self.spotify_client.iter_playlist_pages(selected_playlist)
+
+    def cancel(self) -> dict:
+        """
+        Interrompe il ciclo in corso: l'analisi si ferma alla prossima pagina (senza modificare la playlist
+        interrotta), le playlist successive vengono saltate e i download in coda annullati.
+        Returns:
+            dict: 'running' (c'era un ciclo in corso) e 'cancelled_downloads'.
+        """
+        running = self.progress["state"] != "idle"
+        if running:
+            self.cancel_event.set()
+            self.logger.info("Annullamento del ciclo di sincronizzazione richiesto.")
+        return {"running": running, "cancelled_downloads": self.download_scheduler.cancel_pending(forget=True)}
+
+    def stop(self):
+        """
+        Arresto ordinato (SIGTERM): interrompe l'analisi, completa i download già in corso e lascia gli altri
+        nella coda persistente, da cui riprenderanno al prossimo avvio. sync() termina alla fine del ciclo.
+        """
+        self.logger.info("Arresto richiesto: completamento dei download in corso.")
+        self.stopping.set()
+        self.cancel_event.set()
+        postponed = self.download_scheduler.close()
+        if postponed:
+            print(f"⏸️ {postponed} download rimandati al prossimo avvio.")
+        self.scheduler.wake.set()
+
+    def resume_downloads(self) -> set:
+        """
+        Riprende (una sola volta, al primo ciclo) i download rimasti nella coda persistente.
+        Returns:
+            set: ID delle playlist Spotify che attendono i brani ripresi.
+        """
+        if self.shared.queue_resumed:
+            return set()
+        self.shared.queue_resumed = True
+        playlists = set()
+        for track, playlist_ids, future in self.download_scheduler.resume(on_result=self.record_download_result):
+            self.shared.pending_downloads[track_key(track)] = {"track": track, "future": future, "owners": []}
+            playlists.update(playlist_ids)
+        if self.shared.pending_downloads:
+            print(f"⏯️ Ripresi {len(self.shared.pending_downloads)} download interrotti.")
+        return playlists
+
+    def report_cycle(self, started: float, before: dict, synced: list):
+        """
+        Riassume un ciclo di sincronizzazione (durata delle fasi, richieste, corrispondenze, download),
+        lo pubblica nelle metriche e lo salva in summary_file. Segnala i cicli più lunghi di cycle_budget.
+        Args:
+            started (float): Inizio del ciclo (epoch).
+            before (dict): Snapshot delle metriche all'inizio del ciclo.
+            synced (list): Lo stato di sincronizzazione di ogni playlist analizzata.
+        """
+        finished = time.time()
+        duration = finished - started
+        delta = snapshot_delta(before, metrics.snapshot())
+        summary = {
+            "started_at": started,
+            "finished_at": finished,
+            "duration": duration,
+            "overrun": duration > self.cycle_budget,
+            "playlists": len(synced),
+            "skipped": sum(1 for status in synced if status["skipped"]),
+            "failed": sum(1 for status in synced if status["failed"]),
+            "added": sum(len(status["to_add"]) for status in synced),
+            "removed": sum(len(status["to_remove"]) for status in synced),
+            "moved": sum(status["moved"] for status in synced),
+            "downloaded": sum(len(status["downloaded"]) for status in synced),
+            "lookup_failed": sum(len(status["lookup_failed"]) for status in synced),
+            # Cumulative time: phases run by several threads (match, spotify_fetch) can exceed the duration
+            "phases": {key.split('"')[1]: round(value, 3) for key, value in delta.items()
+                       if key.startswith("sync_phase_seconds_sum")},
+            "metrics": delta,
+        }
+        metrics.last_summary = summary
+        metrics.inc("sync_cycles_total")
+        metrics.set("sync_last_duration_seconds", duration)
+        metrics.set("sync_last_finished_timestamp", finished)
+        phases = ", ".join(f"{phase} {elapsed:.1f}s" for phase, elapsed in summary["phases"].items())
+        self.logger.info(f"Ciclo completato in {duration:.1f}s ({phases})")
+        if summary["overrun"]:
+            metrics.inc("sync_overruns_total")
+            self.logger.warning(f"Il ciclo di sincronizzazione è durato {duration:.0f}s, "
+                                f"oltre il limite di {self.cycle_budget:.0f}s")
+        if self.summary_file:
+            try:
+                with open(self.summary_file, "w", encoding="utf-8") as f:
+                    json.dump(summary, f, indent=2)
+            except OSError as e:
+                self.logger.error(f"Impossibile salvare il riepilogo del ciclo in {self.summary_file}: {e}")
+
+    def sync_selected_playlists(self, playlists: list, selected_playlists: list, excluded_playlists: list,
+                                forced: set = frozenset()) -> list:
+        """
+        Analizza tutte le playlist selezionate e poi scarica, una sola volta, l'unione dei brani mancanti.
+        Args:
+            forced (set): ID delle playlist da analizzare anche se invariate dall'ultima sincronizzazione.
+        Returns:
+            list: Tuple (playlist Spotify, stato della sincronizzazione) di ogni playlist analizzata.
+        """
+        synced = []
         for playlist in playlists:
-            if playlist['name'] in excluded_playlists:
-                self.logger.debug(f"Skipping excluded playlist: {playlist['name']}")
-                continue
-            if playlist['name'] in selected_playlists:
-                try:
-                    self.sync_this_playlist(playlist)
-                except Exception as e:
-                    self.logger.error(f"Error syncing playlist {playlist['name']}: {e}", exc_info=True)
-                    print(f"❌ Errore durante la sincronizzazione della playlist '{playlist['name']}': {e}")
-            else:
-                self.logger.info(f"Skipping playlist: {playlist['name']} (not selected)")
+            if self.cancel_event.is_set():
+                self.logger.info("Ciclo annullato: playlist rimanenti saltate.")
+                break
+            playlist_status = self.sync_selected_playlist(playlist, selected_playlists, excluded_playlists, forced)
+            if playlist_status:
+                synced.append((playlist, playlist_status))
+        self.progress.update(state="download", playlist=None)
+        with metrics.timer("sync_phase_seconds", phase="download"):
+            self.download_songs(synced)
+        self.progress["state"] = "link"
+        self.link_downloaded_songs(synced)
+        return synced
 
+    def sync_selected_playlist(self, playlist: dict, selected_playlists: list, excluded_playlists: list,
+                               forced: set = frozenset()) -> dict|None:
+        """
+        Analizza una playlist del ciclo, se selezionata e non esclusa (vedi sync_selected_playlists).
+        Returns:
+            dict|None: Lo stato della sincronizzazione ('failed' se l'analisi non è riuscita), None se la playlist
+                è esclusa o non selezionata.
+        """
+        self.progress.update(state="analysis", playlist=playlist['name'])
+        if playlist['name'] in excluded_playlists:
+            self.logger.debug(f"Skipping excluded playlist: {playlist['name']}")
+            return None
+        playlist_status = None
+        if playlist['name'] in selected_playlists:
+            try:
+                self.logger.info(f"Starting synchronization for playlist: {playlist['name']}")
+                playlist_status = self.analyse_playlist_difference(playlist, force=playlist['id'] in forced)
+            except Exception as e:
+                self.logger.error(f"Error syncing playlist {playlist['name']}: {e}", exc_info=True)
+                print(f"❌ Errore durante la sincronizzazione della playlist '{playlist['name']}': {e}")
+                # Retried after a backoff (see PlaylistScheduler.schedule_failure)
+                playlist_status = new_playlist_status(playlist)
+                playlist_status["failed"] = True
+        else:
+            self.logger.info(f"Skipping playlist: {playlist['name']} (not selected)")
+        self.progress["playlists_done"] += 1
+        return playlist_status
 
-    def analyse_playlist_difference(self, selected_playlist: dict) -> dict:
+    def analyse_playlist_difference(self, selected_playlist: dict, force: bool = False) -> dict:
         """
         Estrae le tracce mancanti da una playlist selezionata confrontando le tracce della playlist Spotify
         con quelle presenti in Navidrome.
         Args:
             selected_playlist (dict): Dizionario contenente le informazioni della playlist selezionata.
+            force (bool): Analizza la playlist anche se invariata dall'ultima sincronizzazione.
         Returns:
             dict: I risultati dell'analisi della playlist.
         """
-        playlist_status = {
-            "name": selected_playlist['name'],
-            "total_tracks": selected_playlist['tracks_total'],
-            # Tracks that need to be downloaded from Spotify
-            "to_download": [],
-            # Tracks that need to be added to the Navidrome playlist
-            "to_add": [],
-            # Tracks that need to be removed from the Navidrome playlist
-            "to_remove": [],
-            # Tracks that are already present in Navidrome playlist
-            "to_keep": []
-        }
+        playlist_status = new_playlist_status(selected_playlist)
+
+        if not force and self.playlist_unchanged(selected_playlist):
+            self.logger.info(f"Playlist invariata dall'ultima sincronizzazione: {selected_playlist['name']}")
+            playlist_status["skipped"] = True
+            return playlist_status
 
         try:
+            # Refresh the local library index (if expired)
+            self.refresh_library_index()
             # Get info
             n_playlist_info = self.get_navidrome_playlist_info(selected_playlist)
+            playlist_status["navidrome_id"] = n_playlist_info['id']
             # Remove duplicates
             playlist_status["to_remove"].extend(self.remove_duplicates_from_playlist(n_playlist_info))
             # Compare playlists
-            self.compare_playlist_with_spotify(n_playlist_info, selected_playlist, playlist_status)
+            with metrics.timer("sync_phase_seconds", phase="analysis"):
+                self.compare_playlist_with_spotify(n_playlist_info, selected_playlist, playlist_status)
         except NavidromeException:
+            playlist_status["failed"] = True
             return playlist_status
-        self.navidrome_client.add_songs_to_playlist(n_playlist_info['id'], playlist_status["to_add"], playlist_status["to_remove"])
+        if playlist_status["cancelled"] or self.dry_run:
+            return playlist_status
+        with metrics.timer("sync_phase_seconds", phase="playlist_update"):
+            updated = self.update_navidrome_playlist(n_playlist_info, playlist_status["to_add"],
+                                                     playlist_status["to_remove"], playlist_status["target"])
+        if not updated:
+            self.playlist_update_failed(selected_playlist, playlist_status)
+            return playlist_status
+        self.save_playlist_state(selected_playlist, n_playlist_info, playlist_status)
         return playlist_status
 
+    def playlist_update_failed(self, selected_playlist: dict, playlist_status: dict):
+        """
+        Registra un aggiornamento della playlist Navidrome non riuscito: lo snapshot Spotify memorizzato
+        viene azzerato, così il ciclo successivo analizza di nuovo la playlist invece di considerarla invariata.
+        Args:
+            selected_playlist (dict): La playlist Spotify.
+            playlist_status (dict): Lo stato della sincronizzazione, segnato come fallito.
+        """
+        playlist_status.update(failed=True, to_add=[], to_remove=[], moved=0)
+        self.logger.error(f"Aggiornamento della playlist Navidrome {selected_playlist['name']} non riuscito: "
+                          f"verrà riprovato al prossimo ciclo.")
+        print(f"❌ Aggiornamento della playlist '{selected_playlist['name']}' in Navidrome non riuscito.")
+        self.state.save_playlist_state(selected_playlist['id'], name=selected_playlist['name'], snapshot_id=None)
+
+    def playlist_unchanged(self, selected_playlist: dict) -> bool:
+        """
+        Verifica se la playlist Spotify (snapshot_id) e la playlist Navidrome (changed) sono invariate
+        rispetto all'ultima sincronizzazione completa.
+        Args:
+            selected_playlist (dict): Dizionario contenente le informazioni della playlist Spotify.
+        Returns:
+            bool: True se la sincronizzazione può essere saltata.
+        """
+        if not self.skip_unchanged or not selected_playlist.get('snapshot_id'):
+            return False
+        stored = self.state.get_playlist_state(selected_playlist['id'])
+        if not stored or stored['snapshot_id'] != selected_playlist['snapshot_id']:
+            return False
+        if stored['pending'] and stored['retry_at'] <= time.time():
+            # Missing songs that can be downloaded (again)
+            return False
+        for navidrome_playlist in self.get_navidrome_playlists() or []:
+            if navidrome_playlist.get('id') == stored['navidrome_id']:
+                return navidrome_playlist.get('changed') == stored['navidrome_changed']
+        return False
+
+    def save_playlist_state(self, selected_playlist: dict, n_playlist_info: dict, playlist_status: dict):
+        """
+        Memorizza snapshot Spotify e data di modifica Navidrome dopo la sincronizzazione di una playlist.
+        """
+        if playlist_status["to_add"] or playlist_status["to_remove"]:
+            # The update changed the Navidrome playlist: read the new timestamp
+            n_changed = self.navidrome_client.get_playlist_info(n_playlist_info['id']).get('changed')
+        else:
+            n_changed = n_playlist_info.get('changed')
+        self.state.save_playlist_state(
+            selected_playlist['id'],
+            name=selected_playlist['name'],
+            snapshot_id=selected_playlist.get('snapshot_id'),
+            navidrome_id=n_playlist_info['id'],
+            navidrome_changed=n_changed,
+            **self.pending_state(playlist_status["to_download"] + playlist_status["lookup_failed"])
+        )
+
+    def pending_state(self, missing_tracks: list) -> dict:
+        """
+        Calcola il numero di brani mancanti e quando potranno essere riprovati (0 = al prossimo ciclo).
+        """
+        return {
+            "pending": len(missing_tracks),
+            "retry_at": min((self.shared_state.retry_time(track) for track in missing_tracks), default=0)
+        }
+
     def compare_playlist_with_spotify(self, n_playlist_info, selected_playlist, playlist_status):
-        spotify_track_list = self.spotify_client.get_playlist_tracks(selected_playlist)
+        """
+        Confronta la playlist Spotify con quella Navidrome come pipeline: le pagine Spotify vengono lette
+        in anticipo in un thread, le tracce di ogni pagina risolte in parallelo appena la pagina arriva
+        e i brani mancanti passati subito allo scheduler dei download.
+        """
         # Track Navidrome song IDs that should be kept (matched with Spotify)
         navidrome_songs_to_keep = set()
-        
-        for number, spotify_song in enumerate(spotify_track_list, start=1):
-            matched_navidrome_song = find_song_by_isrc(spotify_song, n_playlist_info)
+        playlist_index = build_playlist_index(n_playlist_info)
+
+        def resolve(spotify_song: dict) -> tuple:
+            # Tracks already in the Navidrome playlist (same ISRC) don't need to be resolved
+            matched_navidrome_song = playlist_index["by_isrc"].get(spotify_song.get('isrc'))
             if matched_navidrome_song:
-                # Skip exact matches - song already in playlist with correct ISRC
-                playlist_status["to_keep"].append(spotify_song['id'])
-                navidrome_songs_to_keep.add(matched_navidrome_song['id'])
-                self.logger.debug(f"Song already in Navidrome by ISRC: {spotify_song['search_string']}")
-                continue
-            try:
-                #Search for possible matches
-                songs_found = self.navidrome_client.search_this_song(spotify_song)
-                # Select best match
-                selected_song = self.select_song(songs_found, spotify_song)
+                metrics.inc("match_total", method="playlist_isrc")
+                return matched_navidrome_song, None
+            with metrics.timer("sync_phase_seconds", phase="match"):
+                return None, self.try_resolve_song(spotify_song)
+
+        spotify_pages = metrics.timed(self.iter_spotify_pages(selected_playlist),
+                                      "sync_phase_seconds", phase="spotify_fetch")
+        pages = prefetch(spotify_pages, self.prefetch_pages)
+        for page, results in map_pages(self.navidrome_client.submit, resolve, pages, self.pages_in_flight):
+            if self.cancel_event.is_set():
+                playlist_status["cancelled"] = True
+                self.logger.info(f"Analisi della playlist {selected_playlist['name']} annullata.")
+                return
+            for spotify_song, (matched_navidrome_song, selected_song) in zip(page, results):
+                playlist_status["order"].append((spotify_song['id'], (matched_navidrome_song or selected_song or {}).get('id')))
+                if matched_navidrome_song:
+                    # Skip exact matches - song already in playlist with correct ISRC
+                    playlist_status["to_keep"].append(spotify_song['id'])
+                    navidrome_songs_to_keep.add(matched_navidrome_song['id'])
+                    self.logger.debug(f"Song already in Navidrome by ISRC: {spotify_song['search_string']}")
+                    continue
+                if selected_song is None:
+                    # Resolution failed - error already logged, the song is neither downloaded nor removed
+                    playlist_status["lookup_failed"].append(spotify_song)
+                    continue
                 if not selected_song:
                     # Song not found - download required
                     playlist_status["to_download"].append(spotify_song)
+                    self.queue_download(spotify_song, selected_playlist, playlist_status)
                     self.logger.info(f"Identificato brano mancante - {spotify_song['search_string']}")
-                elif not self.song_in_playlist(selected_song, n_playlist_info, playlist_status):
+                elif not self.song_in_playlist(selected_song, n_playlist_info, playlist_index, navidrome_songs_to_keep):
                     # Song not in the playlist
                     playlist_status["to_add"].append(selected_song['id'])
                     navidrome_songs_to_keep.add(selected_song['id'])
@@ -108,12 +675,105 @@ class PlaylistDownloader:
                     playlist_status["to_keep"].append(selected_song['id'])
                     navidrome_songs_to_keep.add(selected_song['id'])
                     self.logger.debug(f"Song already in Navidrome: {spotify_song['search_string']}")
-            except Exception as e:
-                print(f"Errore nel parsing del brano '{spotify_song}': {e}")
-                self.logger.error(f"Errore nel parsing del brano '{spotify_song}': {e}", exc_info=True)
-        
-        # Identify songs in Navidrome playlist that are not in Spotify and mark for removal
-        self.mark_songs_for_removal(n_playlist_info, navidrome_songs_to_keep, playlist_status)
+
+        if playlist_status["lookup_failed"]:
+            # Unresolved tracks may be in the Navidrome playlist: don't remove anything this cycle
+            self.logger.warning(f"{len(playlist_status['lookup_failed'])} brani non verificati per errori di rete, "
+                                f"nessuna rimozione dalla playlist {selected_playlist['name']} in questo ciclo.")
+            return
+        if self.keep_order:
+            self.plan_playlist_order(n_playlist_info, playlist_status)
+        else:
+            # Identify songs in Navidrome playlist that are not in Spotify and mark for removal
+            self.mark_songs_for_removal(n_playlist_info, navidrome_songs_to_keep, playlist_status)
+
+    def refresh_library_index(self):
+        """
+        Aggiorna l'indice locale della libreria Navidrome, se abilitato.
+        """
+        if self.library_index:
+            with metrics.timer("sync_phase_seconds", phase="library_index"):
+                self.library_index_ready = self.library_index.refresh()
+
+    def try_resolve_song(self, spotify_song: dict) -> dict|None:
+        """
+        Come resolve_song, ma registra gli errori invece di propagarli.
+        Returns:
+            dict|None: La canzone selezionata, {} se non trovata, None in caso di errore.
+        """
+        if self.cycle_matches is not None and spotify_song['id'] in self.cycle_matches:
+            # Already resolved for another playlist in this cycle
+            metrics.inc("match_total", method="cycle_cache")
+            return self.cycle_matches[spotify_song['id']]
+        try:
+            selected_song = self.resolve_song(spotify_song)
+            if self.cycle_matches is not None:
+                self.cycle_matches[spotify_song['id']] = selected_song
+            return selected_song
+        except NavidromeException as e:
+            metrics.inc("match_total", method="error")
+            self.logger.warning(f"Impossibile verificare il brano {spotify_song['search_string']}: {e}")
+            return None
+        except Exception as e:
+            metrics.inc("match_total", method="error")
+            print(f"Errore nel parsing del brano '{spotify_song}': {e}")
+            self.logger.error(f"Errore nel parsing del brano '{spotify_song}': {e}", exc_info=True)
+            return None
+
+    def resolve_song(self, spotify_song: dict) -> dict:
+        """
+        Risolve la canzone Navidrome corrispondente a una traccia Spotify, riutilizzando le corrispondenze
+        memorizzate nello stato persistente prima di cercare nella libreria.
+        Args:
+            spotify_song (dict): Dizionario contenente le informazioni della canzone Spotify.
+        Returns:
+            dict: La canzone Navidrome selezionata, o un dizionario vuoto se non trovata.
+        """
+        stored_id = self.shared_state.get_match(spotify_song)
+        if stored_id:
+            stored_song = self.stored_song(stored_id)
+            if stored_song:
+                metrics.inc("match_total", method="stored")
+                self.logger.debug(f"Corrispondenza memorizzata per {spotify_song['search_string']}: {stored_id}")
+                return stored_song
+        songs_found, source = self.find_song_candidates(spotify_song)
+        selected_song = self.select_song(songs_found, spotify_song)
+        if selected_song:
+            metrics.inc("match_total", method=source)
+            self.shared_state.save_match(spotify_song, selected_song['id'])
+        else:
+            metrics.inc("match_total", method="miss")
+        return selected_song
+
+    def stored_song(self, navidrome_id: str) -> dict:
+        """
+        Verifica che una corrispondenza memorizzata sia ancora valida.
+        Returns:
+            dict: La canzone Navidrome (solo l'ID se l'indice della libreria non è disponibile), {} se non esiste più.
+        """
+        if not self.library_index_ready:
+            return {'id': navidrome_id}
+        song = self.library_index.get(navidrome_id)
+        if not song:
+            self.logger.info(f"Canzone Navidrome {navidrome_id} non più presente, corrispondenza rimossa.")
+            self.shared_state.forget_match(navidrome_id)
+        return song
+
+    def find_song_candidates(self, spotify_song: dict) -> list:
+        """
+        Cerca le possibili corrispondenze Navidrome di una traccia Spotify, prima nell'indice locale
+        e poi, solo per le tracce non indicizzate, tramite ricerca remota.
+        Args:
+            spotify_song (dict): Dizionario contenente le informazioni della canzone Spotify.
+        Returns:
+            tuple: (lista di canzoni Navidrome candidate, "index" o "search" a seconda della provenienza).
+        """
+        if self.library_index_ready:
+            songs_found = self.library_index.lookup(spotify_song)
+            if songs_found or not self.search_fallback:
+                return songs_found, "index"
+            self.logger.debug(f"Brano non presente nell'indice, ricerca remota: {spotify_song['search_string']}")
+        return self.navidrome_client.search_this_song(spotify_song), "search"
 
     def mark_songs_for_removal(self, n_playlist_info, navidrome_songs_to_keep, playlist_status):
         """
@@ -138,9 +798,60 @@ class PlaylistDownloader:
                 playlist_status["to_remove"].append(index)
                 self.logger.info(f"Rimozione brano non presente in Spotify: {navidrome_song.get('title', 'Unknown')} di {navidrome_song.get('artist', 'Unknown')}")
 
+    def plan_playlist_order(self, n_playlist_info: dict, playlist_status: dict):
+        """
+        Sostituisce aggiunte e rimozioni (duplicati compresi) con le modifiche minime che riproducono
+        nella playlist Navidrome l'ordine della playlist Spotify (vedi PlaylistDiff.edit_script).
+        Args:
+            n_playlist_info (dict): La playlist Navidrome, con le sue canzoni ('entry').
+            playlist_status (dict): Lo stato della sincronizzazione, con l'ordine Spotify ('order').
+        """
+        entries = n_playlist_info.get('entry', [])
+        target = ordered_ids(navidrome_id for _, navidrome_id in playlist_status["order"])
+        to_remove, to_add = edit_script([song['id'] for song in entries], target)
+        wanted = set(target)
+        for index in to_remove:
+            if entries[index]['id'] not in wanted:
+                self.logger.info(f"Rimozione brano non presente in Spotify: {entries[index].get('title', 'Unknown')} "
+                                 f"di {entries[index].get('artist', 'Unknown')}")
+        present = {song['id'] for song in entries}
+        playlist_status["moved"] = sum(1 for song_id in to_add if song_id in present)
+        if playlist_status["moved"]:
+            self.logger.info(f"{playlist_status['moved']} brani spostati per seguire l'ordine della playlist Spotify")
+        playlist_status["to_remove"], playlist_status["to_add"], playlist_status["target"] = to_remove, to_add, target
+
+    def update_navidrome_playlist(self, n_playlist_info: dict, to_add: list, to_remove: list, target: list = None) -> dict:
+        """
+        Applica le modifiche a una playlist Navidrome con il minor numero di richieste: se target è indicato
+        e riscrivere l'intera playlist (createPlaylist) costa meno degli updatePlaylist, la sostituisce con target.
+        Args:
+            n_playlist_info (dict): La playlist Navidrome ('id', 'name').
+            to_add (list): ID delle canzoni da aggiungere in fondo.
+            to_remove (list): Indici delle canzoni da togliere.
+            target (list, opzionale): Il contenuto finale della playlist, nell'ordine desiderato.
+        Returns:
+            bool: True se la playlist è stata aggiornata o non c'era nulla da modificare, False in caso di errore.
+        """
+        if not to_add and not to_remove:
+            return True
+        response = None
+        if target:
+            chunk_size = self.navidrome_client.ids_per_request()
+            rewrite = rewrite_requests(target, chunk_size)
+            update = update_requests(to_remove, to_add, chunk_size)
+            if rewrite < update:
+                self.logger.info(f"Playlist {n_playlist_info.get('name')} riscritta con {rewrite} richieste "
+                                 f"invece di {update}")
+                response = self.navidrome_client.create_playlist(n_playlist_info['name'], n_playlist_info['id'], target)
+        if response is None:
+            response = self.navidrome_client.add_songs_to_playlist(n_playlist_info['id'], to_add, to_remove)
+        return response.get("subsonic-response", {}).get("status") == "ok"
+
     def get_navidrome_playlist_info(self, selected_playlist):
         # Estrae le informazioni della playlist da Navidrome
         navidrome_playlist = self.select_navidrome_playlist(selected_playlist)
+        if navidrome_playlist.get('planned'):
+            return navidrome_playlist
         if not navidrome_playlist or not navidrome_playlist.get('id'):
             print(f"❌ Impossibile creare o trovare la playlist in Navidrome. {navidrome_playlist}")
             self.logger.error("Impossibile creare o trovare la playlist in Navidrome.")
@@ -148,21 +859,24 @@ class PlaylistDownloader:
         n_playlist_info = self.navidrome_client.get_playlist_info(navidrome_playlist['id'])
         return n_playlist_info
 
-    def song_in_playlist(self, selected_n_song: dict, navidrome_playlist: dict, playlist_status: dict) -> bool:
+    def song_in_playlist(self, selected_n_song: dict, navidrome_playlist: dict, playlist_index: dict, navidrome_songs_to_keep: set) -> bool:
+        """
+        Verifica se una canzone è già nella playlist Navidrome o è già stata aggiunta/mantenuta in questa analisi.
+        Args:
+            selected_n_song (dict): La canzone Navidrome selezionata.
+            navidrome_playlist (dict): La playlist Navidrome.
+            playlist_index (dict): Indice della playlist creato da build_playlist_index.
+            navidrome_songs_to_keep (set): ID delle canzoni già mantenute o da aggiungere.
+        """
         s_id = selected_n_song['id']
         s_title = selected_n_song.get('title')
-        s_artist = selected_n_song['artist']
-        if s_id in playlist_status["to_keep"]:
-            self.logger.debug(f"Song already in playlist: {navidrome_playlist.get('name', "")}")
+        s_artist = selected_n_song.get('artist')
+        if s_id in navidrome_songs_to_keep:
+            self.logger.debug(f"Song already kept or added to playlist: {navidrome_playlist.get('name', "")}")
             return True
-        elif s_id in playlist_status["to_add"]:
-            self.logger.debug(f"Song will be already added to playlist: {navidrome_playlist.get('name', "")}")
+        elif s_id in playlist_index["ids"]:
+            self.logger.debug(f"Song already in playlist: {navidrome_playlist.get('name', "")}")
             return True
-        else:
-            for navidrome_playlist_song in navidrome_playlist.get('entry', []):
-                if s_id == navidrome_playlist_song['id']:
-                    self.logger.debug(f"Song already in playlist: {navidrome_playlist.get('name', "")}")
-                    return True
         self.logger.info(f"Brano {s_title}({s_artist}) assente dalla playlist Navidrome -> {navidrome_playlist.get('name', "")}")
         return False
 
@@ -178,18 +892,258 @@ class PlaylistDownloader:
             """
             self.logger.info(f"Starting synchronization for playlist: {selected_playlist['name']}")
             # Get playlist info
-            playlist_info = self.analyse_playlist_difference(selected_playlist)
-            # Download missing songs
-            self.download_songs(playlist_info, selected_playlist)
+            with self.sync_lock:
+                # A playlist chosen by hand is analysed even if unchanged
+                playlist_info = self.analyse_playlist_difference(selected_playlist, force=True)
+                # Download missing songs
+                self.download_songs([(selected_playlist, playlist_info)])
+                self.link_downloaded_songs([(selected_playlist, playlist_info)])
             return playlist_info
 
-    def download_songs(self, playlist_info, selected_playlist):
-        dir_safe_name = clean_directory_name(selected_playlist['name'])
-        downloads = self.spotify_client.download_songs(playlist_info["to_download"], self.download_path, dir_safe_name)
-        if downloads:
-            print(f"📂 Scaricati {len(downloads)} brani su {len(playlist_info["to_download"])} richiesti.")
+    def queue_download(self, track: dict, selected_playlist: dict, playlist_status: dict):
+        """
+        Pianifica subito il download di un brano mancante. Un brano presente in più playlist viene scaricato
+        una sola volta (nella cartella della prima playlist che lo contiene) e il risultato viene
+        riportato in "downloaded" di ogni playlist che lo contiene.
+        Args:
+            track (dict): La traccia Spotify da scaricare.
+            selected_playlist (dict): La playlist Spotify che contiene la traccia.
+            playlist_status (dict): Lo stato della sincronizzazione della playlist.
+        """
+        if self.dry_run:
+            return
+        key = track_key(track)
+        if key not in self.shared.pending_downloads:
+            path = self.find_local_file(track)
+            if path:
+                # Already on disk: it only has to be linked after the next scan
+                result = new_result(track, os.path.dirname(path))
+                result.update(outcome='local', path=path, state='done')
+                future = Future()
+                future.set_result(result)
+                self.shared.pending_downloads[key] = {"track": track, "future": future, "owners": [playlist_status]}
+                return
+            if self.shared_state.retry_time(track) > time.time():
+                self.logger.debug(f"Download rimandato (fallito di recente): {track['search_string']}")
+                return
+            destination_path = os.path.join(self.download_path, clean_directory_name(selected_playlist['name']))
+            future = self.download_scheduler.submit(track, destination_path, on_result=self.record_download_result,
+                                                    playlist_id=selected_playlist['id'])
+            self.shared.pending_downloads[key] = {"track": track, "future": future, "owners": [playlist_status]}
+            return
+        pending = self.shared.pending_downloads[key]
+        if not any(owner is playlist_status for owner in pending["owners"]):
+            pending["owners"].append(playlist_status)
+            # The queue row belongs to the track being downloaded, maybe another one with the same ISRC
+            self.download_scheduler.add_playlist(pending["track"], selected_playlist['id'])
+
+    def download_songs(self, synced: list) -> list:
+        """
+        Attende i download pianificati durante l'analisi (pianificando quelli eventualmente mancanti)
+        e riporta i brani scaricati nelle rispettive playlist.
+        Args:
+            synced (list): Lista di tuple (playlist Spotify, stato della sincronizzazione).
+        Returns:
+            list: I risultati dei download riusciti.
+        """
+        for selected_playlist, playlist_info in synced:
+            for track in playlist_info["to_download"]:
+                self.queue_download(track, selected_playlist, playlist_info)
+        pending_downloads, self.shared.pending_downloads = self.shared.pending_downloads, {}
+        if not pending_downloads:
+            return []
+        requested = sum(len(pending["owners"]) for pending in pending_downloads.values())
+        self.logger.info(f"Brani da scaricare: {len(pending_downloads)} unici su {requested} richiesti dalle playlist.")
+        downloads = []
+        local = 0
+        for pending in pending_downloads.values():
+            try:
+                result = pending["future"].result()
+            except CancelledError:
+                continue
+            if result['outcome'] == 'local':
+                local += 1
+            elif result['outcome'] != 'downloaded':
+                continue
+            downloads.append(result)
+            for playlist_info in pending["owners"]:
+                playlist_info["downloaded"].append(result)
+        if local:
+            print(f"📁 {local} brani già presenti nella cartella dei download, non scaricati di nuovo.")
+        if len(downloads) > local:
+            print(f"📂 Scaricati {len(downloads) - local} brani su {len(pending_downloads) - local} richiesti.")
         else:
             self.logger.debug("❌ Nessun brano scaricato. Tutti i brani erano già presenti in Navidrome.")
+        return downloads
+
+    def link_downloaded_songs(self, synced: list, linked: dict = None):
+        """
+        Avvia una scansione Navidrome dopo i download, ne attende la fine e aggiunge i brani appena
+        scaricati alle rispettive playlist, con un solo updatePlaylist per playlist. Aggiorna infine
+        i brani ancora mancanti di ogni playlist, ora che l'esito dei download è noto.
+        Args:
+            synced (list): Lista di tuple (playlist Spotify, stato della sincronizzazione).
+            linked (dict, opzionale): I brani scaricati già trovati in Navidrome (vedi find_downloaded_songs),
+                ad esempio da un altro account dopo la stessa scansione; se non indicato vengono cercati.
+        """
+        if self.stopping.is_set():
+            # The downloaded songs stay 'done' in the persistent queue and are linked after the restart
+            self.logger.info("Arresto in corso: i brani scaricati saranno collegati al prossimo avvio.")
+            return
+        if linked is None:
+            linked = self.find_downloaded_songs(synced)
+        for selected_playlist, playlist_info in synced:
+            missing = playlist_info["to_download"] + playlist_info["lookup_failed"]
+            if not missing or not playlist_info["navidrome_id"]:
+                continue
+            # A recording shared by several playlists is downloaded under the track of the first one:
+            # each playlist finds it through its own tracks, by ISRC
+            found = {track['id']: linked[track_key(track)] for track in missing if track_key(track) in linked}
+            fields = self.pending_state([track for track in missing if track['id'] not in found])
+            if found:
+                with metrics.timer("sync_phase_seconds", phase="playlist_update"):
+                    song_ids = self.link_songs(playlist_info, found)
+                if song_ids is None:
+                    # The songs are in the library but not in the playlist: still pending, added by the next cycle
+                    self.logger.error(f"Brani scaricati non aggiunti alla playlist Navidrome {selected_playlist['name']}: "
+                                      f"verranno aggiunti al prossimo ciclo.")
+                    print(f"❌ Brani scaricati non aggiunti alla playlist '{selected_playlist['name']}' in Navidrome.")
+                    self.state.save_playlist_state(selected_playlist['id'], **self.pending_state(missing))
+                    continue
+                playlist_info["to_add"].extend(song_ids)
+                fields["navidrome_changed"] = self.navidrome_client.get_playlist_info(playlist_info["navidrome_id"]).get('changed')
+            self.state.save_playlist_state(selected_playlist['id'], **fields)
+        # Every download of the cycle has been handled: finished ones leave the persistent queue
+        self.shared_state.remove_downloads()
+
+    def link_songs(self, playlist_info: dict, found: dict) -> list:
+        """
+        Aggiunge alla playlist Navidrome le canzoni appena scaricate: in fondo, o nella loro posizione
+        nell'ordine Spotify se la playlist lo segue (rileggendola, per partire dal suo contenuto effettivo).
+        Args:
+            playlist_info (dict): Lo stato della sincronizzazione della playlist.
+            found (dict): ID della traccia Spotify -> ID della canzone Navidrome, per i brani scaricati della playlist.
+        Returns:
+            list: ID delle canzoni aggiunte alla playlist, None se l'aggiornamento non è riuscito.
+        """
+        song_ids = ordered_ids(found.values())
+        if playlist_info["target"] is not None:
+            n_playlist_info = self.navidrome_client.get_playlist_info(playlist_info["navidrome_id"])
+            if n_playlist_info.get('id'):
+                current = [song['id'] for song in n_playlist_info.get('entry', [])]
+                target = ordered_ids(navidrome_id or found.get(spotify_id)
+                                     for spotify_id, navidrome_id in playlist_info["order"])
+                to_remove, to_add = edit_script(current, target)
+                if not self.update_navidrome_playlist(n_playlist_info, to_add, to_remove, target):
+                    return None
+                # Only the songs that were not in the playlist yet count as added
+                kept, present = set(target), set(current)
+                return [song_id for song_id in song_ids if song_id in kept and song_id not in present]
+        if not self.update_navidrome_playlist({'id': playlist_info["navidrome_id"]}, song_ids, []):
+            return None
+        return song_ids
+
+    def find_downloaded_songs(self, synced: list) -> dict:
+        """
+        Cerca in Navidrome, dopo una nuova scansione, i brani scaricati durante la sincronizzazione.
+        Returns:
+            dict: Chiave della traccia Spotify (vedi track_key) -> ID della canzone Navidrome, per i brani trovati.
+        """
+        tracks = {}
+        scan_needed = False
+        for _, playlist_info in synced:
+            for result in playlist_info["downloaded"]:
+                tracks[track_key(result['track'])] = result['track']
+                scan_needed = scan_needed or self.needs_scan(result)
+        if not tracks or not self.rescan_after_download:
+            return {}
+        scanned = True
+        if scan_needed:
+            with metrics.timer("sync_phase_seconds", phase="scan"):
+                scanned = self.wait_for_scan()
+        if not scanned:
+            self.logger.warning("Scansione Navidrome non completata: i nuovi brani saranno collegati al prossimo ciclo.")
+            return {}
+        tracks = list(tracks.values())
+        with metrics.timer("sync_phase_seconds", phase="link"):
+            songs_found = self.navidrome_client.search_songs(tracks)
+        linked = {}
+        for track, n_songs in zip(tracks, songs_found):
+            if n_songs is None:
+                self.logger.warning(f"Ricerca fallita per il brano scaricato {track['search_string']}: "
+                                    f"sarà collegato al prossimo ciclo.")
+                continue
+            selected_song = self.select_song(n_songs, track)
+            if selected_song:
+                self.shared_state.save_match(track, selected_song['id'])
+                if self.library_index_ready:
+                    self.library_index.add(selected_song)
+                linked[track_key(track)] = selected_song['id']
+            else:
+                self.logger.info(f"Brano scaricato non ancora presente in Navidrome: {track['search_string']}")
+        self.logger.info(f"Collegati {len(linked)} brani scaricati su {len(tracks)}.")
+        return linked
+
+    def wait_for_scan(self) -> bool:
+        """
+        Avvia la scansione della libreria Navidrome e attende che termini.
+        Returns:
+            bool: True se la scansione è terminata entro scan_timeout secondi.
+        """
+        started = time.time()
+        if not self.navidrome_client.start_scan():
+            return False
+        deadline = time.monotonic() + self.scan_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.scan_poll_interval)
+            status = self.navidrome_client.get_scan_status()
+            if not status:
+                return False
+            if not status.get('scanning'):
+                self.last_scan_at = started
+                self.logger.info(f"Scansione Navidrome completata ({status.get('count', '?')} brani).")
+                return True
+        return False
+
+    def needs_scan(self, result: dict) -> bool:
+        """Indica se un brano scaricato (o trovato su disco) può non essere ancora nella libreria Navidrome."""
+        if result['outcome'] != 'local':
+            return True
+        try:
+            stat = os.stat(result['path'])
+        except OSError:
+            return False
+        return max(stat.st_mtime, stat.st_ctime) >= self.last_scan_at
+
+    def find_local_file(self, track: dict) -> str|None:
+        """Cerca nella cartella dei download un file già scaricato per la traccia (vedi DownloadIndex)."""
+        if not self.download_index:
+            return None
+        with metrics.timer("sync_phase_seconds", phase="local_index"):
+            self.download_index.refresh()
+        path = self.download_index.find(track)
+        if path:
+            metrics.inc("downloads_total", outcome="local")
+            self.logger.info(f"Brano già presente su disco, download evitato: {track['search_string']} ({path})")
+        return path
+
+    def record_download_result(self, result: dict):
+        """Registra nello stato persistente l'esito del download di un brano."""
+        self.shared_state.record_download(result['track'], result['outcome'], result['detail'])
+        metrics.inc("downloads_total", outcome=result['outcome'])
+        if result['path'] and os.path.isfile(result['path']):
+            metrics.inc("download_bytes_total", os.path.getsize(result['path']))
+        if result['outcome'] == 'downloaded':
+            self.shared_state.clear_failures(result['track']['id'])
+            if self.download_index and result['path']:
+                self.download_index.add(result['path'], result['track'])
+        elif result['outcome'] == 'unavailable':
+            # Not a problem of the track: retry at the next cycle without backing off
+            self.logger.error(f"Download di {result['track']['search_string']} non eseguito: {result['detail']}")
+        else:
+            next_retry = self.shared_state.record_failure(result['track'], f"{result['outcome']}: {result['detail']}")
+            self.logger.info(f"Nuovo tentativo per {result['track']['search_string']} dopo il "
+                             f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(next_retry))}")
 
     def select_navidrome_playlist(self, spotify_playlist: dict) -> dict:
         """
@@ -199,7 +1153,7 @@ class PlaylistDownloader:
         Returns:
             dict: Le informazioni della playlist Navidrome creata o trovata.
         """
-        navidrome_playlists = self.navidrome_client.list_playlists()
+        navidrome_playlists = self.get_navidrome_playlists()
         if navidrome_playlists is None:
             print("❌ Impossibile recuperare le playlist da Navidrome.")
             self.logger.error("Impossibile recuperare le playlist da Navidrome.")
@@ -210,15 +1164,23 @@ class PlaylistDownloader:
             self.logger.error("Playlist Spotify senza nome. Impossibile procedere.")
             return {}
         for navidrome_playlist in navidrome_playlists:
+            if navidrome_playlist.get('owner', self.navidrome_client.username) != self.navidrome_client.username:
+                # Public playlist of another user (e.g. another account): it cannot be modified
+                continue
             if navidrome_playlist.get('name') == spotify_playlist['name']:
                 self.logger.debug(f"Playlist Navidrome esistente: {navidrome_playlist['name']} ({navidrome_playlist['id']})")
                 selected_navidrome_playlist = navidrome_playlist
                 break
+        if not selected_navidrome_playlist and self.dry_run:
+            # Created when the plan is applied
+            return {'id': None, 'name': spotify_playlist['name'], 'entry': [], 'planned': True}
         if not selected_navidrome_playlist:
             print(f"Creazione della nuova playlist Navidrome: {spotify_playlist['name']}")
             self.logger.info(f"Creazione della nuova playlist Navidrome: {spotify_playlist['name']}")
             data = self.navidrome_client.create_playlist(spotify_playlist['name'])
             selected_navidrome_playlist = data.get("subsonic-response", {}).get("playlist", {})
+            if selected_navidrome_playlist.get('id') and self.navidrome_playlists is not None:
+                self.navidrome_playlists.append(selected_navidrome_playlist)
 
         if not selected_navidrome_playlist or not selected_navidrome_playlist.get('id'):
             print(f"❌ Impossibile creare o trovare la playlist in Navidrome. {selected_navidrome_playlist}")
@@ -226,30 +1188,37 @@ class PlaylistDownloader:
             return {}
 
         # Verifica se la playlist è pubblica, se non lo è la rende pubblica
-        sp_info = self.navidrome_client.get_playlist_info(selected_navidrome_playlist['id'])
-        if not sp_info.get('public', False):
+        if not selected_navidrome_playlist.get('public', False) and not self.dry_run:
             self.navidrome_client.set_playlist_public(selected_navidrome_playlist['id'], True)
+            selected_navidrome_playlist['public'] = True
 
         return selected_navidrome_playlist
 
+    def get_navidrome_playlists(self) -> list|None:
+        """
+        Restituisce le playlist Navidrome, riutilizzando quelle lette all'inizio del ciclo di sincronizzazione.
+        """
+        if self.navidrome_playlists is not None:
+            return self.navidrome_playlists
+        return self.navidrome_client.list_playlists()
+
     def select_song(self, n_songs_found: list, sp_song: dict) -> dict:
-        """Select the most appropriate song from the search results."""
+        """
+        Select the most appropriate song from the search results: the ISRC matches or, without them, the
+        candidates accepted by SongMatcher (title, artists, album and duration); the best quality among them.
+        """
         if not n_songs_found:
             # No songs found - Required download
             return {}
-        elif len(n_songs_found) == 1:
-            # Only one song found - return it
-            if not isrc_match(sp_song, n_songs_found[0]):
-                self.logger.debug(f"One possible song found - No exact ISRC match [{sp_song['search_string']}]")
-            return n_songs_found[0]
-        else:
-            # Multiple songs found - try to get the best match
-            short_list = self.exact_song_matches(n_songs_found, sp_song)
-            if short_list:
-                return self.extract_song_best_quality(short_list)
-            else:
-                self.logger.warning(f"No ISRC match found for {sp_song['search_string']}")
-                return self.extract_song_best_quality(n_songs_found)
+        short_list = self.exact_song_matches(n_songs_found, sp_song)
+        if not short_list:
+            short_list = self.matcher.best_matches(sp_song, n_songs_found)
+            if not short_list:
+                metrics.inc("match_rejected_total")
+                self.logger.info(f"No reliable match for {sp_song['search_string']} among {len(n_songs_found)} candidates")
+                return {}
+            self.logger.debug(f"No ISRC match for {sp_song['search_string']}, matched on title/artist/duration")
+        return self.extract_song_best_quality(short_list)
 
 
     def exact_song_matches(self, n_songs_found, sp_song: dict) -> list:
@@ -266,16 +1235,51 @@ class PlaylistDownloader:
         return max(n_songs_found, key=evaluate_song_quality)
 
     def remove_duplicates_from_playlist(self, playlist_info)-> list:
-        song_id = []
+        song_id = set()
         song_index_to_remove = []
         for index, song in enumerate(playlist_info.get('entry', [])):
             if song['id'] not in song_id:
-                song_id.append(song['id'])
+                song_id.add(song['id'])
             else:
                 self.logger.info(f"Rimozione duplicato: {song['title']} di {song['artist']}")
                 song_index_to_remove.append(index)
         return song_index_to_remove
 
+def new_playlist_status(selected_playlist: dict) -> dict:
+    """
+    Stato iniziale della sincronizzazione di una playlist (vedi analyse_playlist_difference).
+    """
+    return {
+        "name": selected_playlist['name'],
+        "total_tracks": selected_playlist['tracks_total'],
+        # Tracks that need to be downloaded from Spotify
+        "to_download": [],
+        # Tracks that need to be added to the Navidrome playlist
+        "to_add": [],
+        # Tracks that need to be removed from the Navidrome playlist
+        "to_remove": [],
+        # Tracks that are already present in Navidrome playlist
+        "to_keep": [],
+        # Spotify order: (Spotify track ID, Navidrome song ID or None while the song is missing)
+        "order": [],
+        # Navidrome song IDs in the Spotify order, when the update reproduces it (see plan_playlist_order)
+        "target": None,
+        # Songs already in the playlist removed and added again at their new position
+        "moved": 0,
+        # Tracks downloaded during this synchronization
+        "downloaded": [],
+        # Tracks whose lookup failed (network or server errors): retried at the next cycle
+        "lookup_failed": [],
+        # ID of the Navidrome playlist
+        "navidrome_id": None,
+        # True if the playlist did not change since the last synchronization
+        "skipped": False,
+        # True if the analysis was interrupted (see cancel): the Navidrome playlist was not modified
+        "cancelled": False,
+        # True if the synchronization failed (Navidrome errors, update not applied): retried after a backoff
+        "failed": False
+    }
+
 def clean_directory_name(dir_name: str) -> str:
     """
     Cleans the directory name by removing invalid characters and extra whitespace.
@@ -290,6 +1294,28 @@ def clean_directory_name(dir_name: str) -> str:
     clean_name = re.sub(r'\s+', ' ', clean_name).strip()
     return clean_name
 
+def track_key(spotify_song: dict) -> str:
+    """
+    Chiave che identifica la stessa registrazione anche tra tracce Spotify diverse (ISRC, altrimenti ID).
+    """
+    return spotify_song.get('isrc') or spotify_song['id']
+
+def build_playlist_index(navidrome_playlist: dict) -> dict:
+    """
+    Indicizza le canzoni di una playlist Navidrome per confronti in tempo costante.
+    Args:
+        navidrome_playlist (dict): Dizionario contenente le informazioni della playlist Navidrome.
+    Returns:
+        dict: 'by_isrc' (ISRC -> prima canzone della playlist con quell'ISRC) e 'ids' (insieme degli ID presenti).
+    """
+    by_isrc = {}
+    ids = set()
+    for navidrome_song in navidrome_playlist.get('entry', []):
+        ids.add(navidrome_song['id'])
+        for isrc in navidrome_song.get('isrc') or []:
+            by_isrc.setdefault(isrc, navidrome_song)
+    return {"by_isrc": by_isrc, "ids": ids}
+
 def find_song_by_isrc(spotify_song: dict, navidrome_playlist: dict) -> dict:
     """
     Trova una canzone nella playlist di Navidrome basandosi sull'ISRC.
@@ -0,0 +1,157 @@
+import logging
+import random
+import threading
+import time
+from StateStore import StateStore
+
+# Sync request that matches every playlist
+ALL_PLAYLISTS = "*"
+
+
+class PlaylistScheduler:
+    """
+    Decide quando sincronizzare ogni playlist. Ogni playlist ha una propria scadenza: l'intervallo è
+    proporzionale al tempo trascorso dall'ultima modifica (una playlist cambiata un'ora fa viene controllata
+    dopo mezz'ora, una ferma da mesi ogni max_interval), con un po' di jitter per distribuire il lavoro.
+    Le playlist appena cambiate su Spotify (snapshot_id diverso) e quelle richieste con "sync now" hanno la precedenza.
+    """
+
+    def __init__(self, config: dict, state: StateStore):
+        self.logger = logging.getLogger("PlaylistScheduler")
+        self.state = state
+        options = config["download"]
+        self.min_interval = options.get("min_interval", options.get("pause", 15)) * 60
+        self.max_interval = options.get("max_interval", 6 * 60) * 60
+        # Fraction of the time since the last change used as interval
+        self.change_factor = options.get("interval_factor", 0.5)
+        # Maximum wait between two checks of the sync requests (seconds)
+        self.tick = options.get("schedule_tick", 60)
+        # Playlists synchronized by schedule in a single cycle (0 = no limit); changed and requested ones are not limited
+        self.max_per_cycle = options.get("max_playlists_per_cycle", 0)
+        # Reentrant: request_sync can be called by a signal handler on the thread holding the lock
+        self.lock = threading.RLock()
+        self.requests = set()
+        self.wake = threading.Event()
+        # First due time among the selected playlists (None = unknown, check now: before the first cycle)
+        self.next_wake = None
+
+    def request_sync(self, playlist: str = ALL_PLAYLISTS):
+        """
+        Chiede di sincronizzare subito una playlist (nome o ID Spotify) o tutte, svegliando il ciclo di attesa.
+        Può essere chiamato da qualsiasi thread (o da un gestore di segnali).
+        """
+        with self.lock:
+            self.requests.add(playlist)
+        self.wake.set()
+
+    def take_requests(self) -> set:
+        """Restituisce e azzera le richieste di sincronizzazione, incluse quelle registrate da altri processi."""
+        requested = set(self.state.pop_sync_requests())
+        with self.lock:
+            requested |= self.requests
+            self.requests.clear()
+        return requested
+
+    def due_playlists(self, playlists: list, requested: set, now: float = None) -> tuple:
+        """
+        Seleziona, in ordine di priorità, le playlist da sincronizzare in questo ciclo.
+        Args:
+            playlists (list): Playlist Spotify selezionate (con 'id', 'name', 'snapshot_id').
+            requested (set): Playlist richieste esplicitamente (nomi o ID, ALL_PLAYLISTS per tutte).
+            now (float, opzionale): Istante di riferimento.
+        Returns:
+            tuple: (playlist da sincronizzare, insieme degli ID da analizzare anche se invariate).
+        """
+        now = time.time() if now is None else now
+        forced, changed, scheduled = [], [], []
+        self.next_wake = None
+        for playlist in playlists:
+            stored = self.state.get_playlist_state(playlist['id'])
+            if ALL_PLAYLISTS in requested or playlist['id'] in requested or playlist['name'] in requested:
+                forced.append(playlist)
+            elif stored and stored['failures'] and (stored['next_due'] or 0) > now:
+                # Failed recently: retried after the backoff even if changed (see schedule_failure)
+                self.note_due(stored['next_due'])
+            elif not stored or stored['snapshot_id'] != playlist.get('snapshot_id'):
+                changed.append(playlist)
+            elif (stored['next_due'] or 0) <= now:
+                scheduled.append((stored['next_due'] or 0, playlist))
+            else:
+                self.note_due(stored['next_due'])
+        if self.next_wake is None:
+            # Nothing waiting (e.g. no selected playlists): the playlists are listed again after min_interval,
+            # not at every tick; the ones synchronized now are scheduled earlier by schedule
+            self.note_due(now + self.min_interval)
+        scheduled.sort(key=lambda item: item[0])
+        if self.max_per_cycle and len(scheduled) > self.max_per_cycle:
+            # The others are still due: check again as soon as possible
+            scheduled = scheduled[:self.max_per_cycle]
+            self.note_due(now)
+        due = forced + changed + [playlist for _, playlist in scheduled]
+        return due, {playlist['id'] for playlist in forced}
+
+    def schedule(self, playlist: dict, playlist_status: dict, now: float = None) -> float:
+        """
+        Calcola e memorizza la prossima scadenza di una playlist appena sincronizzata.
+        Args:
+            playlist (dict): La playlist Spotify.
+            playlist_status (dict): Il risultato della sincronizzazione.
+            now (float, opzionale): Istante di riferimento.
+        Returns:
+            float: Il timestamp della prossima sincronizzazione.
+        """
+        now = time.time() if now is None else now
+        stored = self.state.get_playlist_state(playlist['id'])
+        # Songs still missing are not a change: a playlist waiting for a download stays cold
+        changed = not playlist_status["skipped"] and any(
+            playlist_status[key] for key in ("to_add", "to_remove", "downloaded")
+        )
+        changed_at = now if changed or not stored.get('changed_at') else stored['changed_at']
+        interval = min(self.max_interval, max(self.min_interval, (now - changed_at) * self.change_factor))
+        # Jitter spreads playlists with the same interval over time
+        next_due = now + interval * random.uniform(0.9, 1.0)
+        if stored.get('pending') and stored.get('retry_at'):
+            # Missing songs that can be downloaded again before the next check
+            next_due = min(next_due, max(stored['retry_at'], now + self.min_interval))
+        self.state.schedule_playlist(playlist['id'], next_due, changed_at)
+        self.note_due(next_due)
+        self.logger.debug(f"Prossima sincronizzazione di {playlist['name']} tra {(next_due - now) / 60:.0f} minuti")
+        return next_due
+
+    def schedule_failure(self, playlist: dict, now: float = None) -> float:
+        """
+        Pianifica un nuovo tentativo per una playlist la cui sincronizzazione è fallita, con backoff
+        esponenziale: min_interval dopo il primo errore, poi il doppio ad ogni errore consecutivo, fino a max_interval.
+        Args:
+            playlist (dict): La playlist Spotify.
+            now (float, opzionale): Istante di riferimento.
+        Returns:
+            float: Il timestamp del prossimo tentativo.
+        """
+        now = time.time() if now is None else now
+        stored = self.state.get_playlist_state(playlist['id'])
+        failures = (stored.get('failures') or 0) + 1
+        interval = min(self.max_interval, self.min_interval * 2 ** (failures - 1))
+        next_due = now + interval * random.uniform(0.9, 1.0)
+        self.state.schedule_playlist(playlist['id'], next_due, stored.get('changed_at') or now, failures)
+        self.note_due(next_due)
+        self.logger.info(f"Sincronizzazione di {playlist['name']} fallita ({failures} di seguito): "
+                         f"nuovo tentativo tra {(next_due - now) / 60:.0f} minuti")
+        return next_due
+
+    def note_due(self, due: float):
+        """Tiene traccia della prima scadenza tra le playlist."""
+        if self.next_wake is None or due < self.next_wake:
+            self.next_wake = due
+
+    def wait(self):
+        """Attende la prima scadenza, una richiesta di sincronizzazione o al massimo tick secondi."""
+        timeout = self.tick
+        if self.next_wake is not None:
+            timeout = min(self.tick, max(0.0, self.next_wake - time.time()))
+        if self.wake.wait(timeout):
+            self.wake.clear()
+
+    def something_due(self, requested: set) -> bool:
+        """Indica se c'è qualcosa da sincronizzare, senza interrogare Spotify."""
+        return bool(requested) or self.next_wake is None or self.next_wake <= time.time()
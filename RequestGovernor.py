@@ -0,0 +1,222 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+import requests
+import urllib3
+from Metrics import metrics
+
+
+class CircuitOpenError(Exception):
+    """Il servizio ha fallito troppe volte di seguito: le richieste vengono rifiutate senza essere inviate."""
+    pass
+
+
+class TokenBucket:
+    """Limita le richieste a rate al secondo, con raffiche fino a burst richieste."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        # Requests are suspended until this time (Retry-After)
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Attende che sia disponibile un gettone e lo consuma."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.rate > 0:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.rate <= 0:
+                        return
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Sospende tutte le richieste per seconds secondi (ad esempio dopo un 429 con Retry-After)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """
+    Apre il circuito dopo threshold errori consecutivi; dopo reset_timeout secondi lascia passare
+    una richiesta di prova, che lo richiude se va a buon fine.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Indica se una richiesta può essere inviata."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Half-open: a single probe request
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self) -> bool:
+        """Registra un errore; restituisce True se il circuito si è appena aperto."""
+        with self.lock:
+            self.failures += 1
+            was_open = self.opened_at is not None
+            if self.probing or (self.threshold > 0 and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self.probing = False
+                return not was_open
+            return False
+
+
+class RequestGovernor:
+    """
+    Governa le richieste verso un servizio (Spotify, Navidrome): limite di frequenza con token bucket,
+    nuovi tentativi con backoff esponenziale e jitter per timeout, errori di connessione, 5xx e 429
+    (rispettando Retry-After) e circuit breaker. Condiviso da tutti i thread che usano il servizio.
+    """
+
+    def __init__(self, name: str, options: dict, rate: float = 0, burst: int = 10):
+        """
+        Args:
+            name (str): Nome del servizio, usato nei log.
+            options (dict): Sezione di configurazione del servizio. Opzioni lette:
+                rate_limit (richieste al secondo, 0 = nessun limite), rate_burst, max_retries,
+                retry_base e retry_max (secondi), circuit_threshold (errori consecutivi, 0 = disattivato)
+                e circuit_reset (secondi).
+            rate (float): Limite di frequenza predefinito del servizio.
+            burst (int): Raffica massima predefinita.
+        """
+        self.name = name
+        self.logger = logging.getLogger("RequestGovernor")
+        self.bucket = TokenBucket(options.get("rate_limit", rate), options.get("rate_burst", burst))
+        self.max_retries = options.get("max_retries", 4)
+        self.retry_base = options.get("retry_base", 0.5)
+        self.retry_max = options.get("retry_max", 30)
+        self.circuit = CircuitBreaker(options.get("circuit_threshold", 5), options.get("circuit_reset", 30))
+
+    def call(self, function, *args, idempotent: bool = True, **kwargs):
+        """
+        Esegue function(*args, **kwargs) rispettando il limite di frequenza e riprovando gli errori transitori.
+        Args:
+            idempotent (bool): False per le richieste che modificano il servizio (ad esempio updatePlaylist):
+                vengono ripetute solo se non hanno mai raggiunto il servizio, perché un timeout o un 5xx
+                dopo l'invio non dice se la modifica è stata applicata.
+        Returns:
+            Il risultato di function.
+        Raises:
+            CircuitOpenError: Se il circuito è aperto.
+            Exception: L'ultimo errore di function, se non è transitorio o se i tentativi sono esauriti.
+        """
+        attempt = 0
+        while True:
+            if not self.circuit.allow():
+                raise CircuitOpenError(f"{self.name}: troppi errori consecutivi, richieste sospese "
+                                       f"per {self.circuit.reset_timeout}s")
+            self.bucket.acquire()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                transient, retry_after = classify_error(e)
+                if not transient:
+                    # The service answered: the request itself is wrong (e.g. 404)
+                    self.circuit.record_success()
+                    raise
+                if self.circuit.record_failure():
+                    metrics.inc("circuit_open_total", service=self.name)
+                    self.logger.warning(f"{self.name}: circuito aperto dopo {self.circuit.failures} errori consecutivi")
+                if attempt >= self.max_retries:
+                    raise
+                if not idempotent and not never_sent(e):
+                    # The change may have been applied: the caller finds out by reading the service again
+                    self.logger.warning(f"{self.name}: modifica non ripetuta dopo un errore transitorio ({e})")
+                    raise
+                delay = self.backoff(attempt)
+                if retry_after is not None:
+                    delay = min(retry_after, self.retry_max)
+                    self.bucket.pause(delay)
+                attempt += 1
+                metrics.inc("request_retries_total", service=self.name)
+                self.logger.info(f"{self.name}: errore transitorio ({e}), tentativo {attempt}/{self.max_retries} "
+                                 f"tra {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            self.circuit.record_success()
+            return result
+
+    def backoff(self, attempt: int) -> float:
+        """Attesa prima del tentativo successivo: backoff esponenziale con jitter completo."""
+        return random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+
+
+def classify_error(error: Exception) -> tuple:
+    """
+    Classifica un errore di una richiesta HTTP (requests o spotipy).
+    Returns:
+        tuple: (True se l'errore è transitorio e la richiesta può essere ripetuta,
+                secondi indicati da Retry-After oppure None).
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True, None
+    status = getattr(error, "http_status", None)
+    headers = getattr(error, "headers", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = response.status_code
+        headers = response.headers
+    if status is None:
+        return False, None
+    if status == 429 or status >= 500:
+        return True, parse_retry_after((headers or {}).get("Retry-After"))
+    return False, None
+
+def never_sent(error: Exception) -> bool:
+    """
+    Indica se una richiesta fallita non ha mai raggiunto il servizio: timeout o rifiuto della connessione.
+    Solo in questo caso una richiesta non idempotente può essere ripetuta senza rischi.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or isinstance(error, requests.Timeout):
+        return False
+    # requests wraps the urllib3 error (MaxRetryError, whose reason is the connection error)
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, (urllib3.exceptions.NewConnectionError, ConnectionRefusedError))
+
+def parse_retry_after(value) -> float|None:
+    """Converte l'intestazione Retry-After (secondi o data HTTP) in secondi di attesa."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
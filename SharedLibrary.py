@@ -0,0 +1,34 @@
+from DownloadIndex import DownloadIndex
+from DownloadScheduler import DownloadScheduler
+from LibraryIndex import LibraryIndex
+from StateStore import StateStore
+
+
+class SharedLibrary:
+    """
+    Componenti legati alla libreria Navidrome e alla cartella dei download invece che a un account:
+    corrispondenze Spotify → Navidrome e fallimenti (StateStore), indice della libreria, coda dei download
+    e file già scaricati. Con più account (vedi AccountPool) sono condivisi da tutti i PlaylistDownloader,
+    così un brano presente nelle playlist di più utenti viene risolto e scaricato una sola volta.
+    """
+
+    def __init__(self, config: dict, spotify_client, navidrome_client):
+        """
+        Args:
+            config (dict): La configurazione principale (state_db, sezioni navidrome e download).
+            spotify_client (Spotify): Il client usato per scaricare i brani (spotdl).
+            navidrome_client (Navidrome): Il client usato per leggere la libreria.
+        """
+        self.state = StateStore(config)
+        self.library_index = None
+        if config['navidrome'].get("library_index", True):
+            self.library_index = LibraryIndex(config, navidrome_client)
+        self.download_scheduler = DownloadScheduler(config, spotify_client, self.state)
+        # Audio files already in the download folder (tags read once per file), checked before every download
+        self.download_index = None
+        if config['download'].get("local_index", True):
+            self.download_index = DownloadIndex(config, self.state)
+        # Downloads started during the analysis: track key -> track being downloaded, future and playlists waiting for it
+        self.pending_downloads = {}
+        # Downloads left in the persistent queue by a previous run are resumed by the first cycle
+        self.queue_resumed = False
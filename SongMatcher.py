@@ -0,0 +1,179 @@
+import logging
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+# Title suffixes that do not change the recording: "(feat. X)", "- 2011 Remaster", "[Explicit]"...
+IGNORED_VERSION = re.compile(
+    r"\b(feat|ft|featuring|with|remaster|remastered|explicit|clean|single|album|radio|mono|stereo|"
+    r"deluxe|expanded|edition|bonus|version|original|\d{4})\b"
+)
+# Words that identify a different recording of the same song
+# (edits and mixes are left to the duration check: "Radio Edit" or "Original Mix" are often the same file)
+DISTINCT_VERSION = ("live", "remix", "acoustic", "instrumental", "demo", "karaoke", "unplugged", "cover",
+                    "rework", "reprise", "orchestral", "sped up", "slowed")
+SUFFIX = re.compile(r"\s*[(\[]([^)\]]*)[)\]]|\s+-\s+(.*)$")
+ARTIST_SEPARATORS = re.compile(r",|;| & | feat\.? | ft\.? | featuring | with | x | vs\.? ", re.IGNORECASE)
+
+
+class SongMatcher:
+    """
+    Decide se una canzone Navidrome corrisponde a una traccia Spotify quando l'ISRC non è disponibile.
+    Confronta titolo, artisti, album e durata dopo averli normalizzati (accenti, punteggiatura, "feat.",
+    suffissi come "Remastered" o "Radio Edit") e rifiuta le versioni diverse (live, remix, acustiche...).
+    """
+
+    def __init__(self, config: dict):
+        self.logger = logging.getLogger("SongMatcher")
+        options = config.get("matching", {})
+        # Minimum score (0-1) of a match without ISRC
+        self.threshold = options.get("threshold", 0.75)
+        # Duration difference (seconds) considered identical; beyond 5 times this the duration does not match
+        self.duration_tolerance = options.get("duration_tolerance", 3)
+        # Beyond this difference (seconds) it is another recording (radio edit, extended mix...)
+        self.max_duration_difference = options.get("max_duration_difference", 30)
+        # Minimum title similarity: artist, album and duration cannot make up for a different title
+        self.min_title = options.get("min_title_score", 0.8)
+        self.weights = {"title": 0.45, "artist": 0.3, "duration": 0.15, "album": 0.1}
+
+    def score(self, spotify_song: dict, navidrome_song: dict) -> float:
+        """
+        Calcola quanto una canzone Navidrome corrisponde a una traccia Spotify.
+        Args:
+            spotify_song (dict): La traccia Spotify ('name', 'artist', 'album', 'duration' in millisecondi, 'isrc').
+            navidrome_song (dict): La canzone Navidrome ('title', 'artist'/'artists', 'album', 'duration' in secondi, 'isrc').
+        Returns:
+            float: Punteggio tra 0 e 1 (1 se l'ISRC coincide).
+        """
+        isrc = spotify_song.get('isrc')
+        if isrc and isrc in (navidrome_song.get('isrc') or []):
+            return 1.0
+        sp_title, sp_versions = parse_title(spotify_song.get('name', ''))
+        nv_title, nv_versions = parse_title(navidrome_song.get('title', ''))
+        if sp_versions != nv_versions:
+            return 0.0
+        title = similarity(sp_title, nv_title)
+        if title < self.min_title:
+            return 0.0
+        scores = {"title": title, "artist": artist_similarity(spotify_artists(spotify_song),
+                                                                  navidrome_artists(navidrome_song))}
+        sp_duration = (spotify_song.get('duration') or 0) / 1000
+        nv_duration = navidrome_song.get('duration') or 0
+        if sp_duration and nv_duration:
+            difference = abs(sp_duration - nv_duration)
+            if difference > self.max_duration_difference:
+                return 0.0
+            scores["duration"] = max(0.0, min(1.0, (5 * self.duration_tolerance - difference) /
+                                              (4 * self.duration_tolerance)))
+        if spotify_song.get('album') and navidrome_song.get('album'):
+            scores["album"] = similarity(parse_title(spotify_song['album'])[0], parse_title(navidrome_song['album'])[0])
+        total_weight = sum(self.weights[key] for key in scores)
+        return sum(self.weights[key] * value for key, value in scores.items()) / total_weight
+
+    def best_matches(self, spotify_song: dict, navidrome_songs: list) -> list:
+        """
+        Restituisce le canzoni che corrispondono alla traccia, dalla più simile; quelle con punteggio
+        quasi uguale al migliore (la stessa registrazione in formati diversi) vengono tutte incluse.
+        """
+        scored = [(self.score(spotify_song, song), song) for song in navidrome_songs]
+        scored = [(score, song) for score, song in scored if score >= self.threshold]
+        if not scored:
+            if navidrome_songs:
+                self.logger.debug(f"Nessuna corrispondenza sufficiente per {spotify_song.get('search_string')} "
+                                  f"tra {len(navidrome_songs)} candidati")
+            return []
+        best = max(score for score, _ in scored)
+        return [song for score, song in sorted(scored, key=lambda item: -item[0]) if score >= best - 0.05]
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizza un testo per il confronto: minuscolo, senza accenti né punteggiatura.
+    """
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w]+", " ", text.casefold())
+    return re.sub(r"\s+", " ", text).strip()
+
+@lru_cache(maxsize=65536)
+def parse_title(title: str) -> tuple:
+    """
+    Separa un titolo nella parte principale normalizzata e nell'insieme delle versioni che lo distinguono.
+    Ad esempio "Song (feat. X) - Live at Wembley / 2011 Remaster" -> ("song", {"live"}).
+    """
+    versions = set()
+
+    def strip_suffix(match):
+        suffix = normalize_text(match.group(1) or match.group(2) or "")
+        distinct = {word for word in DISTINCT_VERSION if re.search(rf"\b{word}\b", suffix)}
+        if distinct:
+            versions.update(distinct)
+            return ""
+        if not suffix or IGNORED_VERSION.search(suffix):
+            return ""
+        # Part of the title, e.g. "Song (Part 2)"
+        return f" {match.group(0)}"
+
+    main = SUFFIX.sub(strip_suffix, title or "")
+    return normalize_text(main), frozenset(versions)
+
+@lru_cache(maxsize=65536)
+def split_artists(artist: str) -> tuple:
+    """Divide una stringa di artisti ("A, B feat. C") nei singoli nomi normalizzati."""
+    return tuple(name for name in (normalize_text(part) for part in ARTIST_SEPARATORS.split(artist or "")) if name)
+
+def spotify_artists(spotify_song: dict) -> tuple:
+    return split_artists(spotify_song.get('artist', ''))
+
+def navidrome_artists(navidrome_song: dict) -> tuple:
+    # 'artists' is a list of {'id', 'name'} in the API responses and a tuple of names in NavidromeSong
+    artists = tuple(normalize_text(artist if isinstance(artist, str) else artist.get('name', ''))
+                    for artist in navidrome_song.get('artists') or [])
+    return tuple(artist for artist in artists if artist) or split_artists(navidrome_song.get('artist', ''))
+
+def similarity(a: str, b: str) -> float:
+    """
+    Somiglianza tra due testi normalizzati (0-1), indipendente dall'ordine delle parole. I numeri devono
+    coincidere ("Song 2" non è "Song", "Pt. 1" non è "Pt. 2") e i testi molto diversi valgono 0.
+    """
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    words_a, words_b = a.split(), b.split()
+    if sorted(words_a) == sorted(words_b):
+        return 1.0
+    if [word for word in words_a if word.isdigit()] != [word for word in words_b if word.isdigit()]:
+        return 0.0
+    matcher = SequenceMatcher(None, a, b)
+    # Cheap upper bounds first: most candidates of a block are different songs
+    if matcher.real_quick_ratio() < 0.5 or matcher.quick_ratio() < 0.5:
+        return 0.0
+    return matcher.ratio()
+
+def artist_similarity(spotify_names: tuple, navidrome_names: tuple) -> float:
+    """Somiglianza tra gli artisti: l'artista principale di una parte deve comparire tra quelli dell'altra."""
+    if not spotify_names or not navidrome_names:
+        return 0.0
+    forward = max(similarity(spotify_names[0], name) for name in navidrome_names)
+    backward = max(similarity(navidrome_names[0], name) for name in spotify_names)
+    return max(forward, backward)
+
+def blocking_key(title: str) -> str:
+    """
+    Chiave di raggruppamento per il confronto con l'intera libreria: il titolo principale normalizzato,
+    senza spazi. Solo le canzoni con la stessa chiave vengono confrontate con SongMatcher.score.
+    """
+    return parse_title(title)[0].replace(" ", "") or (title or "").casefold()
+
+def search_query(spotify_song: dict) -> str:
+    """Testo di ricerca per Navidrome: artista principale e titolo senza "feat." e suffissi di versione."""
+    main_artist = ARTIST_SEPARATORS.split(spotify_song.get('artist', ''))[0].strip()
+
+    def strip_suffix(match):
+        suffix = normalize_text(match.group(1) or match.group(2) or "")
+        return "" if IGNORED_VERSION.search(suffix) else match.group(0)
+
+    title = SUFFIX.sub(strip_suffix, spotify_song.get('name', '')).strip()
+    return f"{main_artist} {title}".strip()
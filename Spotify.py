@@ -1,9 +1,19 @@
+import asyncio
 import logging
 import os
-import spotdl
+import threading
+import time
+import requests
 import spotipy
-from spotdl.utils.config import DOWNLOADER_OPTIONS
-from spotipy import SpotifyOAuth
+from spotipy import CacheFileHandler, SpotifyOAuth
+from Metrics import metrics
+from RequestGovernor import RequestGovernor
+from TrackRecords import SpotifyTrack
+
+
+class DownloaderUnavailable(Exception):
+    """spotdl non può essere caricato (ad esempio manca ffmpeg): nessun brano può essere scaricato."""
+    pass
 
 
 class Spotify:
@@ -11,45 +21,74 @@ class Spotify:
     def __init__(self, config):
         self.config = config
         self.logger = logging.getLogger("Spotify")
-        self.sp = self.authenticate(
-            config['spotify']['client_id'],
-            config['spotify']['client_secret'],
-            config['spotify']['redirect_uri']
-        )
+        self.sp = self.authenticate(config)
         self.logger.debug(f"Autenticato spotipy con client_id: {config['spotify']['client_id']}")
-        # Remove azlyrics that creates issues (infinite connections)
-        downloader_options = DOWNLOADER_OPTIONS
-        downloader_options['lyrics_providers']=["genius", "musixmatch"]
-        self.downloader = spotdl.Spotdl(
-            client_id=config['spotify']["client_id"],
-            client_secret=config['spotify']["client_secret"],
-            downloader_settings=downloader_options
-        )
-        self.logger.debug(f"Autenticato spotdl con client_id: {config['spotify']['client_id']}")
+        # Rate limit, retries (honouring Retry-After) and circuit breaker for the Web API
+        self.governor = RequestGovernor("Spotify", config['spotify'], rate=10, burst=5)
+        # spotdl is loaded on the first download (see load_downloader): importing it takes seconds
+        self.downloader = None
+        self.downloader_options = None
+        self.downloader_lock = threading.Lock()
+        # One spotdl downloader (and event loop) per download thread
+        self.thread_local = threading.local()
 
-    @staticmethod
-    def authenticate(client_id: str, client_secret: str, redirect_uri:str  = 'http://127.0.0.1:8888/callback') -> spotipy.Spotify:
+    def authenticate(self, config: dict) -> spotipy.Spotify:
         """
-        Autentica l\'utente su Spotify utilizzando le credenziali fornite.
+        Autentica l\'utente su Spotify utilizzando le credenziali della configurazione.
+        Il permesso user-library-read viene chiesto solo se la sincronizzazione dei brani salvati
+        (download.liked_songs) è attiva: spotipy scarta un token in cache senza tutti i permessi richiesti,
+        quindi attivarla richiede una nuova autorizzazione interattiva (da eseguire una volta fuori da Docker
+        o copiando il file della cache).
 
         Args:
-            client_id (str): ID client Spotify.
-            client_secret (str): Segreto client Spotify.
-            redirect_uri (str): URI di reindirizzamento per OAuth (default: http://127.0.0.1:8888/callback).
+            config (dict): La configurazione: sezione spotify (client_id, client_secret, redirect_uri,
+                default http://127.0.0.1:8888/callback, e cache_path, il file in cui salvare il token OAuth
+                dell'utente, uno per account) e download.liked_songs.
 
         Returns:
             spotipy.Spotify: Oggetto autenticato per interagire con l\'API Spotify.
         """
         scope = "playlist-read-private playlist-read-collaborative"
+        if config['download'].get("liked_songs", False):
+            # Liked Songs (see LikedSongs)
+            scope += " user-library-read"
         auth_manager = SpotifyOAuth(
-            client_id=client_id,
-            client_secret=client_secret,
-            redirect_uri=redirect_uri,
-            scope=scope
+            client_id=config['spotify']['client_id'],
+            client_secret=config['spotify']['client_secret'],
+            redirect_uri=config['spotify'].get("redirect_uri", 'http://127.0.0.1:8888/callback'),
+            scope=scope,
+            # OAuth token cache: one per account (see AccountPool), spotipy's .cache by default
+            cache_handler=CacheFileHandler(cache_path=config['spotify'].get("cache_path"))
         )
-        return spotipy.Spotify(auth_manager=auth_manager)
+        cached = auth_manager.cache_handler.get_cached_token()
+        if cached and not set(scope.split()) <= set(cached.get('scope', "").split()):
+            self.logger.warning("Il token Spotify salvato non ha i permessi richiesti (brani salvati): "
+                                "serve una nuova autorizzazione.")
+            print("⚠️ Serve una nuova autorizzazione Spotify per leggere i brani salvati: "
+                  "segui le istruzioni per accedere di nuovo.")
+        # Plain session without urllib3 retries: 429 and 5xx are retried by the RequestGovernor,
+        # which needs the Retry-After header of the response
+        return spotipy.Spotify(auth_manager=auth_manager, requests_session=requests.Session())
 
 
+    def call(self, function, *args, **kwargs):
+        """
+        Chiama un metodo di spotipy tramite il RequestGovernor, misurando latenza ed esito di ogni tentativo.
+        """
+        name = function.__name__
+
+        def request():
+            outcome = "error"
+            try:
+                with metrics.timer("spotify_request_seconds", endpoint=name):
+                    result = function(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                metrics.inc("spotify_requests_total", endpoint=name, outcome=outcome)
+
+        return self.governor.call(request)
+
     def list_user_playlists(self) -> list:
         """
         Restituisce la lista delle playlist dell'utente Spotify autenticato.
@@ -58,19 +97,21 @@ class Spotify:
                 - 'name': Nome della playlist
                 - 'id': ID della playlist
                 - 'tracks_total': Numero totale di brani nella playlist
+                - 'snapshot_id': Versione corrente della playlist (cambia ad ogni modifica)
         """
         playlists = []
-        results = self.sp.current_user_playlists()
+        results = self.call(self.sp.current_user_playlists)
 
         while results:
             for item in results['items']:
                 playlists.append({
                     'name': item['name'],
                     'id': item['id'],
-                    'tracks_total': item['tracks']['total']
+                    'tracks_total': item['tracks']['total'],
+                    'snapshot_id': item.get('snapshot_id')
                 })
             if results['next']:
-                results = self.sp.next(results)
+                results = self.call(self.sp.next, results)
             else:
                 break
         self.logger.debug(f"Estratte {len(playlists)} playlist Spotify.")
@@ -89,75 +130,141 @@ class Spotify:
                 - 'id': ID della traccia
                 - 'search_string': Stringa di ricerca formata da artista e titolo
         """
-        tracks = []
-        results = self.sp.playlist_items(playlist_info['id'], additional_types=['track'])
+        tracks = [track for page in self.iter_playlist_pages(playlist_info) for track in page]
+        self.logger.debug(f"Estratte {len(tracks)} tracce dalla playlist {playlist_info['name']} [{playlist_info['id']}].")
+        return tracks
 
-        while results:
-            for item in results['items']:
-                track = item.get('track')
-                if track:
-                    track_name = track['name']
-                    track_url = f"https://open.spotify.com/track/{track['id']}"
-                    artist_name = ', '.join([artist['name'] for artist in track['artists']])
-                    tracks.append({
-                        'name': track_name,
-                        'isrc': track.get('external_ids', {}).get('isrc', ''),
-                        'duration': track['duration_ms'],
-                        'album': track['album']['name'],
-                        'album_release_date': track['album'].get('release_date', ''),
-                        'url': track_url,
-                        'artist': artist_name,
-                        'id': track['id'],
-                        'search_string': f"{artist_name} - {track_name}"
-                    })
+    def iter_playlist_pages(self, playlist_info: dict):
+        """
+        Scorre le tracce di una playlist Spotify una pagina alla volta, man mano che arrivano.
+        Args:
+            playlist_info (dict): Dizionario della playlist Spotify ('id', 'name').
+        Yields:
+            list: Le tracce di una pagina, nello stesso formato di get_playlist_tracks.
+        """
+        results = self.call(self.sp.playlist_items, playlist_info['id'], additional_types=['track'])
 
+        while results:
+            yield [parse_track(item['track']) for item in results['items'] if item.get('track')]
             if results['next']:
-                results = self.sp.next(results)
+                results = self.call(self.sp.next, results)
             else:
                 break
 
-        self.logger.debug(f"Estratte {len(tracks)} tracce dalla playlist {playlist_info['name']} [{playlist_info['id']}].")
-        return tracks
-
-    def download_songs(self, m_tracks: list, destination_path: str, subdirectory: str = "") -> list:
+    def saved_tracks_page(self, offset: int = 0, limit: int = 50) -> dict:
         """
-        Scarica i brani mancanti utilizzando spotdl e li copia nella cartella di destinazione.
+        Legge una pagina dei brani salvati ("Brani che ti piacciono"), dal più recente al più vecchio.
         Args:
-            m_tracks (list): Lista di dizionari delle tracce da scaricare. Ogni dizionario deve contenere almeno la chiave 'url'.
-            destination_path (str): Percorso della cartella dove salvare i brani scaricati.
+            offset (int): Posizione del primo brano.
+            limit (int): Numero di brani (massimo 50).
         Returns:
-            list: Lista dei brani scaricati con successo.
+            dict: 'total' (numero di brani salvati) e 'items', lista di tuple (added_at, traccia)
+                con la traccia nello stesso formato di get_playlist_tracks.
         """
+        results = self.call(self.sp.current_user_saved_tracks, limit=limit, offset=offset)
+        return {
+            'total': results['total'],
+            'items': [(item['added_at'], parse_track(item['track'])) for item in results['items']]
+        }
 
-        if subdirectory:
-            destination_path = os.path.join(destination_path, subdirectory)
-        os.makedirs(destination_path, exist_ok=True)
-        songs_to_download = self.downloader.search([track['url'] for track in m_tracks])
-        downloads = []
-        current_dir = os.getcwd()
-        try:
-            os.chdir(destination_path)
-            for song in songs_to_download:
-                self.logger.info(f"Requesting download of: {song.name} - {song.artist}")
+    def load_downloader(self):
+        """
+        Importa e inizializza spotdl, una sola volta, al primo brano da scaricare.
+        Returns:
+            spotdl.Spotdl: Il client spotdl condiviso.
+        Raises:
+            DownloaderUnavailable: Se spotdl non può essere inizializzato.
+        """
+        with self.downloader_lock:
+            if self.downloader is None:
                 try:
-                    down, path = self.downloader.download(song)
-                    if path:
-                        # if self.config['download'].get("keep_cache", False):
-                        #     shutil.copy2(path, destination_path)
-                        # else:
-                        #     shutil.move(path, destination_path)
-                        downloads.append(down)
-                        print("✅ Download completato.")
-                        self.logger.info(f"Download completed: {song.name} - artista: {song.artist}")
-                    else:
-                        print(f"❌ Impossibile archiviare il file per {song.name} - {song.artist}. Download fallito.")
-                        self.logger.warning(f"Impossibile scaricare canzone - titolo: {song.name} - artista: {song.artist} (Forse V.M. 18?)")
+                    self.downloader = self.create_downloader()
                 except Exception as e:
-                    print(f"❌ Errore durante il download: {e}")
-                    self.logger.warning(
-                        f"Impossibile scaricare canzone - titolo: {song.name} - artista: {song.artist} [{e}]")
-        finally:
-            os.chdir(current_dir)
-            self.logger.info(f"Scaricate {len(downloads)} canzoni.")
-            return downloads
+                    self.logger.error(f"Impossibile inizializzare spotdl: {e}")
+                    raise DownloaderUnavailable(str(e)) from e
+        return self.downloader
+
+    def create_downloader(self):
+        """Importa spotdl e crea il client, registrando quanto costano le due fasi."""
+        started = time.perf_counter()
+        import spotdl
+        from spotdl.utils.config import DOWNLOADER_OPTIONS
+        imported = time.perf_counter()
+        # Remove azlyrics that creates issues (infinite connections)
+        downloader_options = dict(DOWNLOADER_OPTIONS)
+        downloader_options['lyrics_providers']=["genius", "musixmatch"]
+        # Progress bars of parallel downloads would overlap
+        downloader_options['simple_tui'] = True
+        downloader = spotdl.Spotdl(
+            client_id=self.config['spotify']["client_id"],
+            client_secret=self.config['spotify']["client_secret"],
+            downloader_settings=downloader_options
+        )
+        self.downloader_options = downloader_options
+        self.logger.debug(f"Autenticato spotdl con client_id: {self.config['spotify']['client_id']}")
+        self.logger.info(f"spotdl caricato in {time.perf_counter() - started:.2f}s "
+                         f"(import {imported - started:.2f}s, inizializzazione {time.perf_counter() - imported:.2f}s)")
+        return downloader
+
+    def search_songs(self, urls: list) -> list:
+        """
+        Recupera da spotdl i brani corrispondenti agli URL Spotify indicati.
+        Args:
+            urls (list): Lista di URL delle tracce Spotify.
+        Returns:
+            list: Lista di oggetti spotdl.Song (i brani non trovati vengono omessi).
+        """
+        if not urls:
+            return []
+        return self.load_downloader().search(urls)
+
+    def restore_song(self, data: dict):
+        """
+        Ricostruisce un brano spotdl salvato (song.json) da una ricerca precedente, senza ripeterla.
+        Args:
+            data (dict): Il dizionario del brano.
+        Returns:
+            spotdl.Song: Il brano.
+        """
+        self.load_downloader()
+        from spotdl.types.song import Song
+        return Song.from_dict(data)
+
+    def download_song(self, song, destination_path: str):
+        """
+        Scarica un brano direttamente nella cartella indicata, senza cambiare la directory di lavoro.
+        Può essere chiamato contemporaneamente da più thread.
+        Args:
+            song (spotdl.Song): Il brano da scaricare.
+            destination_path (str): Percorso della cartella dove salvare il brano.
+        Returns:
+            Path|None: Il percorso del file scaricato, None se il download non è riuscito.
+        """
+        downloader = getattr(self.thread_local, "downloader", None)
+        if downloader is None:
+            self.load_downloader()
+            from spotdl.download.downloader import Downloader
+            downloader = Downloader(self.downloader_options, loop=asyncio.new_event_loop())
+            self.thread_local.downloader = downloader
+        os.makedirs(destination_path, exist_ok=True)
+        downloader.settings["output"] = os.path.join(destination_path, self.downloader_options["output"])
+        self.logger.info(f"Requesting download of: {song.name} - {song.artist}")
+        _, path = downloader.download_song(song)
+        return path
+
 
+def parse_track(track: dict) -> SpotifyTrack:
+    """
+    Converte una traccia della Web API di Spotify nel record usato dal resto del programma
+    (si legge come un dizionario: 'name', 'isrc', 'duration', 'album', 'album_release_date', 'url',
+    'artist', 'id', 'search_string').
+    """
+    return SpotifyTrack(
+        name=track['name'],
+        isrc=track.get('external_ids', {}).get('isrc', ''),
+        duration=track['duration_ms'],
+        album=track['album']['name'],
+        album_release_date=track['album'].get('release_date', ''),
+        artist=', '.join([artist['name'] for artist in track['artists']]),
+        id=track['id']
+    )
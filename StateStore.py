@@ -0,0 +1,411 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from TrackRecords import SpotifyTrack
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    spotify_id TEXT PRIMARY KEY,
+    isrc TEXT,
+    navidrome_id TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS tracks_isrc ON tracks (isrc);
+CREATE TABLE IF NOT EXISTS playlists (
+    spotify_id TEXT PRIMARY KEY,
+    name TEXT,
+    snapshot_id TEXT,
+    navidrome_id TEXT,
+    navidrome_changed TEXT,
+    pending INTEGER DEFAULT 0,
+    retry_at REAL DEFAULT 0,
+    synced_at REAL,
+    changed_at REAL,
+    next_due REAL DEFAULT 0,
+    failures INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS downloads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    spotify_id TEXT,
+    isrc TEXT,
+    attempted_at REAL,
+    outcome TEXT,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS downloads_spotify_id ON downloads (spotify_id);
+CREATE TABLE IF NOT EXISTS failures (
+    spotify_id TEXT PRIMARY KEY,
+    search_string TEXT,
+    reason TEXT,
+    attempts INTEGER,
+    last_attempt REAL,
+    next_retry REAL
+);
+CREATE TABLE IF NOT EXISTS sync_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL,
+    finished_at REAL,
+    playlists INTEGER,
+    added INTEGER,
+    removed INTEGER,
+    downloaded INTEGER
+);
+CREATE TABLE IF NOT EXISTS sync_requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    playlist TEXT,
+    requested_at REAL
+);
+CREATE TABLE IF NOT EXISTS local_files (
+    path TEXT PRIMARY KEY,
+    inode INTEGER,
+    size INTEGER,
+    mtime REAL,
+    spotify_id TEXT,
+    isrc TEXT
+);
+CREATE TABLE IF NOT EXISTS download_queue (
+    spotify_id TEXT PRIMARY KEY,
+    track TEXT,
+    destination TEXT,
+    playlists TEXT,
+    state TEXT,
+    song TEXT,
+    path TEXT,
+    detail TEXT,
+    queued_at REAL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS liked_tracks (
+    spotify_id TEXT PRIMARY KEY,
+    added_at TEXT,
+    seq INTEGER,
+    track TEXT
+);
+"""
+
+# Columns added after the first release: (table, column, definition)
+MIGRATIONS = [
+    ("playlists", "changed_at", "REAL"),
+    ("playlists", "next_due", "REAL DEFAULT 0"),
+    ("playlists", "failures", "INTEGER DEFAULT 0"),
+]
+
+class StateStore:
+    """Stato persistente (SQLite) delle corrispondenze Spotify → Navidrome, delle playlist e delle sincronizzazioni."""
+
+    def __init__(self, config: dict):
+        self.logger = logging.getLogger("StateStore")
+        # Attesa (in minuti) dopo il primo fallimento di un brano, raddoppiata ad ogni nuovo fallimento
+        self.failure_backoff = config["download"].get("failure_backoff", 60) * 60
+        self.failure_backoff_max = config["download"].get("failure_backoff_max", 7 * 24 * 60) * 60
+        self.path = config["config"].get("state_db", os.path.join('Config', 'state.db'))
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(SCHEMA)
+            for table, column, definition in MIGRATIONS:
+                columns = [row['name'] for row in self.db.execute(f"PRAGMA table_info({table})")]
+                if column not in columns:
+                    self.db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        self.logger.debug(f"Stato persistente aperto: {self.path}")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def get_match(self, spotify_song: dict) -> str|None:
+        """
+        Restituisce l'ID Navidrome già associato a una traccia Spotify (per ID Spotify o, in mancanza, per ISRC).
+        Args:
+            spotify_song (dict): Dizionario della traccia Spotify ('id', 'isrc').
+        Returns:
+            str|None: L'ID della canzone Navidrome, None se la traccia non è mai stata risolta.
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT navidrome_id FROM tracks WHERE spotify_id = ? AND navidrome_id IS NOT NULL",
+                (spotify_song['id'],)
+            ).fetchone()
+            if not row and spotify_song.get('isrc'):
+                row = self.db.execute(
+                    "SELECT navidrome_id FROM tracks WHERE isrc = ? AND navidrome_id IS NOT NULL LIMIT 1",
+                    (spotify_song['isrc'],)
+                ).fetchone()
+        return row['navidrome_id'] if row else None
+
+    def save_match(self, spotify_song: dict, navidrome_id: str|None):
+        """Memorizza (o cancella, con navidrome_id None) la corrispondenza di una traccia Spotify."""
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO tracks (spotify_id, isrc, navidrome_id, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(spotify_id) DO UPDATE SET isrc = excluded.isrc, "
+                "navidrome_id = excluded.navidrome_id, updated_at = excluded.updated_at",
+                (spotify_song['id'], spotify_song.get('isrc') or None, navidrome_id, time.time())
+            )
+
+    def forget_match(self, navidrome_id: str):
+        """Cancella le corrispondenze verso una canzone Navidrome che non esiste più."""
+        with self.lock, self.db:
+            self.db.execute("UPDATE tracks SET navidrome_id = NULL WHERE navidrome_id = ?", (navidrome_id,))
+
+    def get_playlist_state(self, spotify_id: str) -> dict:
+        """Restituisce lo stato dell'ultima sincronizzazione di una playlist Spotify ({} se mai sincronizzata)."""
+        with self.lock:
+            row = self.db.execute("SELECT * FROM playlists WHERE spotify_id = ?", (spotify_id,)).fetchone()
+        return dict(row) if row else {}
+
+    def save_playlist_state(self, spotify_id: str, **fields):
+        """
+        Aggiorna lo stato di una playlist Spotify.
+        Args:
+            spotify_id (str): ID della playlist Spotify.
+            **fields: Colonne da aggiornare (name, snapshot_id, navidrome_id, navidrome_changed, pending, retry_at).
+        """
+        fields["synced_at"] = time.time()
+        columns = ", ".join(fields)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in fields)
+        with self.lock, self.db:
+            self.db.execute(
+                f"INSERT INTO playlists (spotify_id, {columns}) VALUES (?{', ?' * len(fields)}) "
+                f"ON CONFLICT(spotify_id) DO UPDATE SET {updates}",
+                (spotify_id, *fields.values())
+            )
+
+    def schedule_playlist(self, spotify_id: str, next_due: float, changed_at: float, failures: int = 0):
+        """
+        Memorizza quando la playlist deve essere sincronizzata di nuovo, quando è cambiata l'ultima volta
+        e quante sincronizzazioni consecutive sono fallite.
+        """
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO playlists (spotify_id, next_due, changed_at, failures) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(spotify_id) DO UPDATE SET next_due = excluded.next_due, changed_at = excluded.changed_at, "
+                "failures = excluded.failures",
+                (spotify_id, next_due, changed_at, failures)
+            )
+
+    def request_sync(self, playlist: str):
+        """
+        Chiede al processo di sincronizzazione di sincronizzare subito una playlist.
+        Args:
+            playlist (str): Nome o ID della playlist Spotify, '*' per tutte.
+        """
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO sync_requests (playlist, requested_at) VALUES (?, ?)", (playlist, time.time()))
+
+    def pop_sync_requests(self) -> list:
+        """Restituisce e cancella le richieste di sincronizzazione immediata in attesa."""
+        with self.lock, self.db:
+            rows = self.db.execute("SELECT id, playlist FROM sync_requests ORDER BY id").fetchall()
+            if rows:
+                self.db.execute("DELETE FROM sync_requests WHERE id <= ?", (rows[-1]['id'],))
+        return [row['playlist'] for row in rows]
+
+    def enqueue_download(self, spotify_song: dict, destination: str, playlist_id: str = None):
+        """
+        Aggiunge un brano alla coda persistente dei download (stato 'pending'). Un brano già in coda
+        torna 'pending' conservando il risultato della ricerca spotdl e le playlist che lo attendono.
+        Args:
+            spotify_song (dict): La traccia Spotify da scaricare.
+            destination (str): La cartella di destinazione.
+            playlist_id (str, opzionale): La playlist Spotify che attende il brano.
+        """
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute("SELECT playlists FROM download_queue WHERE spotify_id = ?",
+                                  (spotify_song['id'],)).fetchone()
+            playlists = json.loads(row['playlists']) if row else []
+            if playlist_id and playlist_id not in playlists:
+                playlists.append(playlist_id)
+            self.db.execute(
+                "INSERT INTO download_queue (spotify_id, track, destination, playlists, state, queued_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?, ?) ON CONFLICT(spotify_id) DO UPDATE SET "
+                "track = excluded.track, destination = excluded.destination, playlists = excluded.playlists, "
+                "state = 'pending', path = NULL, detail = NULL, updated_at = excluded.updated_at",
+                (spotify_song['id'], json.dumps(dict(spotify_song)), destination, json.dumps(playlists), now, now)
+            )
+
+    def add_download_playlist(self, spotify_id: str, playlist_id: str):
+        """Registra un'altra playlist che attende un brano già in coda."""
+        with self.lock, self.db:
+            row = self.db.execute("SELECT playlists FROM download_queue WHERE spotify_id = ?", (spotify_id,)).fetchone()
+            if not row or playlist_id in json.loads(row['playlists']):
+                return
+            playlists = json.loads(row['playlists']) + [playlist_id]
+            self.db.execute("UPDATE download_queue SET playlists = ? WHERE spotify_id = ?",
+                            (json.dumps(playlists), spotify_id))
+
+    def update_download(self, spotify_id: str, state: str, **fields):
+        """
+        Aggiorna lo stato di un brano nella coda dei download.
+        Args:
+            spotify_id (str): ID della traccia Spotify.
+            state (str): 'pending', 'searching', 'downloading', 'done' o 'failed'.
+            **fields: Altre colonne da aggiornare (song come dizionario, path, detail).
+        """
+        if "song" in fields:
+            fields["song"] = json.dumps(fields["song"]) if fields["song"] is not None else None
+        fields.update(state=state, updated_at=time.time())
+        updates = ", ".join(f"{column} = ?" for column in fields)
+        with self.lock, self.db:
+            self.db.execute(f"UPDATE download_queue SET {updates} WHERE spotify_id = ?", (*fields.values(), spotify_id))
+
+    def list_download_queue(self, states: tuple = None) -> list:
+        """
+        Restituisce i brani nella coda dei download, nell'ordine di inserimento.
+        Args:
+            states (tuple, opzionale): Stati da includere (tutti se non indicato).
+        Returns:
+            list: Dizionari con le colonne della coda; track, song e playlists già decodificati.
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM download_queue ORDER BY queued_at").fetchall()
+        items = []
+        for row in rows:
+            if states and row['state'] not in states:
+                continue
+            item = dict(row)
+            item['track'] = SpotifyTrack.from_dict(json.loads(item['track']))
+            item['playlists'] = json.loads(item['playlists'])
+            item['song'] = json.loads(item['song']) if item['song'] else None
+            items.append(item)
+        return items
+
+    def remove_downloads(self, spotify_ids: list = None, states: tuple = ("done", "failed")) -> int:
+        """
+        Toglie dalla coda dei download i brani indicati (o, se non indicati, quelli negli stati states).
+        Returns:
+            int: Numero di brani tolti.
+        """
+        with self.lock, self.db:
+            if spotify_ids is not None:
+                return sum(self.db.execute("DELETE FROM download_queue WHERE spotify_id = ?", (spotify_id,)).rowcount
+                           for spotify_id in spotify_ids)
+            return self.db.execute(f"DELETE FROM download_queue WHERE state IN ({', '.join('?' * len(states))})",
+                                   states).rowcount
+
+    def list_local_files(self) -> dict:
+        """Restituisce l'indice dei file scaricati: percorso -> inode, size, mtime, spotify_id, isrc."""
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM local_files").fetchall()
+        return {row['path']: {key: row[key] for key in ("inode", "size", "mtime", "spotify_id", "isrc")} for row in rows}
+
+    def save_local_files(self, entries: list):
+        """Salva nell'indice dei file scaricati le voci (percorso, dizionario) indicate."""
+        if not entries:
+            return
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO local_files (path, inode, size, mtime, spotify_id, isrc) VALUES (?, ?, ?, ?, ?, ?)",
+                [(path, entry['inode'], entry['size'], entry['mtime'], entry['spotify_id'], entry['isrc'])
+                 for path, entry in entries]
+            )
+
+    def remove_local_files(self, paths: list):
+        """Toglie dall'indice dei file scaricati i percorsi non più presenti su disco."""
+        if not paths:
+            return
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM local_files WHERE path = ?", [(path,) for path in paths])
+
+    def list_liked_tracks(self) -> list:
+        """
+        Restituisce la copia locale dei brani salvati su Spotify, dal più recente al più vecchio.
+        Returns:
+            list: Tuple (added_at, traccia), come Spotify.saved_tracks_page.
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT added_at, track FROM liked_tracks ORDER BY seq DESC").fetchall()
+        return [(row['added_at'], SpotifyTrack.from_dict(json.loads(row['track']))) for row in rows]
+
+    def save_liked_tracks(self, added: list, removed: list = (), replace: bool = False):
+        """
+        Aggiorna la copia locale dei brani salvati.
+        Args:
+            added (list): Tuple (added_at, traccia) nuove, dalla più recente; vanno in cima alla lista.
+            removed (list): ID Spotify dei brani tolti.
+            replace (bool): Sostituisce l'intera copia con added.
+        """
+        with self.lock, self.db:
+            if replace:
+                self.db.execute("DELETE FROM liked_tracks")
+            self.db.executemany("DELETE FROM liked_tracks WHERE spotify_id = ?", [(spotify_id,) for spotify_id in removed])
+            top = self.db.execute("SELECT COALESCE(MAX(seq), 0) FROM liked_tracks").fetchone()[0]
+            self.db.executemany(
+                "INSERT OR REPLACE INTO liked_tracks (spotify_id, added_at, seq, track) VALUES (?, ?, ?, ?)",
+                [(track['id'], added_at, top + len(added) - position, json.dumps(dict(track)))
+                 for position, (added_at, track) in enumerate(added)]
+            )
+
+    def record_download(self, spotify_song: dict, outcome: str, detail: str = ""):
+        """Registra l'esito di un tentativo di download ('downloaded' o 'failed')."""
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO downloads (spotify_id, isrc, attempted_at, outcome, detail) VALUES (?, ?, ?, ?, ?)",
+                (spotify_song['id'], spotify_song.get('isrc') or None, time.time(), outcome, detail)
+            )
+
+    def record_failure(self, spotify_song: dict, reason: str) -> float:
+        """
+        Registra un brano non scaricabile e calcola il prossimo tentativo con backoff esponenziale.
+        Args:
+            spotify_song (dict): Dizionario della traccia Spotify.
+            reason (str): Motivo del fallimento.
+        Returns:
+            float: Timestamp del prossimo tentativo.
+        """
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute("SELECT attempts FROM failures WHERE spotify_id = ?", (spotify_song['id'],)).fetchone()
+            attempts = row['attempts'] + 1 if row else 1
+            next_retry = now + min(self.failure_backoff * 2 ** (attempts - 1), self.failure_backoff_max)
+            self.db.execute(
+                "INSERT OR REPLACE INTO failures (spotify_id, search_string, reason, attempts, last_attempt, next_retry) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (spotify_song['id'], spotify_song.get('search_string', ''), reason, attempts, now, next_retry)
+            )
+        return next_retry
+
+    def retry_time(self, spotify_song: dict) -> float:
+        """Restituisce il timestamp dal quale il brano può essere riprovato (0 se non ha fallimenti registrati)."""
+        with self.lock:
+            row = self.db.execute("SELECT next_retry FROM failures WHERE spotify_id = ?", (spotify_song['id'],)).fetchone()
+        return row['next_retry'] if row else 0
+
+    def list_failures(self) -> list:
+        """Restituisce tutti i brani nella cache dei fallimenti, ordinati per prossimo tentativo."""
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM failures ORDER BY next_retry").fetchall()
+        return [dict(row) for row in rows]
+
+    def clear_failures(self, spotify_id: str = None) -> int:
+        """
+        Cancella dalla cache dei fallimenti un brano (o tutti, se spotify_id non è indicato).
+        Returns:
+            int: Numero di voci cancellate.
+        """
+        with self.lock, self.db:
+            if spotify_id:
+                return self.db.execute("DELETE FROM failures WHERE spotify_id = ?", (spotify_id,)).rowcount
+            return self.db.execute("DELETE FROM failures").rowcount
+
+    def start_sync(self) -> int:
+        """Registra l'inizio di un ciclo di sincronizzazione e ne restituisce l'ID."""
+        with self.lock, self.db:
+            return self.db.execute("INSERT INTO sync_history (started_at) VALUES (?)", (time.time(),)).lastrowid
+
+    def finish_sync(self, sync_id: int, playlists: int, added: int, removed: int, downloaded: int):
+        """Registra la fine di un ciclo di sincronizzazione con i relativi conteggi."""
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE sync_history SET finished_at = ?, playlists = ?, added = ?, removed = ?, downloaded = ? "
+                "WHERE id = ?",
+                (time.time(), playlists, added, removed, downloaded, sync_id)
+            )
@@ -0,0 +1,40 @@
+import json
+import sys
+from TrackRecords import Record
+
+# Bitrate (kbps) used to estimate the size of the songs to download
+DEFAULT_BITRATE = 128
+
+
+def estimated_size(track: dict, bitrate: int = DEFAULT_BITRATE) -> int:
+    """Dimensione stimata (byte) del file di una traccia Spotify, dalla durata e dal bitrate in kbps."""
+    return int((track.get('duration') or 0) / 1000 * bitrate * 1000 / 8)
+
+def write_plan(entries: list, path: str):
+    """
+    Salva un piano di sincronizzazione: un oggetto JSON per riga (NDJSON), oppure un array JSON
+    se path termina con .json. Con path "-" il piano viene scritto sullo standard output.
+    """
+    if path.endswith(".json"):
+        text = json.dumps(entries, indent=2, ensure_ascii=False, default=record_dict) + "\n"
+    else:
+        text = "".join(json.dumps(entry, ensure_ascii=False, default=record_dict) + "\n" for entry in entries)
+    if path == "-":
+        sys.stdout.write(text)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+def record_dict(value) -> dict:
+    """Serializza i record delle tracce (vedi TrackRecords) come dizionari."""
+    if isinstance(value, Record):
+        return dict(value.items())
+    raise TypeError(f"{type(value).__name__} non serializzabile")
+
+def read_plan(path: str) -> list:
+    """Legge un piano salvato da write_plan (NDJSON o array JSON)."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
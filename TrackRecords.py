@@ -0,0 +1,122 @@
+import sys
+from collections.abc import Mapping
+
+
+class Record:
+    """
+    Record compatto (__slots__) usato al posto dei dizionari delle tracce Spotify e delle canzoni Navidrome,
+    che con librerie e playlist di decine di migliaia di brani occupano gran parte della memoria.
+    Si usa come il dizionario da cui è costruito (record['id'], record.get('isrc'), 'isrc' in record,
+    dict(record), {**record}): un campo assente nella risposta resta non impostato, come una chiave mancante.
+    I campi ripetuti tra molti brani (artisti, album, formato) sono internati: una sola copia per valore.
+    """
+    __slots__ = ()
+    # Stored fields, fields computed from them and fields whose strings are interned
+    FIELDS = ()
+    COMPUTED = ()
+    INTERNED = ()
+    KEYS = frozenset()
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            if key not in self.FIELDS:
+                continue
+            if key in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Costruisce il record da un dizionario (ad esempio una risposta JSON), ignorando i campi non usati."""
+        return cls(**data)
+
+    def __getitem__(self, key):
+        if key in self.KEYS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        if key in self.KEYS:
+            return getattr(self, key, default)
+        return default
+
+    def __contains__(self, key) -> bool:
+        return key in self.KEYS and hasattr(self, key)
+
+    def keys(self) -> list:
+        return [key for key in self.FIELDS + self.COMPUTED if hasattr(self, key)]
+
+    def values(self) -> list:
+        return [self[key] for key in self.keys()]
+
+    def items(self) -> list:
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (Record, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+
+class SpotifyTrack(Record):
+    """
+    Traccia Spotify (vedi Spotify.parse_track). 'url' e 'search_string' sono calcolati da ID, artista e titolo.
+    """
+    __slots__ = ('id', 'name', 'artist', 'album', 'album_release_date', 'isrc', 'duration')
+    FIELDS = __slots__
+    COMPUTED = ('url', 'search_string')
+    INTERNED = ('artist', 'album', 'album_release_date')
+    KEYS = frozenset(FIELDS + COMPUTED)
+
+    @property
+    def url(self) -> str:
+        return f"https://open.spotify.com/track/{self.id}"
+
+    @property
+    def search_string(self) -> str:
+        return f"{self.artist} - {self.name}"
+
+
+class NavidromeSong(Record):
+    """
+    Canzone Navidrome con i soli campi usati per confronti, corrispondenze e qualità (vedi evaluate_song_quality).
+    'isrc' è una tupla di codici e 'artists' una tupla di nomi.
+    """
+    __slots__ = ('id', 'title', 'artist', 'artists', 'album', 'duration', 'isrc', 'bitRate', 'samplingRate',
+                 'bitDepth', 'suffix')
+    FIELDS = __slots__
+    INTERNED = ('artist', 'album', 'suffix')
+    KEYS = frozenset(FIELDS)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        song = cls(**data)
+        isrc = data.get('isrc')
+        if isrc:
+            song.isrc = (isrc,) if isinstance(isrc, str) else tuple(isrc)
+        if data.get('artists'):
+            song.artists = tuple(sys.intern(artist.get('name', '')) if isinstance(artist, dict) else artist
+                                 for artist in data['artists'])
+        return song
+
+
+Mapping.register(Record)
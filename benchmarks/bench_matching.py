@@ -0,0 +1,162 @@
+"""
+Benchmark della corrispondenza dei brani senza ISRC (SongMatcher).
+
+Misura precisione e richiamo su un corpus etichettato (matching_corpus.json: traccia Spotify, candidati
+Navidrome e candidato corretto o null), confrontandoli con la selezione precedente (primo risultato o
+qualità migliore), e il numero di brani risolti al secondo contro una libreria sintetica indicizzata.
+
+Uso:
+    python benchmarks/bench_matching.py [--library 50000] [--queries 5000] [--min-precision 0.95]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PlaylistDownloader import PlaylistDownloader, isrc_match, evaluate_song_quality
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "matching_corpus.json")
+WORDS = ("love night heart fire dream light rain summer blue gold wild river black city road time sky home "
+         "stars ocean dance ghost honey storm paper glass silver midnight heaven angel shadow echo").split()
+VARIATIONS = (" - Remastered 2011", " (feat. Guest)", " - Radio Edit", "", "", "")
+
+
+class StubNavidrome:
+    def __init__(self, library):
+        self.library = library
+
+    def iter_library_songs(self, page_size):
+        yield from self.library
+
+
+def legacy_select(candidates: list, spotify_song: dict) -> dict:
+    """Selezione precedente: l'unico risultato, altrimenti gli ISRC uguali o la qualità migliore."""
+    if not candidates:
+        return {}
+    if len(candidates) == 1:
+        return candidates[0]
+    short_list = [song for song in candidates if isrc_match(spotify_song, song)]
+    return max(short_list or candidates, key=evaluate_song_quality)
+
+
+def evaluate(select, cases: list) -> dict:
+    """Precisione (corrispondenze accettate corrette) e richiamo (corrispondenze attese trovate)."""
+    accepted = correct = expected = 0
+    errors = []
+    for case in cases:
+        selected = select(case['candidates'], case['spotify'])
+        if case['expected']:
+            expected += 1
+        if selected:
+            accepted += 1
+            if selected['id'] == case['expected']:
+                correct += 1
+        if (selected or {}).get('id') != case['expected']:
+            errors.append(case['note'])
+    return {
+        "precision": correct / accepted if accepted else 1.0,
+        "recall": correct / expected if expected else 1.0,
+        "errors": errors,
+    }
+
+
+def synthetic_library(size: int, rng: random.Random) -> list:
+    library = []
+    for i in range(size):
+        library.append({
+            'id': f"nv{i}",
+            'title': " ".join(rng.sample(WORDS, rng.randint(2, 4))).title(),
+            'artist': f"Artist {rng.randrange(size // 20 or 1)}",
+            'album': f"Album {rng.randrange(size // 10 or 1)}",
+            'duration': rng.randint(120, 400),
+            'isrc': [],
+            'bitRate': 320,
+            'suffix': 'mp3',
+        })
+    return library
+
+
+def spotify_query(song: dict, rng: random.Random) -> dict:
+    return {
+        'name': song['title'] + rng.choice(VARIATIONS),
+        'artist': song['artist'],
+        'album': song['album'],
+        'duration': song['duration'] * 1000 + rng.randint(-1500, 1500),
+        'isrc': '',
+        'id': f"sp-{song['id']}",
+        'search_string': f"{song['artist']} - {song['title']}",
+    }
+
+
+def throughput(downloader: PlaylistDownloader, library: list, queries: int, rng: random.Random) -> dict:
+    """Risolve tracce presenti (con titoli variati) e assenti dalla libreria indicizzata."""
+    present = [(spotify_query(song, rng), song['id']) for song in rng.sample(library, min(queries, len(library)))]
+    # Same titles, but other artists, albums and durations
+    absent = [({**query, 'artist': f"{rng.choice(WORDS).title()} Band", 'album': f"Other Album {index}",
+                'duration': rng.randint(120, 400) * 1000, 'id': f"missing{index}"}, None)
+              for index, (query, _) in enumerate(present[:len(present) // 4])]
+    tracks = present + absent
+    rng.shuffle(tracks)
+    correct = accepted = 0
+    started = time.perf_counter()
+    for track, expected in tracks:
+        selected = downloader.select_song(downloader.library_index.lookup(track), track)
+        if selected:
+            accepted += 1
+            correct += selected['id'] == expected
+    elapsed = time.perf_counter() - started
+    return {"tracks": len(tracks), "seconds": elapsed, "per_second": len(tracks) / elapsed,
+            "precision": correct / accepted if accepted else 1.0,
+            "recall": correct / len(present) if present else 1.0}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--library", type=int, default=50000, help="Canzoni nella libreria sintetica")
+    parser.add_argument("--queries", type=int, default=5000, help="Tracce presenti da risolvere")
+    parser.add_argument("--min-precision", type=float, default=0.95, help="Precisione minima sul corpus")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    with open(CORPUS, encoding="utf-8") as f:
+        cases = json.load(f)
+    with tempfile.TemporaryDirectory() as state_dir:
+        rng = random.Random(args.seed)
+        library = synthetic_library(args.library, rng)
+        config = {
+            'config': {'state_db': os.path.join(state_dir, "bench.db")},
+            'spotify': {},
+            'navidrome': {'rescan_after_download': False},
+            'download': {'path': state_dir},
+        }
+        downloader = PlaylistDownloader(config, None, StubNavidrome(library))
+        downloader.refresh_library_index()
+
+        results = {"legacy": evaluate(legacy_select, cases), "matcher": evaluate(downloader.select_song, cases)}
+        print(f"Corpus: {len(cases)} casi")
+        for name, result in results.items():
+            print(f"  {name:<8} precisione {result['precision']:.3f}  richiamo {result['recall']:.3f}  "
+                  f"errori {len(result['errors'])}")
+        for note in results["matcher"]["errors"]:
+            print(f"    ✗ {note}")
+
+        speed = throughput(downloader, library, args.queries, rng)
+        print(f"Libreria sintetica di {args.library} brani: {speed['tracks']} tracce in {speed['seconds']:.2f}s "
+              f"({speed['per_second']:.0f}/s), precisione {speed['precision']:.3f}, richiamo {speed['recall']:.3f}")
+        downloader.state.close()
+
+    if results["matcher"]["precision"] < args.min_precision:
+        print(f"❌ Precisione sotto {args.min_precision}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
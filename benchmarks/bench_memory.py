@@ -0,0 +1,183 @@
+"""
+Benchmark della memoria di una sincronizzazione completa su librerie e playlist molto grandi.
+
+Per ogni dimensione N la libreria Navidrome simulata contiene N canzoni (con tutti i campi restituiti
+da OpenSubsonic) e le playlist Spotify N brani in totale, in playlist da --playlist-size. La sincronizzazione
+gira in un processo separato, così il picco di RSS misurato comprende solo il client e non i server simulati.
+Con --compare-dicts ogni dimensione viene ripetuta con tracce e canzoni come dizionari (il modello precedente
+ai record di TrackRecords), per confronto.
+
+Uso:
+    python benchmarks/bench_memory.py [--sizes 10000,50000,200000] [--playlist-size 5000] [--compare-dicts]
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_servers import FakeSpotifyServer, FakeSubsonicServer
+
+GENRES = ("Rock", "Pop", "Jazz", "Electronic", "Hip-Hop", "Classical", "Metal", "Folk")
+
+
+def navidrome_song(index: int) -> dict:
+    """Canzone come restituita da search3/getPlaylist, con i campi che il client non usa."""
+    artist_index, album_index = index % 4001, index // 11
+    return {
+        'id': f"{index:032x}", 'parent': f"{album_index:032x}", 'isDir': False,
+        'title': f"Song {index}", 'album': f"Album {album_index}", 'artist': f"Artist {artist_index}",
+        'track': index % 11 + 1, 'year': 1970 + index % 50, 'genre': GENRES[index % len(GENRES)],
+        'coverArt': f"al-{album_index:032x}", 'size': 7_800_000 + index % 1000, 'contentType': "audio/mpeg",
+        'suffix': "mp3", 'duration': 180 + index % 120, 'bitRate': 320, 'samplingRate': 44100,
+        'bitDepth': 0, 'channelCount': 2,
+        'path': f"Artist {artist_index}/Album {album_index}/{index % 11 + 1:02d} - Song {index}.mp3",
+        'discNumber': 1, 'created': "2024-05-01T10:00:00.000000000Z", 'albumId': f"{album_index:032x}",
+        'artistId': f"{artist_index:032x}", 'type': "music", 'mediaType': "song", 'isVideo': False,
+        'bpm': 0, 'comment': "", 'sortName': f"song {index}", 'musicBrainzId': "",
+        'isrc': [f"ISRC{index:08d}"] if index % 10 else [],
+        'genres': [{'name': GENRES[index % len(GENRES)]}],
+        'artists': [{'id': f"{artist_index:032x}", 'name': f"Artist {artist_index}"}],
+        'replayGain': {'trackGain': -7.5, 'albumGain': -8.1, 'trackPeak': 1.0, 'albumPeak': 1.0},
+    }
+
+def spotify_track(index: int) -> dict:
+    artist_index, album_index = index % 4001, index // 11
+    return {
+        'id': f"{index:022d}", 'name': f"Song {index}", 'duration_ms': (180 + index % 120) * 1000,
+        'artists': [{'name': f"Artist {artist_index}"}],
+        'album': {'name': f"Album {album_index}", 'release_date': f"{1970 + index % 50}-01-01"},
+        'external_ids': {'isrc': f"ISRC{index:08d}"} if index % 10 else {},
+    }
+
+def current_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+def peak_rss_mb() -> float:
+    """
+    Picco di RSS del processo (VmHWM). ru_maxrss non va bene: dopo fork ed exec conserva il picco
+    del processo padre, che qui contiene la libreria dei server simulati.
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def child(args):
+    """Sincronizza tutte le playlist contro i server indicati e stampa il picco di memoria in JSON."""
+    import requests
+    import spotipy
+    import Navidrome as navidrome_module
+    import Spotify as spotify_module
+    from Metrics import metrics
+    from Navidrome import Navidrome
+    from PlaylistDownloader import PlaylistDownloader
+    from RequestGovernor import RequestGovernor
+    from Spotify import Spotify
+
+    if args.dicts:
+        # Previous model: the JSON dictionaries of the responses
+        class DictSong:
+            @staticmethod
+            def from_dict(data):
+                return data
+        navidrome_module.NavidromeSong = DictSong
+        spotify_module.parse_track = legacy_parse_track
+
+    class MemorySpotify(Spotify):
+        def __init__(self, config):
+            self.config = config
+            self.logger = logging.getLogger("Spotify")
+            self.sp = spotipy.Spotify(auth="benchmark", requests_session=requests.Session())
+            self.sp.prefix = f"{args.spotify}/v1/"
+            self.governor = RequestGovernor("Spotify", config['spotify'], rate=10 ** 6, burst=10 ** 6)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = {
+            'config': {'state_db': os.path.join(work_dir, "state.db")},
+            'metrics': {'summary_file': None},
+            'spotify': {},
+            'navidrome': {'url': args.subsonic, 'username': "bench", 'password': "bench",
+                          'rescan_after_download': False, 'rate': 10 ** 6, 'burst': 10 ** 6},
+            'download': {'path': work_dir, 'selected_playlists': True},
+        }
+        downloader = PlaylistDownloader(config, MemorySpotify(config), Navidrome(config))
+        baseline = current_rss_mb()
+        started = time.perf_counter()
+        downloader.sync_all_playlists()
+        elapsed = time.perf_counter() - started
+        downloader.state.close()
+    peak = peak_rss_mb()
+    print(json.dumps({"baseline_mb": baseline, "peak_mb": peak, "seconds": elapsed,
+                      "added": metrics.last_summary["added"]}))
+
+def legacy_parse_track(track: dict) -> dict:
+    track_name = track['name']
+    artist_name = ', '.join([artist['name'] for artist in track['artists']])
+    return {
+        'name': track_name,
+        'isrc': track.get('external_ids', {}).get('isrc', ''),
+        'duration': track['duration_ms'],
+        'album': track['album']['name'],
+        'album_release_date': track['album'].get('release_date', ''),
+        'url': f"https://open.spotify.com/track/{track['id']}",
+        'artist': artist_name,
+        'id': track['id'],
+        'search_string': f"{artist_name} - {track_name}"
+    }
+
+def measure(size: int, playlist_size: int, dicts: bool) -> dict:
+    library = [navidrome_song(index) for index in range(size)]
+    playlists = []
+    for start in range(0, size, playlist_size):
+        playlists.append({'id': f"{start:022d}", 'name': f"Playlist {start // playlist_size}", 'snapshot_id': "v1",
+                          'tracks': [spotify_track(index) for index in range(start, min(size, start + playlist_size))]})
+    subsonic_server = FakeSubsonicServer(library).start()
+    spotify_server = FakeSpotifyServer(playlists).start()
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--child", "--subsonic", subsonic_server.url,
+                   "--spotify", spotify_server.url] + (["--dicts"] if dicts else [])
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    finally:
+        subsonic_server.stop()
+        spotify_server.stop()
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")],
+                        default=[10000, 50000, 200000], help="Brani (libreria e playlist), separati da virgola")
+    parser.add_argument("--playlist-size", type=int, default=5000, help="Brani per playlist")
+    parser.add_argument("--compare-dicts", action="store_true", help="Misura anche il modello a dizionari")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--dicts", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--subsonic", help=argparse.SUPPRESS)
+    parser.add_argument("--spotify", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.ERROR)
+    if args.child:
+        return child(args)
+    models = [False, True] if args.compare_dicts else [False]
+    for size in args.sizes:
+        for dicts in models:
+            result = measure(size, args.playlist_size, dicts)
+            print(f"{size:>7} brani ({'dizionari' if dicts else 'record'}): picco RSS {result['peak_mb']:7.1f} MB "
+                  f"(dopo gli import {result['baseline_mb']:.1f} MB), {result['seconds']:.1f}s, "
+                  f"{result['added']} brani aggiunti alle playlist")
+
+
+if __name__ == "__main__":
+    main()
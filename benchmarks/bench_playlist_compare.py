@@ -0,0 +1,123 @@
+"""
+Benchmark di regressione del confronto playlist Spotify/Navidrome.
+
+Misura compare_playlist_with_spotify e remove_duplicates_from_playlist su playlist sintetiche
+(nessuna richiesta di rete) e verifica che il tempo cresca in modo circa lineare.
+
+Uso:
+    python benchmarks/bench_playlist_compare.py [dimensioni...]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PlaylistDownloader import PlaylistDownloader, new_playlist_status
+
+# Rapporto massimo accettato tra tempo per brano della playlist più grande e della più piccola
+MAX_PER_TRACK_RATIO = 3.0
+
+
+class StubSpotify:
+    def __init__(self, tracks):
+        self.tracks = tracks
+
+    def iter_playlist_pages(self, playlist_info):
+        for start in range(0, len(self.tracks), 100):
+            yield self.tracks[start:start + 100]
+
+
+class StubNavidrome:
+    def __init__(self, library):
+        self.library = library
+
+    def submit(self, function, item):
+        future = Future()
+        future.set_result(function(item))
+        return future
+
+    def iter_library_songs(self, page_size):
+        yield from self.library
+
+    def search_this_song(self, song_info):
+        return []
+
+
+def spotify_track(i: int) -> dict:
+    # One track out of ten has no ISRC and must be resolved by artist/title
+    return {
+        'name': f"Song {i}",
+        'isrc': f"ISRC{i:08d}" if i % 10 else '',
+        'duration': 200000,
+        'album': f"Album {i // 12}",
+        'album_release_date': '',
+        'url': f"https://open.spotify.com/track/sp{i}",
+        'artist': f"Artist {i % 997}",
+        'id': f"sp{i}",
+        'search_string': f"Artist {i % 997} - Song {i}",
+    }
+
+
+def navidrome_song(i: int) -> dict:
+    return {
+        'id': f"nv{i}",
+        'title': f"Song {i}",
+        'artist': f"Artist {i % 997}",
+        'isrc': [f"ISRC{i:08d}"],
+        'bitRate': 320,
+        'suffix': 'mp3',
+    }
+
+
+def run(size: int, state_dir: str) -> float:
+    library = [navidrome_song(i) for i in range(size + size // 10)]
+    # Playlist: 90% of the Spotify tracks, a few duplicates and some songs removed from Spotify
+    entries = [library[i] for i in range(size) if i % 10 != 3] + library[:size // 100] + library[size:]
+    spotify_tracks = [spotify_track(i) for i in range(size)]
+    config = {
+        'config': {'state_db': os.path.join(state_dir, f"bench_{size}.db")},
+        'spotify': {},
+        'navidrome': {'rescan_after_download': False},
+        'download': {'path': state_dir},
+    }
+    downloader = PlaylistDownloader(config, StubSpotify(spotify_tracks), StubNavidrome(library))
+    downloader.refresh_library_index()
+    n_playlist_info = {'id': 'bench', 'name': 'bench', 'entry': entries}
+    playlist_status = new_playlist_status({'name': 'bench', 'tracks_total': size})
+
+    started = time.perf_counter()
+    playlist_status["to_remove"].extend(downloader.remove_duplicates_from_playlist(n_playlist_info))
+    downloader.compare_playlist_with_spotify(n_playlist_info, {'name': 'bench', 'id': 'bench'}, playlist_status)
+    elapsed = time.perf_counter() - started
+    downloader.state.close()
+
+    print(f"{size:>7} brani: {elapsed:7.3f}s ({elapsed / size * 1e6:6.1f} µs/brano) - "
+          f"add {len(playlist_status['to_add'])}, remove {len(playlist_status['to_remove'])}, "
+          f"keep {len(playlist_status['to_keep'])}, moved {playlist_status['moved']}")
+    return elapsed
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=[10_000, 50_000], help="Brani delle playlist misurate")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    with tempfile.TemporaryDirectory() as state_dir:
+        timings = {size: run(size, state_dir) for size in sorted(args.sizes)}
+    smallest, largest = min(timings), max(timings)
+    ratio = (timings[largest] / largest) / (timings[smallest] / smallest)
+    print(f"Rapporto tempo per brano {largest}/{smallest}: {ratio:.2f} (massimo {MAX_PER_TRACK_RATIO})")
+    if ratio > MAX_PER_TRACK_RATIO:
+        print("❌ Il confronto delle playlist non scala linearmente.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
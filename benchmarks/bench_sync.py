@@ -0,0 +1,209 @@
+"""
+Benchmark end-to-end di PlaylistDownloader.sync_all_playlists contro server Spotify e OpenSubsonic simulati.
+
+Riporta per ogni ciclo il tempo totale, le richieste per endpoint, il picco di memoria e il tempo medio
+di analisi per dimensione di playlist. Con --json il risultato viene salvato per confrontare esecuzioni diverse.
+
+Uso:
+    python benchmarks/bench_sync.py --library 20000 --sizes 100,500,2000 --latency-ms 5 --cycles 2
+    python benchmarks/bench_sync.py --config download.skip_unchanged=false --json run.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+import spotipy
+from fake_servers import FakeSpotifyServer, FakeSubsonicServer
+from Metrics import metrics
+from Navidrome import Navidrome
+from PlaylistDownloader import PlaylistDownloader
+from RequestGovernor import RequestGovernor
+from Spotify import Spotify
+
+
+class BenchSpotify(Spotify):
+    """Client Spotify collegato al server simulato; i download aggiungono il brano alla libreria simulata."""
+
+    def __init__(self, config: dict, spotify_server: FakeSpotifyServer, subsonic_server: FakeSubsonicServer):
+        self.config = config
+        self.logger = logging.getLogger("Spotify")
+        self.sp = spotipy.Spotify(auth="benchmark", requests_session=requests.Session())
+        self.sp.prefix = f"{spotify_server.url}/v1/"
+        self.governor = RequestGovernor("Spotify", config['spotify'], rate=10, burst=5)
+        self.subsonic_server = subsonic_server
+        self.downloads = 0
+
+    def search_songs(self, urls: list) -> list:
+        return [BenchSong(url) for url in urls]
+
+    def download_song(self, song, destination_path: str):
+        self.downloads += 1
+        self.subsonic_server.add_download(library_song(song.index))
+        return os.path.join(destination_path, f"{song.name}.mp3")
+
+
+class BenchSong:
+    def __init__(self, url: str):
+        self.url = url
+        self.index = int(url.rsplit("/", 1)[1])
+        self.name = f"Song {self.index}"
+        self.artist = f"Artist {self.index % 1009}"
+
+
+class BenchPlaylistDownloader(PlaylistDownloader):
+    """Registra il tempo di analisi di ogni playlist."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.playlist_timings = []
+
+    def analyse_playlist_difference(self, selected_playlist: dict, force: bool = False) -> dict:
+        started = time.perf_counter()
+        try:
+            return super().analyse_playlist_difference(selected_playlist, force)
+        finally:
+            self.playlist_timings.append((selected_playlist['tracks_total'], time.perf_counter() - started))
+
+
+def library_song(index: int) -> dict:
+    return {
+        'id': f"s{index}", 'title': f"Song {index}", 'artist': f"Artist {index % 1009}",
+        'album': f"Album {index // 12}", 'isrc': [f"ISRC{index:08d}"], 'duration': 200,
+        'bitRate': 320, 'suffix': 'mp3',
+    }
+
+def spotify_track(index: int, with_isrc: bool) -> dict:
+    return {
+        # Spotify IDs are 22 base62 characters
+        'id': f"{index:022d}", 'name': f"Song {index}", 'duration_ms': 200000,
+        'artists': [{'name': f"Artist {index % 1009}"}],
+        'album': {'name': f"Album {index // 12}", 'release_date': '2020-01-01'},
+        'external_ids': {'isrc': f"ISRC{index:08d}"} if with_isrc else {},
+    }
+
+def build_scenario(args) -> tuple:
+    """Crea la libreria simulata e le playlist Spotify (alcuni brani mancano dalla libreria)."""
+    library = [library_song(i) for i in range(args.library)]
+    playlists = []
+    cursor = 0
+    for size in args.sizes:
+        for copy in range(args.playlists_per_size):
+            tracks = []
+            for position in range(size):
+                # Overlapping playlists: every playlist shares half of its tracks with the previous one
+                index = (cursor + position) % args.library
+                if position % 20 == 19:
+                    # One track out of twenty is not in the library and has to be downloaded
+                    index = args.library + (cursor + position) % args.missing_pool
+                tracks.append(spotify_track(index, with_isrc=index % 10 != 0))
+            cursor += size // 2
+            playlists.append({'id': f"{size:011d}{copy:011d}", 'name': f"Playlist {size} #{copy}",
+                              'snapshot_id': "v1", 'tracks': tracks})
+    return library, playlists
+
+
+def run_cycle(downloader: BenchPlaylistDownloader, servers: list) -> dict:
+    before = [Counter(server.requests) for server in servers]
+    errors_before = sum(server.errors for server in servers)
+    downloads_before = downloader.spotify_client.downloads
+    downloader.playlist_timings = []
+    tracemalloc.start()
+    started = time.perf_counter()
+    downloader.sync_all_playlists()
+    wall_time = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    requests = Counter()
+    for server, counts in zip(servers, before):
+        requests.update(server.requests - counts)
+    per_size = {}
+    for size, elapsed in downloader.playlist_timings:
+        per_size.setdefault(size, []).append(elapsed)
+    return {
+        "wall_time": wall_time,
+        "peak_memory_mb": peak / 2 ** 20,
+        "requests": dict(sorted(requests.items())),
+        "total_requests": sum(requests.values()),
+        "errors": sum(server.errors for server in servers) - errors_before,
+        "downloads": downloader.spotify_client.downloads - downloads_before,
+        "playlist_time": {size: sum(times) / len(times) for size, times in sorted(per_size.items())},
+        "phases": metrics.last_summary["phases"],
+    }
+
+
+def print_cycle(number: int, result: dict):
+    print(f"\nCiclo {number}: {result['wall_time']:.2f}s, picco memoria {result['peak_memory_mb']:.1f} MB, "
+          f"{result['total_requests']} richieste ({result['errors']} errori simulati), "
+          f"{result['downloads']} download")
+    for endpoint, count in result["requests"].items():
+        print(f"  {endpoint:<20} {count:>7}")
+    for size, elapsed in result["playlist_time"].items():
+        print(f"  playlist da {size:>6} brani: {elapsed:.3f}s")
+    for phase, elapsed in result["phases"].items():
+        print(f"  fase {phase:<18} {elapsed:>7.3f}s")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--library", type=int, default=20000, help="Canzoni nella libreria Navidrome simulata")
+    parser.add_argument("--missing-pool", type=int, default=500, help="Brani Spotify assenti dalla libreria")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")],
+                        default=[100, 500, 2000], help="Dimensioni delle playlist, separate da virgola")
+    parser.add_argument("--playlists-per-size", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=5, help="Latenza aggiunta ad ogni richiesta")
+    parser.add_argument("--cycles", type=int, default=2)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Frazione di richieste a cui i server rispondono con 503")
+    parser.add_argument("--json", help="Salva i risultati in questo file")
+    parser.add_argument("--config", action="append", default=[], metavar="SEZIONE.CHIAVE=VALORE",
+                        help="Sovrascrive un'opzione di configurazione (valore JSON), es. navidrome.max_workers=8")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.WARNING)
+    library, playlists = build_scenario(args)
+    subsonic_server = FakeSubsonicServer(library, latency=args.latency_ms / 1000, error_rate=args.error_rate).start()
+    spotify_server = FakeSpotifyServer(playlists, latency=args.latency_ms / 1000, error_rate=args.error_rate).start()
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = {
+            'config': {'state_db': os.path.join(work_dir, "state.db")},
+            'metrics': {'summary_file': os.path.join(work_dir, "last_sync.json")},
+            'spotify': {},
+            'navidrome': {'url': subsonic_server.url, 'username': "bench", 'password': "bench",
+                          'scan_poll_interval': 0},
+            'download': {'path': work_dir, 'selected_playlists': True},
+        }
+        for override in args.config:
+            key, value = override.split("=", 1)
+            section, option = key.split(".", 1)
+            config.setdefault(section, {})[option] = json.loads(value)
+        spotify_client = BenchSpotify(config, spotify_server, subsonic_server)
+        navidrome_client = Navidrome(config)
+        downloader = BenchPlaylistDownloader(config, spotify_client, navidrome_client)
+        print(f"Libreria: {args.library} canzoni, playlist: {len(playlists)} "
+              f"({', '.join(str(size) for size in args.sizes)} brani), latenza {args.latency_ms} ms")
+        results = []
+        for number in range(1, args.cycles + 1):
+            results.append(run_cycle(downloader, [subsonic_server, spotify_server]))
+            print_cycle(number, results[-1])
+        downloader.state.close()
+    subsonic_server.stop()
+    spotify_server.stop()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"arguments": vars(args), "cycles": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Server locali che simulano OpenSubsonic (Navidrome) e la Web API di Spotify per i benchmark offline.
+
+Entrambi girano in un thread, aggiungono una latenza configurabile ad ogni richiesta, possono rispondere
+con errori 503 casuali (error_rate) e contano le richieste ricevute per endpoint.
+"""
+import json
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeServer:
+    """Server HTTP locale con latenza configurabile e contatori delle richieste."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = 0
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle(self, method: str, path: str, params: dict) -> tuple:
+        """Gestisce una richiesta e restituisce (codice HTTP, corpo JSON)."""
+        raise NotImplementedError
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.respond("GET", parse_qs(urlparse(self.path).query, keep_blank_values=True))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                params = parse_qs(urlparse(self.path).query, keep_blank_values=True)
+                body = self.rfile.read(length).decode("utf-8")
+                for key, values in parse_qs(body, keep_blank_values=True).items():
+                    params.setdefault(key, []).extend(values)
+                self.respond("POST", params)
+
+            def respond(self, method, params):
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.error_rate and random.random() < server.error_rate:
+                    with server.lock:
+                        server.errors += 1
+                    status, body = 503, {"error": {"status": 503, "message": "Service unavailable"}}
+                else:
+                    status, body = server.handle(method, urlparse(self.path).path, params)
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\W+", " ", text.casefold()).strip()
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+class FakeSubsonicServer(FakeServer):
+    """
+    Simula gli endpoint OpenSubsonic usati da Navidrome.py: search2, search3, getPlaylists, getPlaylist,
+    createPlaylist, updatePlaylist, startScan, getScanStatus e getOpenSubsonicExtensions.
+    """
+
+    def __init__(self, library: list, latency: float = 0.0, form_post: bool = True, error_rate: float = 0.0):
+        super().__init__(latency, error_rate)
+        self.form_post = form_post
+        self.songs = {}
+        self.by_query = {}
+        self.playlists = {}
+        # Songs written by the (fake) downloads, visible only after a scan
+        self.unscanned = []
+        for song in library:
+            self.add_song(song)
+
+    def add_song(self, song: dict):
+        self.songs[song['id']] = song
+        self.by_query.setdefault(normalize(f"{song['artist']} {song['title']}"), []).append(song)
+
+    def add_download(self, song: dict):
+        with self.lock:
+            self.unscanned.append(song)
+
+    def handle(self, method, path, params):
+        endpoint = path.rsplit("/", 1)[-1].removesuffix(".view")
+        with self.lock:
+            self.requests[endpoint] += 1
+            handler = getattr(self, f"api_{endpoint}", None)
+            if handler is None:
+                return 404, {"subsonic-response": {"status": "failed", "error": {"code": 0}}}
+            return 200, {"subsonic-response": {"status": "ok", "version": "1.16.1", **handler(params)}}
+
+    @staticmethod
+    def value(params, key, default=""):
+        return params.get(key, [default])[0]
+
+    def api_search2(self, params):
+        return {"searchResult2": {"song": self.by_query.get(normalize(self.value(params, "query")), [])}}
+
+    def api_search3(self, params):
+        songs = list(self.songs.values())
+        offset = int(self.value(params, "songOffset", 0))
+        count = int(self.value(params, "songCount", 20))
+        return {"searchResult3": {"song": songs[offset:offset + count]}}
+
+    def playlist_summary(self, playlist):
+        return {key: value for key, value in playlist.items() if key != "entry"} | {"songCount": len(playlist["entry"])}
+
+    def api_getPlaylists(self, params):
+        return {"playlists": {"playlist": [self.playlist_summary(p) for p in self.playlists.values()]}}
+
+    def api_getPlaylist(self, params):
+        playlist = self.playlists[self.value(params, "id")]
+        return {"playlist": self.playlist_summary(playlist) | {"entry": list(playlist["entry"])}}
+
+    def api_createPlaylist(self, params):
+        playlist_id = self.value(params, "playlistId") or f"pl{len(self.playlists) + 1}"
+        playlist = self.playlists.setdefault(playlist_id, {
+            "id": playlist_id, "name": self.value(params, "name"), "public": False, "entry": []
+        })
+        playlist["entry"] = [self.songs[song_id] for song_id in params.get("songId", [])]
+        playlist["changed"] = now_iso()
+        return {"playlist": self.playlist_summary(playlist) | {"entry": playlist["entry"]}}
+
+    def api_updatePlaylist(self, params):
+        playlist = self.playlists[self.value(params, "playlistId")]
+        if "public" in params:
+            playlist["public"] = self.value(params, "public") == "true"
+        removed = {int(index) for index in params.get("songIndexToRemove", [])}
+        entry = [song for index, song in enumerate(playlist["entry"]) if index not in removed]
+        entry.extend(self.songs[song_id] for song_id in params.get("songIdToAdd", []))
+        playlist["entry"] = entry
+        playlist["changed"] = now_iso()
+        return {}
+
+    def api_getOpenSubsonicExtensions(self, params):
+        extensions = [{"name": "formPost", "versions": [1]}] if self.form_post else []
+        return {"openSubsonic": True, "openSubsonicExtensions": extensions}
+
+    def api_startScan(self, params):
+        for song in self.unscanned:
+            self.add_song(song)
+        self.unscanned = []
+        return {"scanStatus": {"scanning": True, "count": len(self.songs)}}
+
+    def api_getScanStatus(self, params):
+        return {"scanStatus": {"scanning": False, "count": len(self.songs)}}
+
+
+class FakeSpotifyServer(FakeServer):
+    """Simula le API paginate di Spotify usate da Spotify.py (playlist dell'utente e relativi brani)."""
+
+    def __init__(self, playlists: list, latency: float = 0.0, page_size: int = 100, error_rate: float = 0.0):
+        super().__init__(latency, error_rate)
+        self.playlists = {playlist['id']: playlist for playlist in playlists}
+        self.page_size = page_size
+
+    def handle(self, method, path, params):
+        parts = path.strip("/").split("/")
+        limit = int(params.get("limit", [self.page_size])[0])
+        offset = int(params.get("offset", [0])[0])
+        with self.lock:
+            if parts[1:] == ["me", "playlists"]:
+                self.requests["me/playlists"] += 1
+                items = [self.playlist_object(playlist) for playlist in self.playlists.values()]
+            elif len(parts) == 4 and parts[1] == "playlists" and parts[3] in ("tracks", "items"):
+                self.requests["playlists/items"] += 1
+                items = [{"track": track} for track in self.playlists[parts[2]]["tracks"]]
+            else:
+                return 404, {"error": {"status": 404, "message": "Not found"}}
+        return 200, self.page(path, items, limit, offset)
+
+    def page(self, path, items, limit, offset):
+        next_url = None
+        if offset + limit < len(items):
+            next_url = f"{self.url}{path}?limit={limit}&offset={offset + limit}"
+        return {"items": items[offset:offset + limit], "total": len(items), "limit": limit,
+                "offset": offset, "next": next_url}
+
+    @staticmethod
+    def playlist_object(playlist):
+        return {"id": playlist['id'], "name": playlist['name'], "snapshot_id": playlist['snapshot_id'],
+                "tracks": {"total": len(playlist['tracks'])}}
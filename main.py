@@ -1,9 +1,39 @@
+import argparse
 import logging
 import os.path
+import signal
+import threading
+import time
 import tomllib
-from Navidrome import Navidrome
-from PlaylistDownloader import PlaylistDownloader
-from Spotify import Spotify
+from contextlib import contextmanager
+
+class StartupReport:
+    """
+    Misura il costo di import e inizializzazione dei componenti all'avvio, per tenerlo sotto controllo.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        """Misura la durata del blocco come fase name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def summary(self) -> str:
+        """Riassunto su una riga, ad esempio "Avvio in 0.42s: import client 0.30s, ..."."""
+        phases = ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in self.phases)
+        return f"Avvio in {time.perf_counter() - self.started:.2f}s: {phases}"
+
+    def print_table(self):
+        for name, elapsed in self.phases:
+            print(f"{name:<30} {elapsed:>7.3f}s")
+        print(f"{'totale':<30} {time.perf_counter() - self.started:>7.3f}s")
 
 def select_playlist(spotify_client, downloader):
     """
@@ -46,6 +76,149 @@ def sync_all_playlists(spotify_client, downloader):
         print(f"\n🎵 Sincronizzazione della playlist: {playlist['name']}")
         downloader.sync_this_playlist(playlist)
 
+def list_failures(config):
+    """
+    Mostra i brani che non è stato possibile scaricare e quando verranno riprovati.
+    """
+    from StateStore import StateStore
+    failures = StateStore(config).list_failures()
+    if not failures:
+        print("Nessun brano nella cache dei fallimenti.")
+    for failure in failures:
+        next_retry = time.strftime('%Y-%m-%d %H:%M', time.localtime(failure['next_retry']))
+        print(f"{failure['spotify_id']} - {failure['search_string']} "
+              f"[{failure['attempts']} tentativi, prossimo: {next_retry}] {failure['reason']}")
+
+def clear_failures(config, spotify_id: str):
+    """
+    Cancella un brano (o tutti, con 'all') dalla cache dei fallimenti, così da riprovarlo al prossimo ciclo.
+    """
+    from StateStore import StateStore
+    removed = StateStore(config).clear_failures(None if spotify_id == "all" else spotify_id)
+    print(f"Rimosse {removed} voci dalla cache dei fallimenti.")
+
+def request_sync(config, playlist: str):
+    """
+    Chiede al processo di sincronizzazione in esecuzione di sincronizzare subito una playlist (o tutte, con '*').
+    """
+    from StateStore import StateStore
+    StateStore(config).request_sync(playlist)
+    print(f"Sincronizzazione richiesta per: {'tutte le playlist' if playlist == '*' else playlist}")
+
+def account_config(config, name: str):
+    """
+    Configurazione dell'account indicato con --account (vedi AccountPool.account_configs), quella principale
+    se non indicato.
+    """
+    if not name:
+        return config
+    from AccountPool import account_configs
+    accounts = account_configs(config)
+    if name not in accounts:
+        raise SystemExit(f"Account non trovato: {name} (account configurati: {', '.join(accounts) or 'nessuno'})")
+    return accounts[name]
+
+def create_account_pool(config, accounts: dict):
+    """
+    Crea i client e il PlaylistDownloader di ogni account della sezione [[accounts]], con indice della libreria,
+    corrispondenze e download condivisi. Gli account condividono anche i limiti di frequenza delle richieste
+    verso lo stesso server Navidrome e, se usano la stessa applicazione (client_id), verso Spotify.
+    """
+    from AccountPool import AccountPool
+    from Navidrome import Navidrome
+    from PlaylistDownloader import PlaylistDownloader
+    from SharedLibrary import SharedLibrary
+    from Spotify import Spotify
+    clients = {name: (Spotify(account), Navidrome(account)) for name, account in accounts.items()}
+    spotify_client, navidrome_client = next(iter(clients.values()))
+    governors = {}
+    for name, (account_spotify, account_navidrome) in clients.items():
+        account_spotify.governor = governors.setdefault(accounts[name]['spotify']['client_id'], account_spotify.governor)
+        account_navidrome.governor = navidrome_client.governor
+        account_navidrome.executor = navidrome_client.executor
+    shared = SharedLibrary(config, spotify_client, navidrome_client)
+    return AccountPool(config, {name: PlaylistDownloader(accounts[name], *clients[name], shared) for name in accounts})
+
+def plan_sync(downloader, path: str):
+    """
+    Calcola senza modificare nulla cosa farebbe un ciclo di sincronizzazione e lo salva in path (NDJSON,
+    o JSON se path termina con .json; "-" per lo standard output), da applicare poi con --apply-plan.
+    """
+    from SyncPlan import write_plan
+    plan = downloader.plan_cycle()
+    write_plan(plan, path)
+    if path == "-":
+        return
+    for entry in plan:
+        state = "invariata" if entry["skipped"] else (f"+{len(entry['to_add'])} -{len(entry['to_remove'])}, "
+                                                      f"{len(entry['to_download'])} da scaricare "
+                                                      f"(~{entry['estimated_download_bytes'] / 2 ** 20:.0f} MB)")
+        print(f"{entry['name']}: {state}")
+    total = sum(entry["estimated_download_bytes"] for entry in plan)
+    print(f"📝 Piano salvato in {path}: {len(plan)} playlist, ~{total / 2 ** 20:.0f} MB da scaricare.")
+
+def apply_plan(downloader, path: str):
+    """
+    Applica un piano salvato con --plan, senza ripetere l'analisi delle playlist.
+    """
+    from SyncPlan import read_plan
+    synced = downloader.apply_plan(read_plan(path))
+    failed = [status["name"] for status in synced if status["failed"]]
+    print(f"✅ Piano applicato: {len(synced) - len(failed)} playlist sincronizzate.")
+    if failed:
+        print(f"❌ Playlist non aggiornate, da pianificare di nuovo: {', '.join(failed)}")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Sincronizza le playlist Spotify con Navidrome.")
+    parser.add_argument("--list-failures", action="store_true",
+                        help="Mostra i brani il cui download è fallito e quando verranno riprovati")
+    parser.add_argument("--clear-failures", metavar="SPOTIFY_ID", nargs="?", const="all",
+                        help="Cancella un brano (o tutti) dalla cache dei fallimenti")
+    parser.add_argument("--sync-now", metavar="PLAYLIST", nargs="?", const="*",
+                        help="Chiede al processo in esecuzione di sincronizzare subito una playlist (o tutte)")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Mostra il tempo di import e inizializzazione di ogni componente (incluso spotdl) ed esce")
+    parser.add_argument("--plan", metavar="FILE", nargs="?", const=os.path.join('Config', 'plan.ndjson'),
+                        help="Salva cosa farebbe un ciclo (brani da aggiungere, togliere e scaricare) senza eseguirlo")
+    parser.add_argument("--apply-plan", metavar="FILE",
+                        help="Applica un piano salvato con --plan")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Resta in esecuzione e accetta comandi dall'API HTTP locale (sezione [control])")
+    parser.add_argument("--account", metavar="NOME",
+                        help="Con più account ([[accounts]]): l'account a cui si riferiscono --sync-now, --plan e --apply-plan")
+    return parser.parse_args()
+
+def start_metrics_server(config):
+    """
+    Avvia il server delle metriche (/metrics in formato Prometheus, /summary con il riepilogo dell'ultimo ciclo)
+    se nella sezione [metrics] è indicata una porta.
+    """
+    options = config.get("metrics", {})
+    if not options.get("port"):
+        return None
+    from Metrics import MetricsServer, metrics
+    try:
+        return MetricsServer(metrics, options.get("host", "127.0.0.1"), options["port"]).start()
+    except OSError as e:
+        logging.error(f"Impossibile avviare il server delle metriche sulla porta {options['port']}: {e}")
+        return None
+
+def start_control_server(config, downloader, required: bool, pool=None):
+    """
+    Avvia l'API HTTP di controllo se richiesta (--daemon) o se nella sezione [control] è indicata una porta.
+    """
+    options = config.get("control", {})
+    if not required and not options.get("port"):
+        return None
+    from ControlServer import ControlServer
+    try:
+        return ControlServer(downloader, options, pool).start()
+    except OSError as e:
+        logging.error(f"Impossibile avviare l'API di controllo sulla porta {options.get('port', 8787)}: {e}")
+        if required:
+            raise
+        return None
+
 def silence_debug_libraries():
     """
     Silenzia i log delle librerie di terze parti per evitare clutter nei log.
@@ -58,8 +231,17 @@ def silence_debug_libraries():
 
 
 def main ():
-    with open(os.path.join('Config', 'config.toml'), 'rb') as f:
-        config = tomllib.load(f)
+    startup = StartupReport()
+    args = parse_arguments()
+    with startup.phase("config"):
+        with open(os.path.join('Config', 'config.toml'), 'rb') as f:
+            config = tomllib.load(f)
+    if args.list_failures:
+        return list_failures(config)
+    if args.clear_failures:
+        return clear_failures(config, args.clear_failures)
+    if args.sync_now:
+        return request_sync(account_config(config, args.account), args.sync_now)
     logging.basicConfig(
         level=config["config"].get("log_level", "INFO"),
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -67,15 +249,60 @@ def main ():
     )
     silence_debug_libraries()
     logging.info(f"Starting SpotifyImporter")
-    spotify_client = Spotify(config)
-    navidrome_client = Navidrome(config)
-    downloader = PlaylistDownloader(config, spotify_client, navidrome_client)
-    if not config["download"].get("selected_playlists", []):
+    # spotdl is not imported here: Spotify loads it on the first download
+    with startup.phase("import client"):
+        from AccountPool import account_configs
+        from Navidrome import Navidrome
+        from PlaylistDownloader import PlaylistDownloader
+        from Spotify import Spotify
+    accounts = account_configs(config)
+    pool = None
+    if accounts:
+        if args.account and args.account not in accounts:
+            raise SystemExit(f"Account non trovato: {args.account} (account configurati: {', '.join(accounts)})")
+        with startup.phase(f"account ({len(accounts)})"):
+            pool = create_account_pool(config, accounts)
+        downloader = pool.accounts[args.account] if args.account else pool.primary
+        spotify_client = downloader.spotify_client
+    else:
+        with startup.phase("Spotify"):
+            spotify_client = Spotify(config)
+        with startup.phase("Navidrome"):
+            navidrome_client = Navidrome(config)
+        with startup.phase("PlaylistDownloader"):
+            downloader = PlaylistDownloader(config, spotify_client, navidrome_client)
+    start_metrics_server(config)
+    logging.info(startup.summary())
+    if args.startup_report:
+        try:
+            with startup.phase("spotdl (al primo download)"):
+                spotify_client.load_downloader()
+        except Exception as e:
+            print(f"spotdl non disponibile: {e}")
+        return startup.print_table()
+    if (args.plan or args.apply_plan) and pool and not args.account:
+        raise SystemExit("Con più account indicare l'account da pianificare con --account")
+    if args.plan:
+        return plan_sync(downloader, args.plan)
+    if args.apply_plan:
+        return apply_plan(downloader, args.apply_plan)
+    if not pool and not args.daemon and not config["download"].get("selected_playlists", []) \
+            and not config["download"].get("liked_songs", False):
         logging.info(f"Manuale playlist selection enabled.")
         select_playlist(spotify_client, downloader)
     else:
         logging.info(f"Starting automatic playlist synchronization.")
-        downloader.sync()
+        # With several accounts the pool schedules the playlists of all of them
+        service = pool or downloader
+        # Without selected playlists the daemon only synchronizes the ones requested through the API
+        start_control_server(config, downloader, args.daemon, pool)
+        if hasattr(signal, "SIGUSR1"):
+            # kill -USR1 <pid> synchronizes every playlist immediately
+            signal.signal(signal.SIGUSR1, lambda signum, frame: (pool or downloader.scheduler).request_sync())
+        # SIGTERM (docker stop) drains the downloads in flight; the others resume at the next start.
+        # stop() takes locks that the interrupted main thread may hold, so it runs on its own thread
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=service.stop, name="stop").start())
+        service.sync()
         logging.info(f"Stopped automatic playlist synchronization.")
     logging.info(f"Finished SpotifyImporter")
     print(f"Finished SpotifyImporter")
@@ -0,0 +1,147 @@
+"""
+Client Spotify e Navidrome simulati in memoria, per i test della sincronizzazione senza rete.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from TrackRecords import NavidromeSong
+
+
+def spotify_track(index: int) -> dict:
+    return {'name': f"Song {index}", 'isrc': f"ISRC{index}", 'duration': 200000, 'album': "Album",
+            'album_release_date': "", 'url': f"https://open.spotify.com/track/t{index}",
+            'artist': f"Artist {index}", 'id': f"t{index}", 'search_string': f"Artist {index} - Song {index}"}
+
+def navidrome_song(index: int) -> dict:
+    return {'id': f"n{index}", 'title': f"Song {index}", 'artist': f"Artist {index}", 'isrc': [f"ISRC{index}"],
+            'bitRate': 320, 'suffix': "mp3"}
+
+
+class FakeSpotify:
+    """
+    Playlist Spotify in memoria: nome -> lista di tracce. I brani scaricati vengono aggiunti
+    alla libreria indicata (quella della FakeNavidrome), come dopo una scansione.
+    """
+
+    def __init__(self, playlists: dict, library: list = None):
+        self.playlists = playlists
+        self.snapshots = {name: "v1" for name in playlists}
+        self.library = library
+        self.downloaded = []
+
+    def list_user_playlists(self) -> list:
+        return [{'name': name, 'id': f"sp_{name}", 'tracks_total': len(tracks), 'snapshot_id': self.snapshots[name]}
+                for name, tracks in self.playlists.items()]
+
+    def iter_playlist_pages(self, playlist_info: dict):
+        tracks = self.playlists[playlist_info['name']]
+        for start in range(0, len(tracks), 2):
+            yield tracks[start:start + 2]
+
+    def search_songs(self, urls: list) -> list:
+        return [SimpleNamespace(url=url, name=url.rsplit("/", 1)[1], artist="Artist") for url in urls]
+
+    def download_song(self, song, destination_path: str) -> str:
+        index = int(song.url.rsplit("/t", 1)[1])
+        self.downloaded.append(index)
+        self.library.append(navidrome_song(index))
+        return os.path.join(destination_path, f"{index}.mp3")
+
+
+class FakeNavidrome:
+    """
+    Server Navidrome in memoria. Le prime fail_updates richieste di modifica delle playlist
+    (createPlaylist con playlistId, updatePlaylist) falliscono come farebbe il client reale, con {}.
+    """
+
+    def __init__(self, library: list):
+        self.library = library
+        self.playlists = {}
+        self.username = "user"
+        self.max_workers = 2
+        self.chunk_size = 50
+        self.fail_updates = 0
+        self.executor = ThreadPoolExecutor(self.max_workers)
+
+    def map(self, function, items: list) -> list:
+        return list(self.executor.map(function, items))
+
+    def submit(self, function, item):
+        return self.executor.submit(function, item)
+
+    def iter_library_songs(self, page_size: int = 500):
+        yield from map(NavidromeSong.from_dict, self.library)
+
+    def search_this_song(self, song_info: dict) -> list:
+        return [NavidromeSong.from_dict(song) for song in self.library if song['title'] == song_info['name']]
+
+    def search_songs(self, songs_info: list) -> list:
+        return [self.search_this_song(song_info) for song_info in songs_info]
+
+    def start_scan(self) -> bool:
+        return True
+
+    def get_scan_status(self) -> dict:
+        return {'scanning': False, 'count': len(self.library)}
+
+    def ids_per_request(self) -> int:
+        return self.chunk_size
+
+    def list_playlists(self) -> list:
+        return [{'id': playlist_id, 'name': playlist['name'], 'changed': playlist['changed'], 'owner': self.username}
+                for playlist_id, playlist in self.playlists.items()]
+
+    def get_playlist_info(self, playlist_id: str) -> dict:
+        playlist = self.playlists[playlist_id]
+        return {**playlist, 'entry': [NavidromeSong.from_dict(song) for song in playlist['entry']]}
+
+    def set_playlist_public(self, playlist_id: str, is_public: bool):
+        pass
+
+    def update_fails(self) -> bool:
+        if self.fail_updates:
+            self.fail_updates -= 1
+            return True
+        return False
+
+    def create_playlist(self, playlist_name: str, playlist_id: str = "", songs: list = None) -> dict:
+        if not playlist_id:
+            playlist_id = f"np{len(self.playlists)}"
+            self.playlists[playlist_id] = {'id': playlist_id, 'name': playlist_name, 'entry': [], 'changed': "0"}
+        elif self.update_fails():
+            return {}
+        self.set_entries(playlist_id, list(songs or []))
+        return {'subsonic-response': {'status': "ok", 'playlist': {'id': playlist_id, 'name': playlist_name}}}
+
+    def add_songs_to_playlist(self, playlist_id: str, songs_to_add: list, songs_to_remove: list) -> dict:
+        if not songs_to_add and not songs_to_remove:
+            return {}
+        if self.update_fails():
+            return {}
+        removed = set(songs_to_remove)
+        kept = [song['id'] for index, song in enumerate(self.playlists[playlist_id]['entry']) if index not in removed]
+        self.set_entries(playlist_id, kept + list(songs_to_add))
+        return {'subsonic-response': {'status': "ok"}}
+
+    def set_entries(self, playlist_id: str, song_ids: list):
+        songs = {song['id']: song for song in self.library}
+        playlist = self.playlists[playlist_id]
+        playlist['entry'] = [songs[song_id] for song_id in song_ids]
+        playlist['changed'] = str(int(playlist['changed']) + 1)
+
+    def entry_ids(self, playlist_id: str) -> list:
+        return [song['id'] for song in self.playlists[playlist_id]['entry']]
+
+
+@pytest.fixture
+def config(tmp_path) -> dict:
+    return {
+        'config': {'state_db': os.path.join(tmp_path, "state.db")},
+        'metrics': {'summary_file': None},
+        'spotify': {},
+        'navidrome': {'scan_poll_interval': 0},
+        'download': {'path': str(tmp_path), 'selected_playlists': True},
+    }
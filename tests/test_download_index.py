@@ -0,0 +1,43 @@
+import os
+
+from conftest import spotify_track
+from DownloadIndex import DownloadIndex
+from StateStore import StateStore
+
+
+def write_file(path: str):
+    with open(path, "wb") as f:
+        f.write(b"audio")
+
+
+def test_find_downloaded_file(config):
+    index = DownloadIndex(config, StateStore(config))
+    index.refresh(force=True)
+    path = os.path.join(config['download']['path'], "t1.mp3")
+    write_file(path)
+    index.add(path, spotify_track(1))
+    assert index.find(spotify_track(1)) == path
+    assert index.find(spotify_track(2)) is None
+
+
+def test_file_added_during_refresh_is_kept(config):
+    state = StateStore(config)
+    index = DownloadIndex(config, state)
+    root = config['download']['path']
+    write_file(os.path.join(root, "old.mp3"))
+    downloaded = os.path.join(root, "t1.mp3")
+
+    def read_tags(path):
+        # A download thread finishes while the folder is being walked
+        write_file(downloaded)
+        index.add(downloaded, spotify_track(1))
+        return {'spotify_id': None, 'isrc': None}
+
+    index.read_tags = read_tags
+    index.refresh(force=True)
+    assert index.find(spotify_track(1)) == downloaded
+    assert downloaded in state.list_local_files()
+    # Recognised by the next refresh without reading its tags again
+    index.read_tags = None
+    index.refresh(force=True)
+    assert index.find(spotify_track(1)) == downloaded
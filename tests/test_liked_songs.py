@@ -0,0 +1,80 @@
+import pytest
+
+from conftest import spotify_track
+from LikedSongs import LikedSongs
+from StateStore import StateStore
+
+
+class SavedTracks:
+    """Brani salvati su Spotify, dal più recente, con il numero di pagine lette."""
+
+    def __init__(self, count: int):
+        self.items = [(f"2024-01-01T00:{index // 60:02d}:{index % 60:02d}Z", spotify_track(index))
+                      for index in reversed(range(count))]
+        self.requests = 0
+
+    def saved_tracks_page(self, offset: int = 0, limit: int = 50) -> dict:
+        self.requests += 1
+        return {'total': len(self.items), 'items': self.items[offset:offset + limit]}
+
+    def remove(self, *indices: int):
+        removed = {spotify_track(index)['id'] for index in indices}
+        self.items = [item for item in self.items if item[1]['id'] not in removed]
+
+    def ids(self) -> list:
+        return [track['id'] for _, track in self.items]
+
+
+@pytest.fixture
+def liked(config):
+    def make(count: int) -> tuple:
+        spotify = SavedTracks(count)
+        liked_songs = LikedSongs(config, spotify, StateStore(config))
+        liked_songs.page_size = 4
+        liked_songs.playlist()
+        return liked_songs, spotify
+    return make
+
+
+def current_ids(liked_songs: LikedSongs) -> list:
+    return [track['id'] for page in liked_songs.iter_pages() for track in page]
+
+
+@pytest.mark.parametrize("removed", [(0,), (99,), (0, 99), (50,), (10, 11, 12)])
+def test_find_removed(liked, removed):
+    liked_songs, spotify = liked(100)
+    spotify.remove(*removed)
+    found = liked_songs.find_removed(list(liked_songs.tracks), 0, len(removed))
+    assert sorted(found) == sorted(spotify_track(index)['id'] for index in removed)
+
+
+def test_removal_at_the_edges_is_found_by_bisection(liked):
+    liked_songs, spotify = liked(100)
+    # The first item of the feed (most recent) and the last one (oldest)
+    spotify.remove(99, 0)
+    spotify.requests = 0
+    liked_songs.playlist()
+    assert current_ids(liked_songs) == spotify.ids()
+    # Far fewer requests than reading the 25 pages again
+    assert spotify.requests < 25
+
+
+def test_new_and_removed_tracks(liked):
+    liked_songs, spotify = liked(30)
+    spotify.remove(5)
+    spotify.items.insert(0, ("2025-01-01T00:00:00Z", spotify_track(500)))
+    liked_songs.playlist()
+    assert current_ids(liked_songs) == spotify.ids()
+    assert [track['id'] for _, track in liked_songs.state.list_liked_tracks()] == spotify.ids()
+
+
+def test_dry_run_does_not_save(liked):
+    liked_songs, spotify = liked(20)
+    saved = liked_songs.state.list_liked_tracks()
+    spotify.items.insert(0, ("2025-01-01T00:00:00Z", spotify_track(500)))
+    planned = liked_songs.playlist(persist=False)
+    assert current_ids(liked_songs)[0] == "t500"
+    assert liked_songs.state.list_liked_tracks() == saved
+    # The real run still sees the new track and gets the same snapshot as the plan
+    assert liked_songs.playlist() == planned
+    assert liked_songs.state.list_liked_tracks()[0][1]['id'] == "t500"
@@ -0,0 +1,70 @@
+import random
+
+import requests
+
+from Navidrome import Navidrome, split_playlist_update
+
+
+def apply_batches(playlist: list, batches: list) -> list:
+    """Applica le richieste una dopo l'altra, come updatePlaylist: prima le rimozioni per indice, poi le aggiunte."""
+    playlist = list(playlist)
+    for to_add, to_remove in batches:
+        removed = set(to_remove)
+        playlist = [song for index, song in enumerate(playlist) if index not in removed] + to_add
+    return playlist
+
+
+def test_removals_are_descending_across_chunks():
+    batches = split_playlist_update([], [3, 10, 1, 7, 5], 2)
+    assert batches == [([], [10, 7]), ([], [5, 3]), ([], [1])]
+
+
+def test_additions_fill_the_last_removal_request():
+    batches = split_playlist_update(["a", "b", "c"], [1, 5, 3], 2)
+    assert batches == [([], [5, 3]), (["a"], [1]), (["b", "c"], [])]
+
+
+def test_repeated_indices_are_removed_once():
+    assert split_playlist_update([], [2, 2, 0], 5) == [([], [2, 0])]
+
+
+def test_nothing_to_change():
+    assert split_playlist_update([], [], 10) == []
+
+
+def test_batches_match_a_single_update():
+    generator = random.Random(7)
+    playlist = [f"s{index}" for index in range(40)]
+    for chunk_size in (1, 3, 7, 100):
+        to_remove = generator.sample(range(len(playlist)), 15)
+        to_add = [f"new{index}" for index in range(9)]
+        batches = split_playlist_update(to_add, to_remove, chunk_size)
+        assert all(len(add) + len(remove) <= chunk_size for add, remove in batches)
+        expected = [song for index, song in enumerate(playlist) if index not in set(to_remove)] + to_add
+        assert apply_batches(playlist, batches) == expected
+
+
+class AppliedThenTimedOut:
+    """Sessione HTTP che applica ogni richiesta ma non fa arrivare la risposta (ReadTimeout)."""
+
+    def __init__(self):
+        self.requests = []
+        self.entries = []
+
+    def get(self, url: str, params: dict = None, timeout: float = None):
+        self.requests.append(url)
+        if url.endswith("/rest/updatePlaylist.view"):
+            self.entries.extend(params["songIdToAdd"])
+        raise requests.ReadTimeout("Read timed out")
+
+
+def test_playlist_update_is_not_repeated_after_a_read_timeout():
+    navidrome = Navidrome({'navidrome': {'url': "http://navidrome", 'username': "user", 'password': "password",
+                                         'form_post': False, 'retry_base': 0, 'circuit_threshold': 0}})
+    navidrome.session = AppliedThenTimedOut()
+    # The update may have been applied: repeating it would add the songs twice
+    assert navidrome.add_songs_to_playlist("np0", ["n1", "n2"], []) == {}
+    assert navidrome.session.entries == ["n1", "n2"]
+    # Reads are still retried
+    assert navidrome.get_playlist_info("np0") == {}
+    assert len(navidrome.session.requests) == 1 + 1 + navidrome.governor.max_retries
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from conftest import FakeNavidrome, FakeSpotify, navidrome_song, spotify_track
+from PlaylistDiff import edit_script, ordered_ids, rewrite_requests, update_requests
+from PlaylistDownloader import PlaylistDownloader
+
+
+def is_subsequence(songs: list, playlist: list) -> bool:
+    remaining = iter(playlist)
+    return all(song in remaining for song in songs)
+
+def apply(current: list, to_remove: list, to_add: list) -> list:
+    removed = set(to_remove)
+    return [song for index, song in enumerate(current) if index not in removed] + to_add
+
+
+@pytest.mark.parametrize("current, target, expected", [
+    # Unchanged
+    (["a", "b", "c"], ["a", "b", "c"], ([], [])),
+    # Insert in the middle: the songs after it move to the end
+    (["a", "b", "c"], ["a", "x", "b", "c"], ([1, 2], ["x", "b", "c"])),
+    # Append
+    (["a", "b"], ["a", "b", "c"], ([], ["c"])),
+    # Delete
+    (["a", "b", "c", "d"], ["a", "c", "d"], ([1], [])),
+    # Move the first song to the end
+    (["a", "b", "c"], ["b", "c", "a"], ([0], ["a"])),
+    # Reverse
+    (["a", "b", "c"], ["c", "b", "a"], ([0, 1], ["b", "a"])),
+    # Duplicates in the playlist
+    (["a", "a", "b", "b"], ["a", "b"], ([1, 3], [])),
+    # Empty playlist
+    ([], ["a", "b"], ([], ["a", "b"])),
+])
+def test_edit_script(current, target, expected):
+    assert edit_script(current, target) == expected
+    assert apply(current, *edit_script(current, target)) == target
+
+
+def test_edit_script_reaches_the_target():
+    generator = random.Random(3)
+    for _ in range(200):
+        songs = [f"s{index}" for index in range(20)]
+        current = generator.choices(songs, k=generator.randint(0, 25))
+        target = generator.sample(songs, generator.randint(0, 20))
+        to_remove, to_add = edit_script(current, target)
+        assert apply(current, to_remove, to_add) == target
+        # Minimal: keeping one more song of the target is impossible
+        kept = len(target) - len(to_add)
+        assert kept == len(target) or not is_subsequence(target[:kept + 1], current)
+
+
+def test_ordered_ids():
+    assert ordered_ids(["a", None, "b", "a", "", "c", "b"]) == ["a", "b", "c"]
+
+
+def test_request_counts():
+    assert update_requests([], [], 10) == 0
+    assert update_requests([5, 4, 3], ["a", "b"], 10) == 1
+    assert update_requests(list(range(15)), [], 10) == 2
+    assert rewrite_requests([], 10) == 1
+    assert rewrite_requests(list(range(25)), 10) == 3
+
+
+def test_playlist_follows_the_spotify_order(config):
+    library = [navidrome_song(index) for index in range(20)]
+    navidrome = FakeNavidrome(library)
+    navidrome.chunk_size = 5
+    spotify = FakeSpotify({"Road": [spotify_track(index) for index in range(10)]})
+    downloader = PlaylistDownloader(config, spotify, navidrome)
+    downloader.sync_all_playlists()
+    tracks = spotify.playlists["Road"]
+    tracks.insert(3, spotify_track(15))
+    tracks.append(tracks.pop(0))
+    del tracks[5]
+    spotify.snapshots["Road"] = "v2"
+    downloader.sync_all_playlists()
+    assert navidrome.entry_ids("np0") == [f"n{track['id'][1:]}" for track in tracks]
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from conftest import FakeNavidrome, FakeSpotify, navidrome_song, spotify_track
+from PlaylistDownloader import PlaylistDownloader
+from PlaylistScheduler import PlaylistScheduler
+from StateStore import StateStore
+
+PLAYLIST = {'id': "sp_Road", 'name': "Road", 'snapshot_id': "v1"}
+
+
+@pytest.fixture
+def scheduler(config) -> PlaylistScheduler:
+    config['download'].update(min_interval=10, max_interval=60)
+    return PlaylistScheduler(config, StateStore(config))
+
+
+def test_failures_back_off_exponentially(scheduler):
+    now = 1000.0
+    delays = [scheduler.schedule_failure(PLAYLIST, now) - now for _ in range(4)]
+    for delay, interval in zip(delays, (600, 1200, 2400, 3600)):
+        assert interval * 0.9 <= delay <= interval
+    assert scheduler.state.get_playlist_state("sp_Road")["failures"] == 4
+
+
+def test_failed_playlist_waits_for_the_backoff(scheduler):
+    now = 1000.0
+    next_due = scheduler.schedule_failure(PLAYLIST, now)
+    # Never synchronized: without the backoff it would be due at every tick
+    due, _ = scheduler.due_playlists([PLAYLIST], set(), now + 60)
+    assert due == []
+    assert scheduler.next_wake == next_due
+    due, _ = scheduler.due_playlists([PLAYLIST], set(), next_due)
+    assert due == [PLAYLIST]
+    # A sync request does not wait
+    due, _ = scheduler.due_playlists([PLAYLIST], {"Road"}, now + 60)
+    assert due == [PLAYLIST]
+
+
+def test_success_resets_the_failures(scheduler):
+    scheduler.schedule_failure(PLAYLIST, 1000.0)
+    status = {"skipped": False, "to_add": [], "to_remove": [], "downloaded": []}
+    scheduler.schedule(PLAYLIST, status, 2000.0)
+    assert scheduler.state.get_playlist_state("sp_Road")["failures"] == 0
+
+
+def test_failed_update_sets_next_wake(config):
+    navidrome = FakeNavidrome([navidrome_song(index) for index in range(5)])
+    spotify = FakeSpotify({"Road": [spotify_track(index) for index in range(5)]})
+    downloader = PlaylistDownloader(config, spotify, navidrome)
+    navidrome.fail_updates = 1
+    downloader.sync_all_playlists(scheduled=True)
+    assert downloader.scheduler.next_wake is not None
+    assert not downloader.scheduler.something_due(set())
+    assert downloader.state.get_playlist_state("sp_Road")["failures"] == 1
+
+
+def test_no_playlists_waits_for_min_interval(scheduler):
+    now = time.time()
+    assert scheduler.due_playlists([], set(), now) == ([], set())
+    assert scheduler.next_wake == now + scheduler.min_interval
+    # The playlists are not listed again at every tick
+    assert not scheduler.something_due(set())
+    assert scheduler.something_due({"Road"})
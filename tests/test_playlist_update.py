@@ -0,0 +1,113 @@
+import threading
+
+from conftest import FakeNavidrome, FakeSpotify, navidrome_song, spotify_track
+from Metrics import metrics
+from PlaylistDownloader import PlaylistDownloader
+
+
+def make_downloader(config, tracks: int = 10):
+    navidrome = FakeNavidrome([navidrome_song(index) for index in range(tracks)])
+    spotify = FakeSpotify({"Road": [spotify_track(index) for index in range(tracks)]})
+    return PlaylistDownloader(config, spotify, navidrome), navidrome
+
+
+def test_failed_update_is_retried_at_next_cycle(config):
+    downloader, navidrome = make_downloader(config)
+    navidrome.fail_updates = 1
+    downloader.sync_all_playlists()
+    assert navidrome.entry_ids("np0") == []
+    assert downloader.state.get_playlist_state("sp_Road")["snapshot_id"] is None
+    assert metrics.last_summary["added"] == 0
+
+    downloader.sync_all_playlists()
+    assert navidrome.entry_ids("np0") == [f"n{index}" for index in range(10)]
+    assert metrics.last_summary["skipped"] == 0
+
+    downloader.sync_all_playlists()
+    assert metrics.last_summary["skipped"] == 1
+
+
+def test_failed_update_is_reported(config):
+    downloader, navidrome = make_downloader(config)
+    navidrome.fail_updates = 1
+    downloader.navidrome_playlists = navidrome.list_playlists()
+    playlist = downloader.spotify_client.list_user_playlists()[0]
+    status = downloader.analyse_playlist_difference(playlist)
+    assert status["failed"]
+    assert status["to_add"] == [] and status["to_remove"] == []
+
+
+def test_successful_update_saves_snapshot(config):
+    downloader, navidrome = make_downloader(config)
+    downloader.sync_all_playlists()
+    stored = downloader.state.get_playlist_state("sp_Road")
+    assert stored["snapshot_id"] == "v1"
+    assert stored["navidrome_changed"] == navidrome.playlists["np0"]["changed"]
+
+
+def test_failed_link_keeps_downloaded_songs_pending(config):
+    library = [navidrome_song(index) for index in range(3)]
+    navidrome = FakeNavidrome(library)
+    spotify = FakeSpotify({"Road": [spotify_track(index) for index in range(4)]}, library)
+    downloader = PlaylistDownloader(config, spotify, navidrome)
+    # The first update creates the playlist content, the second one (linking the download) fails
+    original = navidrome.add_songs_to_playlist
+    calls = []
+    def add_songs_to_playlist(playlist_id, songs_to_add, songs_to_remove):
+        calls.append(songs_to_add)
+        return {} if len(calls) == 2 else original(playlist_id, songs_to_add, songs_to_remove)
+    navidrome.add_songs_to_playlist = add_songs_to_playlist
+    downloader.sync_all_playlists()
+    assert spotify.downloaded == [3]
+    assert navidrome.entry_ids("np0") == ["n0", "n1", "n2"]
+    assert downloader.state.get_playlist_state("sp_Road")["pending"] == 1
+
+    downloader.sync_all_playlists()
+    assert navidrome.entry_ids("np0") == ["n0", "n1", "n2", "n3"]
+    assert spotify.downloaded == [3]
+    assert downloader.state.get_playlist_state("sp_Road")["pending"] == 0
+
+
+def test_failed_plan_entry_is_reported_and_retried(config):
+    downloader, navidrome = make_downloader(config)
+    downloader.sync_all_playlists()
+    spotify = downloader.spotify_client
+    spotify.playlists["Road"].reverse()
+    spotify.snapshots["Road"] = "v2"
+    plan = downloader.plan_cycle()
+    navidrome.fail_updates = 1
+    [status] = downloader.apply_plan(plan)
+    assert status["failed"]
+    assert navidrome.entry_ids("np0") == [f"n{index}" for index in range(10)]
+    assert downloader.state.get_playlist_state("sp_Road")["snapshot_id"] is None
+
+    downloader.sync_all_playlists()
+    assert navidrome.entry_ids("np0") == [f"n{index}" for index in reversed(range(10))]
+
+
+def test_download_shared_by_isrc_is_linked_to_every_playlist(config):
+    library = [navidrome_song(index) for index in range(3)]
+    navidrome = FakeNavidrome(library)
+    # The same recording under another Spotify ID in the second playlist
+    other_release = dict(spotify_track(3), id="t3b")
+    spotify = FakeSpotify({"A": [spotify_track(index) for index in range(4)],
+                           "B": [spotify_track(0), other_release, spotify_track(1), spotify_track(2)]}, library)
+    downloader = PlaylistDownloader(config, spotify, navidrome)
+    # The download ends after both playlists have been analysed, so B waits for the download started by A
+    analysed = threading.Event()
+    analyse, download_song = downloader.analyse_playlist_difference, spotify.download_song
+    def analyse_playlist_difference(playlist, force=False):
+        status = analyse(playlist, force)
+        if playlist['name'] == "B":
+            analysed.set()
+        return status
+    def delayed_download(song, destination_path):
+        analysed.wait(5)
+        return download_song(song, destination_path)
+    downloader.analyse_playlist_difference, spotify.download_song = analyse_playlist_difference, delayed_download
+    downloader.sync_all_playlists()
+    assert spotify.downloaded == [3]
+    assert navidrome.entry_ids("np0") == ["n0", "n1", "n2", "n3"]
+    assert navidrome.entry_ids("np1") == ["n0", "n3", "n1", "n2"]
+    assert downloader.state.get_playlist_state("sp_B")["pending"] == 0
+    assert metrics.last_summary["added"] == 8
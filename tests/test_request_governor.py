@@ -0,0 +1,194 @@
+import pytest
+import requests
+import urllib3
+
+import RequestGovernor as governor_module
+from RequestGovernor import (CircuitBreaker, CircuitOpenError, RequestGovernor, TokenBucket, classify_error,
+                             never_sent, parse_retry_after)
+
+
+class Clock:
+    """Sostituisce time.monotonic e time.sleep: il tempo avanza solo con sleep."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(governor_module.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(governor_module.time, "sleep", clock.sleep)
+    return clock
+
+
+class HTTPStatusError(Exception):
+    """Errore con stato HTTP e intestazioni, come spotipy.SpotifyException."""
+
+    def __init__(self, http_status: int, headers: dict = None):
+        super().__init__(f"HTTP {http_status}")
+        self.http_status = http_status
+        self.headers = headers or {}
+
+
+def test_token_bucket_allows_a_burst_then_waits(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_token_bucket_pause(clock):
+    bucket = TokenBucket(rate=0)
+    bucket.pause(4)
+    bucket.acquire()
+    assert sum(clock.sleeps) == pytest.approx(4)
+
+
+def test_circuit_breaker_open_half_open_closed(clock):
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    assert not breaker.record_failure()
+    assert breaker.allow()
+    # Open
+    assert breaker.record_failure()
+    assert not breaker.allow()
+    clock.now += 29
+    assert not breaker.allow()
+    # Half-open: a single probe
+    clock.now += 1
+    assert breaker.allow()
+    assert not breaker.allow()
+    # Closed after a successful probe
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+    assert breaker.failures == 0
+
+
+def test_circuit_breaker_failed_probe_opens_again(clock):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.allow()
+
+
+def test_governor_retries_transient_errors(clock):
+    governor = RequestGovernor("Test", {"max_retries": 3, "retry_base": 1, "retry_max": 8}, rate=0)
+    results = iter([requests.ConnectionError(), HTTPStatusError(503), "ok"])
+
+    def request():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert governor.call(request) == "ok"
+    assert len(clock.sleeps) == 2
+    assert governor.circuit.failures == 0
+
+
+def test_governor_honours_retry_after(clock):
+    governor = RequestGovernor("Test", {"retry_max": 30}, rate=0)
+    calls = []
+
+    def request():
+        calls.append(clock.now)
+        if len(calls) == 1:
+            raise HTTPStatusError(429, {"Retry-After": "7"})
+        return "ok"
+
+    assert governor.call(request) == "ok"
+    assert calls[1] - calls[0] == pytest.approx(7)
+    # The pause applies to every request of the service
+    assert governor.bucket.paused_until == pytest.approx(calls[0] + 7)
+
+
+def test_governor_does_not_retry_client_errors(clock):
+    governor = RequestGovernor("Test", {}, rate=0)
+
+    def request():
+        raise HTTPStatusError(404)
+
+    with pytest.raises(HTTPStatusError):
+        governor.call(request)
+    assert clock.sleeps == []
+    assert governor.circuit.failures == 0
+
+
+def test_governor_rejects_requests_while_open(clock):
+    governor = RequestGovernor("Test", {"max_retries": 0, "circuit_threshold": 1, "circuit_reset": 60}, rate=0)
+
+    def request():
+        raise requests.Timeout()
+
+    with pytest.raises(requests.Timeout):
+        governor.call(request)
+    with pytest.raises(CircuitOpenError):
+        governor.call(request)
+    clock.now += 60
+    assert governor.call(lambda: "ok") == "ok"
+
+
+def refused() -> requests.ConnectionError:
+    error = urllib3.exceptions.NewConnectionError(None, "Connection refused")
+    return requests.ConnectionError(urllib3.exceptions.MaxRetryError(None, "/rest/updatePlaylist.view", error))
+
+
+def test_governor_retries_writes_only_if_never_sent(clock):
+    governor = RequestGovernor("Test", {"max_retries": 3}, rate=0)
+    results = iter([requests.ConnectTimeout(), refused(), "ok"])
+
+    def request():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert governor.call(request, idempotent=False) == "ok"
+    for error in (requests.ReadTimeout(), requests.ConnectionError(), HTTPStatusError(503)):
+        calls = []
+
+        def request():
+            calls.append(error)
+            raise error
+
+        with pytest.raises(type(error)):
+            governor.call(request, idempotent=False)
+        assert len(calls) == 1
+
+
+def test_never_sent():
+    assert never_sent(requests.ConnectTimeout())
+    assert never_sent(refused())
+    assert not never_sent(requests.ReadTimeout())
+    assert not never_sent(requests.ConnectionError("Connection aborted"))
+    assert not never_sent(HTTPStatusError(503))
+
+
+def test_classify_error():
+    assert classify_error(requests.ConnectionError()) == (True, None)
+    assert classify_error(HTTPStatusError(500)) == (True, None)
+    assert classify_error(HTTPStatusError(429, {"Retry-After": "3"})) == (True, 3.0)
+    assert classify_error(HTTPStatusError(400)) == (False, None)
+    assert classify_error(ValueError()) == (False, None)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("12") == 12.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("not a date") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
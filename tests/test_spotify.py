@@ -0,0 +1,34 @@
+import json
+import os
+
+import pytest
+
+from Spotify import Spotify
+
+OLD_SCOPE = "playlist-read-private playlist-read-collaborative"
+
+
+@pytest.fixture
+def spotify_config(config, tmp_path) -> dict:
+    cache_path = os.path.join(tmp_path, ".cache")
+    with open(cache_path, "w") as f:
+        json.dump({'access_token': "token", 'refresh_token': "refresh", 'expires_at': 2 ** 40,
+                   'scope': OLD_SCOPE, 'token_type': "Bearer"}, f)
+    config['spotify'].update(client_id="id", client_secret="secret", redirect_uri="http://127.0.0.1:8888/callback",
+                             cache_path=cache_path)
+    return config
+
+
+def test_liked_songs_scope_only_when_enabled(spotify_config, capsys):
+    client = Spotify(spotify_config)
+    assert "user-library-read" not in client.sp.auth_manager.scope
+    # The token cached before Liked Songs existed is still valid
+    assert client.sp.auth_manager.validate_token(client.sp.auth_manager.cache_handler.get_cached_token())
+    assert "autorizzazione" not in capsys.readouterr().out
+
+
+def test_liked_songs_scope_requires_new_authorization(spotify_config, capsys):
+    spotify_config['download']['liked_songs'] = True
+    client = Spotify(spotify_config)
+    assert "user-library-read" in client.sp.auth_manager.scope
+    assert "autorizzazione" in capsys.readouterr().out